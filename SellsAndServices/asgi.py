@@ -1,7 +1,6 @@
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter, URLRouter, ChannelNameRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SellsAndServices.settings')
@@ -9,14 +8,16 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SellsAndServices.settings')
 django_asgi_app = get_asgi_application()
 
 import chats.routing, chat_bot.routing
+from users.middleware import JWTAuthMiddlewareStack
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
-        AuthMiddlewareStack(
+        JWTAuthMiddlewareStack(
             URLRouter(
                 chat_bot.routing.websocket_urlpatterns + chats.routing.websocket_urlpatterns,
             )
         )
     ),
+    "channel": ChannelNameRouter(chats.routing.channel_routes),
 })
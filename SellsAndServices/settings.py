@@ -63,11 +63,60 @@ TEMPLATES = [
 WSGI_APPLICATION = 'SellsAndServices.wsgi.application'
 ASGI_APPLICATION = 'SellsAndServices.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+REDIS_URL = os.getenv('REDIS_URL')
+
+CHAT_SEND_QUEUE_LIMIT = int(os.getenv('CHAT_SEND_QUEUE_LIMIT', '100'))
+
+CHATBOT_ANSWER_CACHE = os.getenv('CHATBOT_ANSWER_CACHE', 'chatbot')
+CHATBOT_ANSWER_CACHE_TTL = int(os.getenv('CHATBOT_ANSWER_CACHE_TTL', '86400'))
+CHATBOT_ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('CHATBOT_ANSWER_CACHE_MAX_ENTRIES', '1000'))
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                'capacity': CHAT_SEND_QUEUE_LIMIT,
+            },
+        }
+    }
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        # Shared by every worker. Run Redis with an LRU maxmemory-policy
+        # (e.g. allkeys-lru) so the least recently asked answers go first.
+        'chatbot': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'chatbot',
+            'TIMEOUT': CHATBOT_ANSWER_CACHE_TTL,
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {
+                'capacity': CHAT_SEND_QUEUE_LIMIT,
+            },
+        }
+    }
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'chatbot': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'chatbot',
+            'TIMEOUT': CHATBOT_ANSWER_CACHE_TTL,
+            'OPTIONS': {
+                'MAX_ENTRIES': CHATBOT_ANSWER_CACHE_MAX_ENTRIES,
+            },
+        },
     }
-}
 
 DATABASES = {
     'default': {
@@ -187,3 +236,69 @@ CORS_EXPOSE_HEADERS = [
 CORS_PREFLIGHT_MAX_AGE = 86400
 
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL') or None
+
+CHATBOT_LLM_BACKEND = os.getenv('CHATBOT_LLM_BACKEND', 'groq')
+CHATBOT_STUB_RECORDINGS = os.getenv('CHATBOT_STUB_RECORDINGS') or None
+CHATBOT_STUB_FIRST_TOKEN_MS = float(os.getenv('CHATBOT_STUB_FIRST_TOKEN_MS', '200'))
+CHATBOT_STUB_TOKEN_MS = float(os.getenv('CHATBOT_STUB_TOKEN_MS', '20'))
+CHATBOT_STUB_ANSWER_TOKENS = int(os.getenv('CHATBOT_STUB_ANSWER_TOKENS', '20'))
+CHATBOT_STUB_RECORDED_TIMING = os.getenv('CHATBOT_STUB_RECORDED_TIMING', 'False') == 'True'
+
+CHATBOT_LLM_CONNECT_TIMEOUT = float(os.getenv('CHATBOT_LLM_CONNECT_TIMEOUT', '5'))
+CHATBOT_LLM_READ_TIMEOUT = float(os.getenv('CHATBOT_LLM_READ_TIMEOUT', '30'))
+CHATBOT_LLM_POOL_TIMEOUT = float(os.getenv('CHATBOT_LLM_POOL_TIMEOUT', '10'))
+CHATBOT_LLM_MAX_RETRIES = int(os.getenv('CHATBOT_LLM_MAX_RETRIES', '2'))
+CHATBOT_LLM_MAX_CONNECTIONS = int(os.getenv('CHATBOT_LLM_MAX_CONNECTIONS', '100'))
+CHATBOT_LLM_MAX_KEEPALIVE = int(os.getenv('CHATBOT_LLM_MAX_KEEPALIVE', '100'))
+CHATBOT_LLM_KEEPALIVE_EXPIRY = float(os.getenv('CHATBOT_LLM_KEEPALIVE_EXPIRY', '60'))
+
+CHATBOT_LLM_MAX_IN_FLIGHT = int(os.getenv('CHATBOT_LLM_MAX_IN_FLIGHT', '8'))
+CHATBOT_LLM_CLUSTER_MAX_IN_FLIGHT = int(os.getenv('CHATBOT_LLM_CLUSTER_MAX_IN_FLIGHT', '0'))
+CHATBOT_LLM_CLUSTER_LEASE = int(os.getenv('CHATBOT_LLM_CLUSTER_LEASE', '120'))
+CHATBOT_LLM_CLUSTER_POLL_MS = int(os.getenv('CHATBOT_LLM_CLUSTER_POLL_MS', '200'))
+CHATBOT_USER_TOKEN_QUOTA = int(os.getenv('CHATBOT_USER_TOKEN_QUOTA', '50000'))
+CHATBOT_USER_TOKEN_WINDOW = int(os.getenv('CHATBOT_USER_TOKEN_WINDOW', '3600'))
+
+CHATBOT_KEYWORDS_FILE = os.getenv('CHATBOT_KEYWORDS_FILE') or None
+
+CHATBOT_RETRIEVAL_ANSWER_CONFIDENCE = float(os.getenv('CHATBOT_RETRIEVAL_ANSWER_CONFIDENCE', '0.45'))
+CHATBOT_RETRIEVAL_ANSWER_MARGIN = float(os.getenv('CHATBOT_RETRIEVAL_ANSWER_MARGIN', '2'))
+CHATBOT_RETRIEVAL_CONTEXT_CONFIDENCE = float(os.getenv('CHATBOT_RETRIEVAL_CONTEXT_CONFIDENCE', '0.2'))
+CHATBOT_RETRIEVAL_CONTEXT_PASSAGES = int(os.getenv('CHATBOT_RETRIEVAL_CONTEXT_PASSAGES', '3'))
+CHATBOT_RETRIEVAL_CONTEXT_CHARS = int(os.getenv('CHATBOT_RETRIEVAL_CONTEXT_CHARS', '1200'))
+
+CHATBOT_FLEET_SNAPSHOT_TTL = int(os.getenv('CHATBOT_FLEET_SNAPSHOT_TTL', '300'))
+CHATBOT_INTENT_LIST_LIMIT = int(os.getenv('CHATBOT_INTENT_LIST_LIMIT', '5'))
+
+CHATBOT_HISTORY_TOKENS = int(os.getenv('CHATBOT_HISTORY_TOKENS', '1500'))
+CHATBOT_HISTORY_SUMMARY_TOKENS = int(os.getenv('CHATBOT_HISTORY_SUMMARY_TOKENS', '200'))
+CHATBOT_SESSION_TTL_DAYS = int(os.getenv('CHATBOT_SESSION_TTL_DAYS', '30'))
+
+CHAT_FRAME_COALESCE_MS = int(os.getenv('CHAT_FRAME_COALESCE_MS', '5'))
+
+CHAT_CONNECTION_RATE = float(os.getenv('CHAT_CONNECTION_RATE', '5'))
+CHAT_CONNECTION_BURST = int(os.getenv('CHAT_CONNECTION_BURST', '10'))
+CHAT_USER_RATE = float(os.getenv('CHAT_USER_RATE', '10'))
+CHAT_USER_BURST = int(os.getenv('CHAT_USER_BURST', '20'))
+CHAT_THROTTLE_MAX_STRIKES = int(os.getenv('CHAT_THROTTLE_MAX_STRIKES', '20'))
+CHAT_THROTTLE_STRIKE_WINDOW = int(os.getenv('CHAT_THROTTLE_STRIKE_WINDOW', '60'))
+
+CHAT_PRESENCE_TTL = int(os.getenv('CHAT_PRESENCE_TTL', '60'))
+CHAT_TYPING_DEBOUNCE = int(os.getenv('CHAT_TYPING_DEBOUNCE', '3'))
+
+CHAT_BROADCAST_CHUNK_SIZE = int(os.getenv('CHAT_BROADCAST_CHUNK_SIZE', '500'))
+CHAT_BROADCAST_SEND_BATCH = int(os.getenv('CHAT_BROADCAST_SEND_BATCH', '100'))
+CHAT_BROADCAST_PAUSE_MS = int(os.getenv('CHAT_BROADCAST_PAUSE_MS', '50'))
+CHAT_BROADCAST_STALE_SECONDS = int(os.getenv('CHAT_BROADCAST_STALE_SECONDS', '300'))
+
+WS_USER_CACHE_TTL = int(os.getenv('WS_USER_CACHE_TTL', '60'))
+
+CHAT_ARCHIVE_ROOT = os.getenv('CHAT_ARCHIVE_ROOT', str(BASE_DIR / 'chat_archive'))
+CHAT_RETENTION_DAYS = int(os.getenv('CHAT_RETENTION_DAYS', '180'))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.getenv('CHAT_ARCHIVE_BATCH_SIZE', '1000'))
+
+CHAT_ASSIGNMENT_BACKLOG_WEIGHT = float(os.getenv('CHAT_ASSIGNMENT_BACKLOG_WEIGHT', '0.5'))
+CHAT_ASSIGNMENT_OFFLINE_GRACE = int(os.getenv('CHAT_ASSIGNMENT_OFFLINE_GRACE', '120'))
+CHAT_ASSIGNMENT_REBALANCE_LIMIT = int(os.getenv('CHAT_ASSIGNMENT_REBALANCE_LIMIT', '200'))
+CHAT_LOAD_COUNTER_TTL = int(os.getenv('CHAT_LOAD_COUNTER_TTL', '3600'))
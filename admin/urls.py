@@ -7,7 +7,10 @@ from .views import (
     AllUsersView,
     UserSearchView,
     AllServicesView,
-    AllSellsView
+    AllSellsView,
+    ChatResponseTimeView,
+    ChatRoomResponseTimeView,
+    ChatbotAnswerCacheView
 )
 
 urlpatterns = [
@@ -19,4 +22,7 @@ urlpatterns = [
     path('users/search/', UserSearchView.as_view(), name='user-search'),
     path('services/', AllServicesView.as_view(), name='all-services'),
     path('sells/', AllSellsView.as_view(), name='all-sells'),
+    path('chat/response-times/', ChatResponseTimeView.as_view(), name='chat-response-times'),
+    path('chat/response-times/rooms/', ChatRoomResponseTimeView.as_view(), name='chat-room-response-times'),
+    path('chatbot/answer-cache/', ChatbotAnswerCacheView.as_view(), name='chatbot-answer-cache'),
 ]
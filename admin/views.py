@@ -3,12 +3,18 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAdminUser, AllowAny
 from rest_framework.pagination import PageNumberPagination
+from datetime import timedelta
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.contrib.auth import get_user_model
+from django.db.models import Count, Min
 from .models import PrivacyPolicy, TermsAndConditions, AboutUs
 from .serializers import PrivacyPolicySerializer, TermsAndConditionsSerializer, AboutUsSerializer
 from main.models import Service, Sell
 from main.serializers import ServiceSerializer, SellSerializer
+from chats.models import ChatRoom, ChatResponseDaily
+from chats.sla import merge_days, summarize
+from chat_bot.answers import answer_cache_stats, reset_answer_cache_stats
 from users.serializers import CustomUserSerializer
 
 CustomUser = get_user_model()
@@ -359,3 +365,115 @@ class AllSellsView(APIView):
         serializer = SellSerializer(paginated_sells, many=True)
         
         return paginator.get_paginated_response(serializer.data)
+
+def query_date(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(f'{name} is not a date')
+    return day
+
+class ChatResponseTimeView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        try:
+            end = query_date(request.query_params, 'end') or timezone.localdate()
+            start = query_date(request.query_params, 'start') or end - timedelta(days=29)
+            admin_id = request.query_params.get('admin_id')
+            admin_id = int(admin_id) if admin_id else None
+        except ValueError:
+            return Response({'error': 'start and end must be dates (YYYY-MM-DD) and admin_id an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({'error': 'start must not be after end'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        days = ChatResponseDaily.objects.filter(date__gte=start, date__lte=end)
+        waiting = ChatRoom.objects.filter(is_active=True, awaiting_reply_since__isnull=False)
+        if admin_id:
+            days = days.filter(admin_id=admin_id)
+            waiting = waiting.filter(admin_id=admin_id)
+        
+        totals = merge_days(days.values('admin_id', 'kind', 'bucket', 'count', 'total_seconds', 'max_seconds'))
+        backlog = {
+            row['admin']: row
+            for row in waiting.order_by().values('admin').annotate(rooms=Count('id'), oldest=Min('awaiting_reply_since'))
+        }
+        
+        now = timezone.now()
+        admins = CustomUser.objects.in_bulk({admin for admin, _ in totals} | set(backlog))
+        results = []
+        for admin in sorted(admins.values(), key=lambda admin: admin.email):
+            waiting_rooms = backlog.get(admin.id)
+            results.append({
+                'admin': {
+                    'id': admin.id,
+                    'email': admin.email,
+                    'first_name': admin.first_name,
+                    'last_name': admin.last_name
+                },
+                'replies': summarize(totals.get((admin.id, 'reply'))),
+                'first_responses': summarize(totals.get((admin.id, 'first_response'))),
+                'backlog': {
+                    'waiting_rooms': waiting_rooms['rooms'] if waiting_rooms else 0,
+                    'oldest_waiting_seconds': round((now - waiting_rooms['oldest']).total_seconds()) if waiting_rooms else None
+                }
+            })
+        
+        return Response({
+            'start': start,
+            'end': end,
+            'admins': results
+        }, status=status.HTTP_200_OK)
+
+class ChatRoomResponseTimeView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        try:
+            page_size = max(min(int(request.query_params.get('page_size', 10)), 100), 1)
+            admin_id = request.query_params.get('admin_id')
+            admin_id = int(admin_id) if admin_id else None
+        except ValueError:
+            return Response({'error': 'page_size and admin_id must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # The room counters cover the room's whole lifetime; per-period
+        # numbers come from ChatResponseTimeView.
+        rooms = ChatRoom.objects.filter(is_active=True).select_related('user', 'admin')
+        if admin_id:
+            rooms = rooms.filter(admin_id=admin_id)
+        if request.query_params.get('waiting_only', '').lower() in ('1', 'true'):
+            rooms = rooms.filter(awaiting_reply_since__isnull=False).order_by('awaiting_reply_since')
+        else:
+            rooms = rooms.order_by('-last_message_at')
+        
+        paginator = PageNumberPagination()
+        paginator.page_size = page_size
+        paginated_rooms = paginator.paginate_queryset(rooms, request)
+        
+        now = timezone.now()
+        return paginator.get_paginated_response([
+            {
+                'id': room.id,
+                'subject': room.subject,
+                'user_email': room.user.email,
+                'admin_email': room.admin.email,
+                'awaiting_reply_since': room.awaiting_reply_since,
+                'waiting_seconds': round((now - room.awaiting_reply_since).total_seconds()) if room.awaiting_reply_since else None,
+                'first_response_seconds': room.first_response_seconds,
+                'reply_count': room.reply_count,
+                'avg_reply_seconds': round(room.reply_seconds_total / room.reply_count, 1) if room.reply_count else None
+            }
+            for room in paginated_rooms
+        ])
+
+class ChatbotAnswerCacheView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        return Response(answer_cache_stats(), status=status.HTTP_200_OK)
+    
+    def delete(self, request):
+        reset_answer_cache_stats()
+        return Response({'message': 'Answer cache metrics reset'}, status=status.HTTP_200_OK)
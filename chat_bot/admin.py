@@ -1,3 +1,13 @@
 from django.contrib import admin
+from .models import ChatBotSession
 
-
+@admin.register(ChatBotSession)
+class ChatBotSessionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'turn_count', 'token_count', 'created_at', 'updated_at']
+    search_fields = ['user__email']
+    readonly_fields = ['id', 'created_at', 'updated_at']
+    ordering = ['-updated_at']
+    
+    def turn_count(self, obj):
+        return len(obj.turns)
+    turn_count.short_description = 'Turns'
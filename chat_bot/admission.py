@@ -0,0 +1,197 @@
+import uuid
+import random
+import asyncio
+import weakref
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from chats.throttling import TokenBucket
+
+
+def cluster_slot_key(slot):
+    return f"chatbot_llm_slot_{slot}"
+
+
+def acquire_cluster_slot(token):
+    # Each slot is a cache key taken with add(), which is atomic on Redis.
+    # Slots expire after CHATBOT_LLM_CLUSTER_LEASE seconds, so a worker that
+    # dies mid-generation cannot leak one.
+    keys = [cluster_slot_key(slot) for slot in range(settings.CHATBOT_LLM_CLUSTER_MAX_IN_FLIGHT)]
+    taken = cache.get_many(keys)
+    free = [key for key in keys if key not in taken]
+    random.shuffle(free)
+    for key in free:
+        if cache.add(key, token, settings.CHATBOT_LLM_CLUSTER_LEASE):
+            return key
+    return None
+
+
+def release_cluster_slot(key, token):
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+class Waiter:
+    def __init__(self, key, notify):
+        self.key = key
+        self.notify = notify
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.position = None
+        self.slot = None
+        self.token = None
+
+
+class AdmissionController:
+    # Generations are admitted up to CHATBOT_LLM_MAX_IN_FLIGHT at a time.
+    # Everyone else waits in a per-user FIFO and users are served round
+    # robin, so one user with many sockets cannot crowd out the others. A
+    # consumer handles one message at a time, so the queue never holds more
+    # than one entry per open socket.
+    def __init__(self):
+        self.queues = OrderedDict()
+        self.waiting = 0
+        self.in_flight = 0
+        self.changed = asyncio.Event()
+        self.dispatcher = None
+        self.tasks = set()
+
+    def background(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def enqueue(self, key, notify):
+        waiter = Waiter(key, notify)
+        self.queues.setdefault(key, deque()).append(waiter)
+        self.waiting += 1
+        self.wake()
+        return waiter
+
+    def withdraw(self, waiter):
+        queue = self.queues.get(waiter.key)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                del self.queues[waiter.key]
+            self.wake()
+
+    def next_waiter(self):
+        key, queue = next(iter(self.queues.items()))
+        waiter = queue.popleft()
+        self.waiting -= 1
+        if queue:
+            self.queues.move_to_end(key)
+        else:
+            del self.queues[key]
+        return waiter
+
+    def release(self, waiter):
+        self.in_flight -= 1
+        if waiter.slot is not None:
+            self.background(sync_to_async(release_cluster_slot, thread_sensitive=False)(waiter.slot, waiter.token))
+        self.wake()
+
+    def wake(self):
+        self.changed.set()
+        if self.dispatcher is None and self.waiting:
+            self.dispatcher = asyncio.ensure_future(self.dispatch())
+
+    async def dispatch(self):
+        try:
+            while self.waiting:
+                self.changed.clear()
+                cluster_full = await self.admit()
+                self.announce_positions()
+                if not self.waiting:
+                    break
+                if cluster_full:
+                    # Other workers free cluster slots without telling us.
+                    try:
+                        await asyncio.wait_for(self.changed.wait(), settings.CHATBOT_LLM_CLUSTER_POLL_MS / 1000)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self.changed.wait()
+        finally:
+            self.dispatcher = None
+
+    async def admit(self):
+        while self.waiting and self.in_flight < settings.CHATBOT_LLM_MAX_IN_FLIGHT:
+            slot = None
+            token = uuid.uuid4().hex
+            if settings.CHATBOT_LLM_CLUSTER_MAX_IN_FLIGHT:
+                slot = await sync_to_async(acquire_cluster_slot, thread_sensitive=False)(token)
+                if slot is None:
+                    return True
+                if not self.waiting:
+                    await sync_to_async(release_cluster_slot, thread_sensitive=False)(slot, token)
+                    break
+            waiter = self.next_waiter()
+            waiter.slot = slot
+            waiter.token = token
+            self.in_flight += 1
+            waiter.admitted.set_result(None)
+        return False
+
+    def announce_positions(self):
+        # Positions follow the round-robin order the queue will be served in.
+        position = 0
+        depth = 0
+        queues = list(self.queues.values())
+        while position < self.waiting:
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    waiter = queue[depth]
+                    if waiter.position != position:
+                        waiter.position = position
+                        self.background(waiter.notify(position))
+            depth += 1
+
+
+_controllers = weakref.WeakKeyDictionary()
+
+
+def get_controller():
+    loop = asyncio.get_running_loop()
+    controller = _controllers.get(loop)
+    if controller is None:
+        controller = _controllers[loop] = AdmissionController()
+    return controller
+
+
+@asynccontextmanager
+async def llm_slot(key, notify):
+    controller = get_controller()
+    waiter = controller.enqueue(key, notify)
+    try:
+        await waiter.admitted
+    except asyncio.CancelledError:
+        if waiter.admitted.cancelled():
+            controller.withdraw(waiter)
+        else:
+            controller.release(waiter)
+        raise
+    try:
+        yield
+    finally:
+        controller.release(waiter)
+
+
+def token_quota(key):
+    return TokenBucket(
+        f"chatbot_token_quota_{key}",
+        settings.CHATBOT_USER_TOKEN_QUOTA / settings.CHATBOT_USER_TOKEN_WINDOW,
+        settings.CHATBOT_USER_TOKEN_QUOTA,
+    )
+
+
+def reserve_tokens(key, tokens):
+    return token_quota(key).consume(tokens)
+
+
+def charge_tokens(key, tokens):
+    token_quota(key).consume(tokens, force=True)
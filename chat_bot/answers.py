@@ -0,0 +1,90 @@
+import re
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from .prompts import CHATBOT_MODEL, SYSTEM_PROMPT
+
+STOP_WORDS = {
+    "a", "an", "the", "i", "im", "me", "my", "mine", "we", "our", "us", "you", "your",
+    "it", "its", "is", "are", "am", "was", "were", "be", "been", "do", "does", "did",
+    "can", "could", "would", "should", "will", "shall", "may", "might", "to", "of",
+    "for", "please", "pls", "plz", "just", "some", "any", "there", "here", "this", "that",
+    "hi", "hello", "hey", "thanks", "thank", "tushar", "bot",
+}
+
+# Answers written under another system prompt or model are never served:
+# changing either moves every key to a new namespace, and the old entries
+# age out through the TTL or the backend's LRU eviction.
+ANSWER_CACHE_VERSION = hashlib.sha1(f"{CHATBOT_MODEL}\n{SYSTEM_PROMPT}".encode()).hexdigest()[:12]
+
+METRIC_KEYS = {
+    "hits": "chatbot_answer_cache_hits",
+    "misses": "chatbot_answer_cache_misses",
+    "stores": "chatbot_answer_cache_stores",
+    "retrieved": "chatbot_answer_retrieved",
+    "routed": "chatbot_answer_routed",
+    "cancelled_stop": "chatbot_generation_cancelled_stop",
+    "cancelled_superseded": "chatbot_generation_cancelled_superseded",
+    "cancelled_disconnect": "chatbot_generation_cancelled_disconnect",
+}
+
+
+def answer_cache():
+    return caches[settings.CHATBOT_ANSWER_CACHE]
+
+
+def normalize_prompt(prompt):
+    words = re.sub(r"[^\w\s]", "", prompt.lower()).split()
+    return " ".join(word for word in words if word not in STOP_WORDS)
+
+
+def answer_key(prompt, context=""):
+    normalized = normalize_prompt(prompt)
+    if not normalized:
+        return None
+    # The retrieved context is part of the key, so editing the policy or
+    # about text it came from retires the answers built on it.
+    digest = hashlib.sha1(f"{normalized}\n{context}".encode()).hexdigest()
+    return f"chatbot_answer_{ANSWER_CACHE_VERSION}_{digest}"
+
+
+def count(metric):
+    cache = answer_cache()
+    key = METRIC_KEYS[metric]
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, None)
+
+
+def get_cached_answer(prompt, context=""):
+    key = answer_key(prompt, context)
+    if key is None:
+        return None
+    answer = answer_cache().get(key)
+    count("hits" if answer is not None else "misses")
+    return answer
+
+
+def store_answer(prompt, answer, context=""):
+    key = answer_key(prompt, context)
+    if key is None:
+        return
+    answer_cache().set(key, answer, settings.CHATBOT_ANSWER_CACHE_TTL)
+    count("stores")
+
+
+def answer_cache_stats():
+    values = answer_cache().get_many(METRIC_KEYS.values())
+    stats = {metric: values.get(key, 0) for metric, key in METRIC_KEYS.items()}
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+    stats["cancelled"] = stats["cancelled_stop"] + stats["cancelled_superseded"] + stats["cancelled_disconnect"]
+    stats["version"] = ANSWER_CACHE_VERSION
+    stats["ttl"] = settings.CHATBOT_ANSWER_CACHE_TTL
+    return stats
+
+
+def reset_answer_cache_stats():
+    answer_cache().delete_many(METRIC_KEYS.values())
@@ -1,158 +1,44 @@
-import os
+import uuid
 import asyncio
-from django.conf import settings
-from groq import Groq
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-import json
-
-def _get_groq_client():
-    api_key = settings.GROQ_API_KEY or os.getenv("GROQ_API_KEY")
-    if not api_key:
-        raise RuntimeError("GROQ_API_KEY is not set")
-    return Groq(api_key=api_key)
-
-ALLOWED_KEYWORDS = [
-
-    "hello", "hi", "greetings", "hey", "good morning", "good afternoon", "good evening",
-    
-
-    "thank you", "thanks", "appreciate", "grateful", "much obliged", "thankful", "cheers",
-    
-
-    "how", "what", "when", "where", "why", "who", "which", "can", "could", "would", "should",
-    
-
-    "exit", "quit", "bye", "goodbye", "see you", "later",
-    
-
-    "sellnservice", "sells and services", "sellsandservices", "platform", "app", "application",
-    
-
-    "vehicle", "car", "truck", "auto", "automobile", "unit", "fleet", "vin",
-    "brand", "model", "year", "mileage", "honda", "toyota", "ford", "chevrolet",
-    "purchase", "bought", "own", "owned", "inventory", "stock",
-    
-
-    "active", "sold", "inactive", "in service", "available", "status",
-    
-
-    "service", "maintenance", "repair", "fix", "appointment", "schedule",
-    "mechanic", "garage", "workshop", "oil change", "tire", "brake", "inspection",
-    "scheduled", "in progress", "completed", "cancelled", "cost", "price",
-    
-
-    "sell", "sale", "selling", "buyer", "purchase", "buy", "buying",
-    "payment", "transaction", "deal", "sold", "revenue", "profit",
-    
-
-    "account", "profile", "register", "login", "logout", "password", "email",
-    "verify", "verification", "otp", "reset", "forgot", "user", "authentication",
-    
-
-    "chat", "message", "talk", "speak", "communicate", "support", "help",
-    "admin", "contact", "question", "ask", "answer", "reply",
-    
-
-    "feature", "function", "capability", "option", "setting", "configuration",
-    "upload", "image", "photo", "picture", "media", "file",
-    
-
-    "help", "support", "guide", "tutorial", "how to", "instruction",
-    "privacy", "policy", "terms", "conditions", "about",
-    
-
-    "create", "add", "new", "update", "edit", "modify", "delete", "remove",
-    "view", "see", "show", "display", "list", "search", "find",
-    
-
-    "customer", "client", "dealer", "business", "manage", "management",
-    "track", "tracking", "record", "history", "report", "data",
-    
-
-    "location", "address", "where", "zip", "code", "city", "state",
-    
-
-    "date", "time", "today", "tomorrow", "yesterday", "week", "month", "year",
-    "appointment", "schedule", "calendar",
-]
-
-def is_on_topic(prompt):
-    prompt_lower = prompt.lower()
-    return any(keyword in prompt_lower for keyword in ALLOWED_KEYWORDS)
-
-async def get_ai_response(prompt, conversation_history=None):
-    import asyncio
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, test_openai_api, prompt, conversation_history or [])
-
-def test_openai_api(promt, conversation_history=None):
-
-    system_prompt = """You are 'Tushar', an intelligent assistant for SellnService - a comprehensive vehicle fleet management and service platform.
-
-    Your role is to help users with:
-    1. **Vehicle Management**: Adding vehicles (units) with VIN, tracking mileage, brand/model info, and managing vehicle status (active, sold, in service, inactive)
-    2. **Service Scheduling**: Booking vehicle maintenance appointments, tracking service status, managing service costs and history
-    3. **Sales Management**: Recording vehicle sales, managing buyer information, tracking payment methods
-    4. **Account Management**: User registration, email verification, password reset, profile updates
-    5. **Real-time Chat**: Communicating with admins about specific vehicles, services, or sales
-    6. **Platform Features**: Explaining how to use various features like uploading images, viewing history, etc.
-
-    Platform Key Features:
-    - JWT-based authentication with email verification (OTP)
-    - Vehicle tracking with VIN validation (17 characters)
-    - Service workflow: Scheduled → In Progress → Completed
-    - Automatic unit status updates when sold
-    - WebSocket-based real-time chat system
-    - Media management for vehicle and profile images
-
-    When helping users:
-    - Be concise and friendly
-    - Provide step-by-step guidance when needed
-    - Reference specific API endpoints when relevant (e.g., /api/users/register/, /api/main/units/)
-    - Explain technical terms in simple language
-    - Ask clarifying questions if the user's request is unclear
-    - Guide them to the appropriate feature or admin support
-
-    Always stay within the scope of SellnService platform. If asked about unrelated topics, politely redirect to platform-related questions."""
-
+from chats.protocol import FrameProtocolMixin
+from chats.throttling import ThrottleMixin
+from .admission import charge_tokens, llm_slot, reserve_tokens
+from .answers import count, get_cached_answer, store_answer
+from .intents import answer_intent, match_intent
+from .llm import get_backend
+from .memory import ConversationMemory, estimate_message_tokens, estimate_tokens, load_session, save_session
+from .prompts import FALLBACK_ANSWER, build_messages
+from .retrieval import retrieve
+from .topics import is_exit, is_on_topic
+
+async def stream_ai_response(prompt, conversation_history=None, context=None):
     try:
-
-        messages = [{"role": "system", "content": system_prompt}]
-        
-
-        if conversation_history:
-            messages.extend(conversation_history[-10:])
-        
-
-        messages.append({"role": "user", "content": promt})
-        
-        client = _get_groq_client()
-        response = client.chat.completions.create(
-            model="openai/gpt-oss-20b",
-            messages=messages,
-            temperature=0.7,
-            max_completion_tokens=1024,
-            top_p=0.9,
-            stream=True,
-            stop=None
-        )
-        content = ""
-        for chunk in response:
-            if hasattr(chunk.choices[0].delta, "content") and chunk.choices[0].delta.content:
-                content += chunk.choices[0].delta.content
-        
-        result = content.strip()
-        return result if result else "I apologize, but I couldn't generate a response. Please try again."
+        async for delta in get_backend().stream(build_messages(prompt, conversation_history, context)):
+            yield delta
     except Exception as e:
         raise Exception(f"AI API Error: {str(e)}")
 
-class ChatBotConsumer(AsyncWebsocketConsumer):
+async def get_ai_response(prompt, conversation_history=None, context=None):
+    content = ""
+    async for delta in stream_ai_response(prompt, conversation_history, context):
+        content += delta
+    result = content.strip()
+    return result if result else FALLBACK_ANSWER
+
+class ChatBotConsumer(ThrottleMixin, FrameProtocolMixin, AsyncWebsocketConsumer):
+    generation = None
+
     async def connect(self):
         await self.accept()
 
-        self.conversation_history = []
+        self.user = self.scope.get("user")
+        self.session_id, self.memory, resumed = await self.open_session()
 
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "message": "👋 Hello! I'm Tushar, your SellnService assistant!\n\n"
                        "I can help you with:\n"
                        "• Managing your vehicle fleet\n"
@@ -160,51 +46,206 @@ class ChatBotConsumer(AsyncWebsocketConsumer):
                        "• Recording sales and transactions\n"
                        "• Account and profile management\n"
                        "• Understanding platform features\n\n"
-                       "Just ask me anything about SellnService!"
-        }))
+                       "Just ask me anything about SellnService!",
+            "session_id": str(self.session_id),
+            "resumed": resumed
+        })
+
+    async def open_session(self):
+        requested = parse_qs(self.scope.get("query_string", b"").decode()).get("session")
+        if requested:
+            session = await database_sync_to_async(load_session)(requested[0], self.user)
+            if session is not None:
+                return session.pk, ConversationMemory(session.turns, session.earlier_questions), True
+        return uuid.uuid4(), ConversationMemory(), False
+
+    def throttled_event(self, retry_after):
+        return {
+            "error": "You are sending messages too quickly. Please wait a moment.",
+            "retry_after": retry_after
+        }
+
+    async def routed_answer(self, prompt):
+        intent = match_intent(prompt)
+        if intent is None:
+            return None
+        answer = await database_sync_to_async(answer_intent)(intent, prompt, self.user)
+        await sync_to_async(count, thread_sensitive=False)("routed")
+        await self.send_event({
+            "type": "delta",
+            "delta": answer
+        })
+        return answer
+
+    async def retrieved_answer(self, prompt):
+        answer, context = await database_sync_to_async(retrieve)(prompt)
+        if answer is not None:
+            await sync_to_async(count, thread_sensitive=False)("retrieved")
+            await self.send_event({
+                "type": "delta",
+                "delta": answer
+            })
+        return answer, context
+
+    async def cached_answer(self, prompt, context):
+        # Follow-up questions depend on the conversation, so only a
+        # conversation's first question is answered from the cache.
+        if self.memory:
+            return None
+        answer = await sync_to_async(get_cached_answer, thread_sensitive=False)(prompt, context)
+        if answer is not None:
+            await self.send_event({
+                "type": "delta",
+                "delta": answer
+            })
+        return answer
+
+    def admission_key(self):
+        if self.user is not None and self.user.is_authenticated:
+            return f"user_{self.user.id}"
+        return f"session_{self.session_id}"
+
+    async def send_queue_position(self, position):
+        await self.send_event({
+            "type": "queued",
+            "position": position
+        })
+
+    async def stream_answer(self, prompt, context):
+        # The prompt is paid for up front and the answer once it is known, so
+        # a user who is out of tokens is turned away before taking a slot.
+        key = self.admission_key()
+        history = self.memory.messages()
+        prompt_tokens = estimate_message_tokens(build_messages(prompt, history, context))
+        retry_after = await sync_to_async(reserve_tokens, thread_sensitive=False)(key, prompt_tokens)
+        if retry_after:
+            await self.send_event({
+                "error": "You have reached your chatbot usage limit. Please try again later.",
+                "retry_after": round(retry_after)
+            })
+            return None
+
+        content = ""
+        try:
+            async with llm_slot(key, self.send_queue_position):
+                async for delta in stream_ai_response(prompt, history, context):
+                    if not content:
+                        delta = delta.lstrip()
+                        if not delta:
+                            continue
+                    content += delta
+                    await self.send_event({
+                        "type": "delta",
+                        "delta": delta
+                    })
+        finally:
+            await sync_to_async(charge_tokens, thread_sensitive=False)(key, estimate_tokens(content))
+        return content.strip() or FALLBACK_ANSWER
+
+    async def answer(self, prompt):
+        try:
+            # Questions about the user's own fleet are answered from the
+            # database, everything else from retrieval, the cache or the LLM.
+            answer = await self.routed_answer(prompt)
+            context = ""
+            if answer is None:
+                answer, context = await self.retrieved_answer(prompt)
+            if answer is None:
+                answer = await self.cached_answer(prompt, context)
+            if answer is None:
+                answer = await self.stream_answer(prompt, context)
+                if answer is None:
+                    return
+                if not self.memory and answer != FALLBACK_ANSWER:
+                    await sync_to_async(store_answer, thread_sensitive=False)(prompt, answer, context)
+
+
+            self.memory.add(prompt, answer)
+
+            await self.send_event({
+                "type": "done",
+                "message": f"'Tushar' the Bot: {answer}"
+            })
+            # The answer is delivered, so a stop or a new question no longer
+            # cancels it. The session is still saved.
+            if self.generation is asyncio.current_task():
+                self.generation = None
+            await database_sync_to_async(save_session)(self.session_id, self.user, self.memory)
+        except Exception as e:
+            await self.send_event({
+                "error": f"Failed to get AI response: {str(e)}"
+            })
+
+    async def cancel_generation(self, reason):
+        # Cancelling the task closes the upstream HTTP stream and releases the
+        # admission slot before this returns.
+        generation = self.generation
+        if generation is None or generation.done():
+            return False
+        generation.cancel()
+        await asyncio.wait([generation])
+        self.generation = None
+        await sync_to_async(count, thread_sensitive=False)(f"cancelled_{reason}")
+        if reason != "disconnect":
+            await self.send_event({
+                "type": "cancelled",
+                "reason": reason
+            })
+        return True
 
     async def disconnect(self, close_code):
+        await self.cancel_generation("disconnect")
 
-        self.conversation_history = []
+    async def receive(self, text_data=None, bytes_data=None):
+        if await self.throttle():
+            return
 
-    async def receive(self, text_data):
         try:
 
-            if not text_data or text_data.strip() == "":
-                await self.send(text_data=json.dumps({
+            if not bytes_data and (not text_data or text_data.strip() == ""):
+                await self.send_event({
                     "error": "Empty message received"
-                }))
+                })
                 return
 
 
             try:
-                data = json.loads(text_data)
-            except json.JSONDecodeError:
-                await self.send(text_data=json.dumps({
+                data = self.decode_frame(text_data, bytes_data)
+            except ValueError:
+                await self.send_event({
                     "error": "Invalid JSON format. Please send {\"message\": \"your text\"}"
-                }))
+                })
+                return
+
+            if data.get("type") == "stop":
+                await self.cancel_generation("stop")
                 return
 
             prompt = data.get("message", "").strip()
 
 
             if not prompt:
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     "error": "Message field is required and cannot be empty"
-                }))
+                })
                 return
 
+            # Answers are generated in a task so this consumer keeps reading
+            # frames, and a stop, a newer question or a disconnect can cancel
+            # the generation.
+            await self.cancel_generation("superseded")
 
-            if any(exit_word in prompt.lower() for exit_word in ["exit", "quit", "bye", "goodbye"]):
-                await self.send(text_data=json.dumps({
+
+            if is_exit(prompt):
+                await self.send_event({
                     "message": "'Tushar' the Bot: Okay, goodbye! Have a great day!"
-                }))
+                })
                 await self.close()
                 return
 
 
             if not is_on_topic(prompt):
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     "message": "'Tushar' the Bot: I'm here to help you with SellnService platform! I can assist you with:\n\n"
                                "🚗 Vehicle Management - Add, track, and manage your fleet\n"
                                "🔧 Service Scheduling - Book and track maintenance\n"
@@ -212,27 +253,14 @@ class ChatBotConsumer(AsyncWebsocketConsumer):
                                "👤 Account Help - Registration, login, password reset\n"
                                "💬 Platform Features - Upload images, view history, chat support\n\n"
                                "What would you like to know about?"
-                }))
+                })
                 return
 
 
-            try:
-                answer = await get_ai_response(prompt, self.conversation_history)
-                
-
-                self.conversation_history.append({"role": "user", "content": prompt})
-                self.conversation_history.append({"role": "assistant", "content": answer})
-                
-                await self.send(text_data=json.dumps({
-                    "message": f"'Tushar' the Bot: {answer}"
-                }))
-            except Exception as e:
-                await self.send(text_data=json.dumps({
-                    "error": f"Failed to get AI response: {str(e)}"
-                }))
+            self.generation = asyncio.ensure_future(self.answer(prompt))
 
         except Exception as e:
 
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 "error": f"An unexpected error occurred: {str(e)}"
-            }))
\ No newline at end of file
+            })
\ No newline at end of file
@@ -0,0 +1,221 @@
+import re
+import calendar
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Subquery
+from django.utils import timezone
+from main.models import Sell, Service, Unit
+
+VEHICLE = r"(?:units?|vehicles?|cars?|trucks?)"
+OWNER = r"(?=.*(?:\bi\b|\bmy\b|\bwe\b|\bour\b|\bmine\b))"
+# How-to and editing questions are about using the platform, not the data.
+NOT_HOW_TO = (
+    r"(?!.*\b(?:how (?:do|can|should|would) (?:i|we)|how to|(?:can|could|may) (?:i|we)|"
+    r"record|add|create|mark|schedule|book|delete|remove|update|edit|change)\b)"
+)
+
+# A data question has to open a clause with a question word, so "I sold my
+# car, what should I do next?" does not read as one.
+ASKS = r"(?:^|.*[,.;:!?] )"
+SERVICE = r"(?:services?|appointments?|maintenance|servicing)"
+SALE = (
+    r"(?:(?:have|did|had) (?:i|we)(?: \w+)? (?:sold|sell)|(?:i|we)(?:'ve| have)? sold|"
+    r"(?:my|our)(?: \w+)? (?:sales|revenue)|total (?:sales|revenue))"
+)
+
+# Checked in order. The patterns are narrow on purpose: a miss costs an LLM
+# call, a false match answers the wrong question.
+INTENTS = [
+    ("next_service", re.compile(
+        OWNER + NOT_HOW_TO + ASKS + r"(?:when|what|which|do (?:i|we) have|are there|list|show)\b"
+        rf"(?:.*\b(?:next|upcoming|scheduled)(?: \w+)? {SERVICE}\b|.*\b{SERVICE}\b.*\b(?:coming up|upcoming|scheduled)\b)"
+    )),
+    ("sales", re.compile(
+        OWNER + NOT_HOW_TO + ASKS + rf"(?:how (?:many|much)|what|which|list|show)\b.*\b{SALE}\b"
+    )),
+    ("unit_count", re.compile(
+        OWNER + NOT_HOW_TO + rf"(?:.*\bhow many\b.*\b{VEHICLE}\b|.*\b(?:number|count) of\b.*\b{VEHICLE}\b|.*\bfleet size\b)"
+    )),
+]
+
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+UPCOMING_STATUSES = ("scheduled", "in_progress")
+STATUS_LABELS = dict(Unit.STATUS_CHOICES)
+
+
+def match_intent(prompt):
+    text = " ".join(prompt.lower().split())
+    for intent, pattern in INTENTS:
+        if pattern.match(text):
+            return intent
+    return None
+
+
+def snapshot_key(user_id, today):
+    # v2: units carry a list of sales rather than only the latest one.
+    return f"chatbot_fleet_v2_{user_id}_{today.isoformat()}"
+
+
+def build_snapshot(user_id, today):
+    # One query: every unit with its next open service attached as correlated
+    # subqueries, joined to all of its sales. A unit can be sold, bought back
+    # and sold again, so each unit keeps the full list.
+    upcoming = Service.objects.filter(
+        unit=OuterRef("pk"), status__in=UPCOMING_STATUSES, appointment__gte=today
+    ).order_by("appointment", "pk")
+    upcoming_count = upcoming.order_by().values("unit").annotate(total=Count("pk")).values("total")
+    rows = Unit.objects.filter(user_id=user_id).annotate(
+        next_service=Subquery(upcoming.values("appointment")[:1]),
+        next_service_location=Subquery(upcoming.values("location")[:1]),
+        upcoming_services=Subquery(upcoming_count),
+    ).order_by("pk", "sales__sale_date", "sales__pk").values(
+        "pk", "year", "brand", "model", "vin", "status", "next_service", "next_service_location",
+        "upcoming_services", "sales__sale_date", "sales__sale_price",
+    )
+    units = {}
+    for row in rows:
+        unit_id, sale_date, sale_price = row.pop("pk"), row.pop("sales__sale_date"), row.pop("sales__sale_price")
+        unit = units.get(unit_id)
+        if unit is None:
+            unit = units[unit_id] = dict(
+                row,
+                name=f"{row['year']} {row['brand']} {row['model']}",
+                upcoming_services=row["upcoming_services"] or 0,
+                sales=[],
+            )
+        if sale_date is not None:
+            unit["sales"].append((sale_date, sale_price))
+    return list(units.values())
+
+
+def fleet_snapshot(user_id):
+    # Keyed by date so "next" and "last month" move on at midnight, and
+    # dropped by the signals whenever the user's units, services or sales
+    # change.
+    today = timezone.localdate()
+    key = snapshot_key(user_id, today)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_snapshot(user_id, today)
+        cache.set(key, snapshot, settings.CHATBOT_FLEET_SNAPSHOT_TTL)
+    return snapshot
+
+
+def invalidate_snapshot(user_id):
+    cache.delete(snapshot_key(user_id, timezone.localdate()))
+
+
+def format_date(day):
+    return f"{day:%a} {day.day} {day:%b %Y}"
+
+
+def format_money(amount):
+    return f"${amount:,.2f}"
+
+
+def sale_period(text, today):
+    if "last month" in text or "previous month" in text:
+        end = today.replace(day=1)
+        start = (end - timedelta(days=1)).replace(day=1)
+        return f"last month ({start:%B %Y})", start, end
+    if "this month" in text:
+        start = today.replace(day=1)
+        return f"this month ({start:%B %Y})", start, today + timedelta(days=1)
+    if "last week" in text:
+        start = today - timedelta(days=today.weekday() + 7)
+        return "last week", start, start + timedelta(days=7)
+    if "this week" in text:
+        start = today - timedelta(days=today.weekday())
+        return "this week", start, today + timedelta(days=1)
+    if "last year" in text:
+        start = today.replace(year=today.year - 1, month=1, day=1)
+        return f"in {start.year}", start, start.replace(year=today.year)
+    if "this year" in text:
+        start = today.replace(month=1, day=1)
+        return f"this year ({start.year})", start, today + timedelta(days=1)
+    if "yesterday" in text:
+        return "yesterday", today - timedelta(days=1), today
+    if "today" in text:
+        return "today", today, today + timedelta(days=1)
+    for word in re.findall(r"[a-z]+", text):
+        # "may" is usually the verb.
+        if word not in MONTHS or word == "may" and not re.search(r"\bin may\b", text):
+            continue
+        month = MONTHS[word]
+        year = today.year if month <= today.month else today.year - 1
+        start = today.replace(year=year, month=month, day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        return f"in {start:%B %Y}", start, end
+    return "in total", None, None
+
+
+def answer_unit_count(snapshot, prompt, today):
+    if not snapshot:
+        return "You don't have any units yet. Add one with POST /api/main/units/."
+    counts = {}
+    for unit in snapshot:
+        counts[unit["status"]] = counts.get(unit["status"], 0) + 1
+    breakdown = ", ".join(
+        f"{counts[status]} {STATUS_LABELS[status].lower()}"
+        for status in STATUS_LABELS if status in counts
+    )
+    noun = "unit" if len(snapshot) == 1 else "units"
+    return f"You have {len(snapshot)} {noun}: {breakdown}."
+
+
+def answer_next_service(snapshot, prompt, today):
+    upcoming = sorted(
+        (unit for unit in snapshot if unit["next_service"] is not None),
+        key=lambda unit: unit["next_service"],
+    )
+    if not upcoming:
+        return "You have no upcoming services scheduled. Book one with POST /api/main/services/."
+    unit = upcoming[0]
+    answer = f"Your next service is on {format_date(unit['next_service'])} for your {unit['name']} ({unit['vin']})"
+    if unit["next_service_location"]:
+        answer += f" at {unit['next_service_location']}"
+    answer += "."
+    total = sum(unit["upcoming_services"] for unit in snapshot)
+    if total > 1:
+        answer += f" You have {total} upcoming services in all."
+    return answer
+
+
+def answer_sales(snapshot, prompt, today):
+    label, start, end = sale_period(" ".join(prompt.lower().split()), today)
+    sold = sorted(
+        (
+            (unit, sale_date, sale_price)
+            for unit in snapshot for sale_date, sale_price in unit["sales"]
+            if start is None or start <= sale_date < end
+        ),
+        key=lambda sale: sale[1],
+        reverse=True,
+    )
+    if not sold:
+        return f"You didn't sell any units {label}." if start else "You haven't recorded any sales yet."
+    total = sum(sale_price for _, _, sale_price in sold)
+    noun = "unit" if len(sold) == 1 else "units"
+    lines = [f"You sold {len(sold)} {noun} {label} for {format_money(total)}:"]
+    lines += [
+        f"• {unit['name']} on {format_date(sale_date)} for {format_money(sale_price)}"
+        for unit, sale_date, sale_price in sold[:settings.CHATBOT_INTENT_LIST_LIMIT]
+    ]
+    if len(sold) > settings.CHATBOT_INTENT_LIST_LIMIT:
+        lines.append(f"…and {len(sold) - settings.CHATBOT_INTENT_LIST_LIMIT} more. See GET /api/main/sales/ for the full list.")
+    return "\n".join(lines)
+
+
+ANSWERS = {
+    "unit_count": answer_unit_count,
+    "next_service": answer_next_service,
+    "sales": answer_sales,
+}
+
+
+def answer_intent(intent, prompt, user):
+    if not getattr(user, "is_authenticated", False):
+        return "Sign in and I can answer questions about your own units, services and sales."
+    return ANSWERS[intent](fleet_snapshot(user.id), prompt, timezone.localdate())
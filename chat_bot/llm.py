@@ -0,0 +1,124 @@
+import os
+import asyncio
+import weakref
+import httpx
+from django.conf import settings
+from django.utils.module_loading import import_string
+from groq import AsyncGroq, DefaultAsyncHttpxClient
+from .prompts import CHATBOT_MODEL
+from .stub import StubResponder, load_recordings
+
+# httpx connections belong to the event loop that opened them, so the pool is
+# shared by every conversation on a loop. A daphne worker has one loop, and
+# therefore one pool, for its lifetime.
+_clients = weakref.WeakKeyDictionary()
+
+
+def client_timeout():
+    return httpx.Timeout(
+        settings.CHATBOT_LLM_READ_TIMEOUT,
+        connect=settings.CHATBOT_LLM_CONNECT_TIMEOUT,
+        pool=settings.CHATBOT_LLM_POOL_TIMEOUT,
+    )
+
+
+def client_limits():
+    return httpx.Limits(
+        max_connections=settings.CHATBOT_LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.CHATBOT_LLM_MAX_KEEPALIVE,
+        keepalive_expiry=settings.CHATBOT_LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        api_key = settings.GROQ_API_KEY or os.getenv("GROQ_API_KEY")
+        if not api_key:
+            raise RuntimeError("GROQ_API_KEY is not set")
+        # Connection errors, 408, 409, 429 and 5xx responses are retried by the
+        # SDK with jittered exponential backoff (0.5 s doubling up to 8 s, or
+        # the server's Retry-After). A stream is never retried once it starts.
+        client = AsyncGroq(
+            api_key=api_key,
+            base_url=settings.GROQ_BASE_URL,
+            timeout=client_timeout(),
+            max_retries=settings.CHATBOT_LLM_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(timeout=client_timeout(), limits=client_limits()),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+class LLMBackend:
+    # stream() is an async generator of answer text for a list of chat
+    # messages. It must stop generating, and release any upstream request,
+    # when the generator is closed.
+    def stream(self, messages):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class GroqBackend(LLMBackend):
+    async def stream(self, messages):
+        stream = await get_client().chat.completions.create(
+            model=CHATBOT_MODEL,
+            messages=messages,
+            temperature=0.7,
+            max_completion_tokens=1024,
+            top_p=0.9,
+            stream=True,
+            stop=None
+        )
+        async with stream:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def close(self):
+        await close_client()
+
+
+class StubBackend(LLMBackend):
+    # Answers offline, for load tests and benchmarks. Settings are read on
+    # every call so tests can override them.
+    def __init__(self):
+        self.generations = 0
+
+    def responder(self):
+        return StubResponder(
+            load_recordings(settings.CHATBOT_STUB_RECORDINGS),
+            settings.CHATBOT_STUB_FIRST_TOKEN_MS / 1000,
+            settings.CHATBOT_STUB_TOKEN_MS / 1000,
+            settings.CHATBOT_STUB_ANSWER_TOKENS,
+            settings.CHATBOT_STUB_RECORDED_TIMING,
+        )
+
+    def stream(self, messages):
+        self.generations += 1
+        return self.responder().stream(messages)
+
+
+BACKENDS = {
+    "groq": GroqBackend,
+    "stub": StubBackend,
+}
+_backends = {}
+
+
+def get_backend():
+    name = settings.CHATBOT_LLM_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        backend_class = BACKENDS[name] if name in BACKENDS else import_string(name)
+        backend = _backends[name] = backend_class()
+    return backend
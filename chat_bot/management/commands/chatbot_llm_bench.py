@@ -0,0 +1,126 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from groq import Groq
+from chat_bot.consumers import get_ai_response
+from chat_bot.llm import close_client
+from chat_bot.prompts import CHATBOT_MODEL, build_messages
+from chat_bot.stub import StubLLMServer, StubResponder
+from chats.loadtest_utils import percentile
+
+
+class TimedExecutor(ThreadPoolExecutor):
+    # Tracks how long executor threads are held: for the per-request client
+    # that is the whole generation, for the pooled client only the DNS lookups
+    # asyncio makes when a new connection is opened.
+    def __init__(self):
+        super().__init__()
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        def timed():
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.busy += time.perf_counter() - start
+        return super().submit(timed)
+
+
+def legacy_request(base_url, prompt):
+    # The previous implementation: a new client per question, iterated inside
+    # an executor thread.
+    client = Groq(api_key='stub', base_url=base_url)
+    response = client.chat.completions.create(
+        model=CHATBOT_MODEL,
+        messages=build_messages(prompt),
+        stream=True,
+    )
+    content = ''
+    for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            content += chunk.choices[0].delta.content
+    return content.strip()
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request overhead and thread usage of the per-request and pooled LLM clients against a local stub server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['both', 'legacy', 'pooled'], default='both')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--latency', type=float, default=0.02, help='Stub time to first token in seconds')
+        parser.add_argument('--chunks', type=int, default=20, help='Chunks streamed per answer')
+        parser.add_argument('--chunk-interval', type=float, default=0.0, help='Seconds between streamed chunks')
+
+    def handle(self, *args, **options):
+        self.options = options
+        server = StubLLMServer(StubResponder(
+            first_token=options['latency'],
+            token_interval=options['chunk_interval'],
+            answer_tokens=options['chunks'],
+        ))
+        base_url = server.start()
+        ideal = options['latency'] + (options['chunks'] - 1) * options['chunk_interval']
+
+        self.stdout.write(
+            f"{options['requests']} requests, concurrency {options['concurrency']}, "
+            f"stub answer time {ideal * 1000:.1f} ms"
+        )
+        self.stdout.write(
+            f"{'client':<8}{'p50 ms':>10}{'p95 ms':>10}{'overhead':>10}{'req/s':>10}{'threads':>9}{'thread ms/req':>15}{'conns':>7}"
+        )
+        modes = ['legacy', 'pooled'] if options['mode'] == 'both' else [options['mode']]
+        for mode in modes:
+            connections = server.connections
+            with override_settings(CHATBOT_LLM_BACKEND='groq', GROQ_API_KEY='stub', GROQ_BASE_URL=base_url):
+                latencies, elapsed, threads, busy = asyncio.run(self.run(mode, base_url))
+            p50 = percentile(latencies, 50) * 1000
+            self.stdout.write(
+                f"{mode:<8}{p50:>10.2f}{percentile(latencies, 95) * 1000:>10.2f}"
+                f"{p50 - ideal * 1000:>10.2f}{len(latencies) / elapsed:>10.1f}"
+                f"{threads:>9}{busy / len(latencies) * 1000:>15.2f}{server.connections - connections:>7}"
+            )
+
+    async def run(self, mode, base_url):
+        loop = asyncio.get_running_loop()
+        executor = TimedExecutor()
+        loop.set_default_executor(executor)
+        baseline = threading.active_count()
+        peak = baseline
+        latencies = []
+        queue = asyncio.Queue()
+        for i in range(self.options['requests']):
+            queue.put_nowait(f'How do I add vehicle {i}?')
+
+        async def request(prompt):
+            if mode == 'legacy':
+                return await loop.run_in_executor(None, legacy_request, base_url, prompt)
+            return await get_ai_response(prompt)
+
+        async def worker():
+            while not queue.empty():
+                prompt = queue.get_nowait()
+                start = time.perf_counter()
+                await request(prompt)
+                latencies.append(time.perf_counter() - start)
+
+        async def sample_threads():
+            nonlocal peak
+            while True:
+                peak = max(peak, threading.active_count())
+                await asyncio.sleep(0.005)
+
+        sampler = asyncio.ensure_future(sample_threads())
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(self.options['concurrency'])])
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+        await close_client()
+        return latencies, elapsed, peak - baseline, executor.busy
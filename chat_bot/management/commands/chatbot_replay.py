@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import asyncio
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from chat_bot.llm import get_backend
+from chat_bot.stub import read_conversations
+from chats.loadtest_utils import STUB_CHANNEL_LAYERS, CommunicatorClient, percentile
+
+SAMPLE_RECORDINGS = os.path.join(os.path.dirname(__file__), '..', '..', 'recordings', 'sample.jsonl')
+
+
+class Replay:
+    def __init__(self, application, conversations, options):
+        self.application = application
+        self.conversations = conversations
+        self.options = options
+        self.first_token = []
+        self.turn_latency = []
+        self.conversation_latency = []
+        self.counts = {'turns': 0, 'chunks': 0, 'queued': 0, 'errors': 0}
+        self.recorded = []
+
+    async def ask(self, client, prompt):
+        start = time.perf_counter()
+        await client.send({'message': prompt})
+        chunks = []
+        first_token = None
+        while True:
+            event = await client.receive()
+            if event is None:
+                return None
+            if event.get('type') == 'queued':
+                self.counts['queued'] += 1
+            elif event.get('type') == 'delta':
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                chunks.append(event['delta'])
+            elif 'error' in event:
+                self.counts['errors'] += 1
+                return None
+            elif 'message' in event:
+                break
+        elapsed = time.perf_counter() - start
+        self.counts['turns'] += 1
+        self.counts['chunks'] += len(chunks)
+        self.turn_latency.append(elapsed)
+        if first_token is not None:
+            self.first_token.append(first_token)
+        return {
+            'chunks': chunks,
+            'first_token_ms': round((first_token or elapsed) * 1000, 1),
+            'token_ms': round((elapsed - (first_token or elapsed)) / max(len(chunks) - 1, 1) * 1000, 1),
+        }
+
+    async def converse(self, turns):
+        client = CommunicatorClient(self.application, '/ws/chatbot/')
+        await client.connect()
+        await client.receive()
+        start = time.perf_counter()
+        recorded = []
+        for turn in turns:
+            result = await self.ask(client, turn['prompt'])
+            if result is None:
+                break
+            recorded.append({'prompt': turn['prompt'], **result})
+        else:
+            self.conversation_latency.append(time.perf_counter() - start)
+        await client.close()
+        self.recorded.append({'turns': recorded})
+
+    async def run(self):
+        queue = asyncio.Queue()
+        for i in range(self.options['conversations']):
+            queue.put_nowait(self.conversations[i % len(self.conversations)])
+
+        async def worker():
+            while not queue.empty():
+                await self.converse(queue.get_nowait())
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(self.options['concurrency'])])
+        return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded chatbot conversations through ChatBotConsumer and report throughput and time to first token'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recordings', default=SAMPLE_RECORDINGS, help='JSONL file of conversations, one per line')
+        parser.add_argument('--conversations', type=int, default=100, help='Conversations to run, cycling through the file')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--first-token-ms', type=float, help='Stub time to first token (default CHATBOT_STUB_FIRST_TOKEN_MS)')
+        parser.add_argument('--token-ms', type=float, help='Stub time between tokens (default CHATBOT_STUB_TOKEN_MS)')
+        parser.add_argument('--recorded-timing', action='store_true', help='Use the timings stored with each recorded turn')
+        parser.add_argument('--record', metavar='OUTPUT', help='Run each conversation once against CHATBOT_LLM_BACKEND and write the answers to OUTPUT')
+
+    def handle(self, *args, **options):
+        try:
+            conversations = read_conversations(options['recordings'])
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read {options['recordings']}: {e}")
+        if not conversations:
+            raise CommandError(f"{options['recordings']} has no conversations")
+
+        overrides = {'CHANNEL_LAYERS': STUB_CHANNEL_LAYERS}
+        if options['record']:
+            options['conversations'] = len(conversations)
+        else:
+            overrides.update(
+                CHATBOT_LLM_BACKEND='stub',
+                CHATBOT_STUB_RECORDINGS=options['recordings'],
+                CHATBOT_STUB_RECORDED_TIMING=options['recorded_timing'],
+            )
+            if options['first_token_ms'] is not None:
+                overrides['CHATBOT_STUB_FIRST_TOKEN_MS'] = options['first_token_ms']
+            if options['token_ms'] is not None:
+                overrides['CHATBOT_STUB_TOKEN_MS'] = options['token_ms']
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, serialize=False)
+        try:
+            with override_settings(**overrides):
+                from SellsAndServices.asgi import application
+                backend = get_backend()
+                generations = getattr(backend, 'generations', None)
+                replay = Replay(application, conversations, options)
+                elapsed = asyncio.run(replay.run())
+                if generations is not None:
+                    generations = backend.generations - generations
+                self.report(replay, elapsed, generations)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['record']:
+            with open(options['record'], 'w') as f:
+                for conversation in replay.recorded:
+                    f.write(json.dumps(conversation, ensure_ascii=False) + '\n')
+            self.stdout.write(f"recorded {len(replay.recorded)} conversations to {options['record']}")
+
+    def report(self, replay, elapsed, generations):
+        def line(label, values):
+            values_ms = [value * 1000 for value in values]
+            self.stdout.write(
+                f'{label:<14}n={len(values_ms):<7}p50={percentile(values_ms, 50):8.2f}ms '
+                f'p95={percentile(values_ms, 95):8.2f}ms p99={percentile(values_ms, 99):8.2f}ms '
+                f'max={max(values_ms, default=0):8.2f}ms'
+            )
+
+        options = self.options = replay.options
+        self.stdout.write(
+            f"{options['conversations']} conversations, concurrency {options['concurrency']}, "
+            f"backend {settings.CHATBOT_LLM_BACKEND}"
+        )
+        line('first token', replay.first_token)
+        line('turn', replay.turn_latency)
+        line('conversation', replay.conversation_latency)
+
+        counts = replay.counts
+        self.stdout.write(
+            f"throughput={counts['turns'] / elapsed:.1f} turns/s "
+            f"{len(replay.conversation_latency) / elapsed:.1f} conversations/s "
+            f"{counts['chunks'] / elapsed:.1f} tokens/s over {elapsed:.1f}s"
+        )
+        summary = f"turns={counts['turns']} queued={counts['queued']} errors={counts['errors']}"
+        if generations is not None:
+            summary += f' llm={generations}'
+        self.stdout.write(summary)
@@ -0,0 +1,35 @@
+import asyncio
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chat_bot.stub import StubLLMServer, StubResponder, load_recordings
+
+
+class Command(BaseCommand):
+    help = 'Serve canned or recorded chatbot answers from an OpenAI-compatible endpoint for offline testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8090)
+        parser.add_argument('--recordings', default=settings.CHATBOT_STUB_RECORDINGS, help='JSONL file of recorded conversations')
+        parser.add_argument('--first-token-ms', type=float, default=settings.CHATBOT_STUB_FIRST_TOKEN_MS)
+        parser.add_argument('--token-ms', type=float, default=settings.CHATBOT_STUB_TOKEN_MS)
+        parser.add_argument('--answer-tokens', type=int, default=settings.CHATBOT_STUB_ANSWER_TOKENS, help='Tokens in the canned answer to unrecorded prompts')
+        parser.add_argument('--recorded-timing', action='store_true', help='Use the timings stored with each recorded turn')
+
+    def handle(self, *args, **options):
+        recordings = load_recordings(options['recordings'])
+        server = StubLLMServer(StubResponder(
+            recordings,
+            options['first_token_ms'] / 1000,
+            options['token_ms'] / 1000,
+            options['answer_tokens'],
+            options['recorded_timing'],
+        ))
+        self.stdout.write(
+            f"Serving {len(recordings)} recorded answers on http://{options['host']}:{options['port']}/openai/v1. "
+            f"Set GROQ_BASE_URL=http://{options['host']}:{options['port']} to use it."
+        )
+        try:
+            asyncio.run(server.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,47 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from chat_bot.topics import ALLOWED_KEYWORDS, KeywordMatcher
+
+OFF_TOPIC_WORDS = ['weather', 'football', 'recipe', 'movie', 'poem', 'guitar', 'planet', 'ocean', 'novel', 'jazz']
+
+
+def legacy_is_on_topic(prompt):
+    # The previous implementation: one substring scan per keyword.
+    prompt_lower = prompt.lower()
+    return any(keyword in prompt_lower for keyword in ALLOWED_KEYWORDS)
+
+
+class Command(BaseCommand):
+    help = 'Compare the substring scan and the compiled keyword matcher used for chatbot topic gating'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lengths', default='20,200,2000,20000', help='Comma separated prompt lengths in characters')
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        matcher = KeywordMatcher(ALLOWED_KEYWORDS)
+        rng = random.Random(0)
+        self.stdout.write(f'{len(ALLOWED_KEYWORDS)} keywords, {len(matcher.keywords)} after removing duplicates')
+        self.stdout.write(f"{'chars':>8}{'scan us':>12}{'matcher us':>12}{'matcher ns/char':>17}{'speedup':>9}")
+
+        for length in [int(value) for value in options['lengths'].split(',')]:
+            # Off-topic prompts are the worst case: nothing matches, so both
+            # implementations read the whole prompt.
+            text = ''
+            while len(text) < length:
+                text += rng.choice(OFF_TOPIC_WORDS) + ' '
+            assert not legacy_is_on_topic(text) and not matcher.matches(text)
+
+            scan = self.timeit(legacy_is_on_topic, text, options['iterations'])
+            compiled = self.timeit(matcher.matches, text, options['iterations'])
+            self.stdout.write(
+                f'{len(text):>8}{scan * 1e6:>12.2f}{compiled * 1e6:>12.2f}'
+                f'{compiled * 1e9 / len(text):>17.2f}{scan / compiled:>8.1f}x'
+            )
+
+    def timeit(self, func, text, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func(text)
+        return (time.perf_counter() - start) / iterations
@@ -0,0 +1,17 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chat_bot.models import ChatBotSession
+
+
+class Command(BaseCommand):
+    help = 'Delete chatbot sessions that have not been used within the session TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHATBOT_SESSION_TTL_DAYS, help='Delete sessions idle for longer than this many days')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = ChatBotSession.objects.filter(updated_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} chatbot sessions idle for more than {options["days"]} days'))
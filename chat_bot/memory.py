@@ -0,0 +1,96 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from .models import ChatBotSession
+
+# Close enough to the provider's tokenizer for English text, and free.
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+EARLIER_QUESTION_TOKENS = 30
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_message_tokens(messages):
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+
+def clip(text, tokens):
+    limit = tokens * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+class ConversationMemory:
+    # Recent turns are kept verbatim within CHATBOT_HISTORY_TOKENS. Older
+    # turns are folded into a list of the questions asked, capped at
+    # CHATBOT_HISTORY_SUMMARY_TOKENS, so the history sent with every prompt
+    # never exceeds the sum of the two.
+    def __init__(self, turns=None, earlier_questions=None):
+        self.turns = [list(turn) for turn in turns or []]
+        self.earlier_questions = list(earlier_questions or [])
+        self.trim()
+
+    def __bool__(self):
+        return bool(self.turns or self.earlier_questions)
+
+    def add(self, question, answer):
+        turn_limit = settings.CHATBOT_HISTORY_TOKENS // 2
+        self.turns.append([clip(question, turn_limit // 2), clip(answer, turn_limit)])
+        self.trim()
+
+    def turn_tokens(self):
+        return sum(estimate_tokens(question) + estimate_tokens(answer) for question, answer in self.turns)
+
+    def summary_tokens(self):
+        return sum(estimate_tokens(question) for question in self.earlier_questions)
+
+    def trim(self):
+        while self.turns and self.turn_tokens() > settings.CHATBOT_HISTORY_TOKENS:
+            question, _ = self.turns.pop(0)
+            self.earlier_questions.append(clip(question, EARLIER_QUESTION_TOKENS))
+        while self.earlier_questions and self.summary_tokens() > settings.CHATBOT_HISTORY_SUMMARY_TOKENS:
+            self.earlier_questions.pop(0)
+
+    def token_count(self):
+        return self.turn_tokens() + self.summary_tokens()
+
+    def messages(self):
+        messages = []
+        if self.earlier_questions:
+            messages.append({
+                "role": "system",
+                "content": "Earlier in this conversation the user asked: " + "; ".join(self.earlier_questions)
+            })
+        for question, answer in self.turns:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        return messages
+
+
+def session_owner(user):
+    return user if getattr(user, "is_authenticated", False) else None
+
+
+def load_session(session_id, user):
+    # Sessions are resumed by ID. A signed-in user can only resume their own,
+    # an anonymous one only a session that was never signed in.
+    cutoff = timezone.now() - timedelta(days=settings.CHATBOT_SESSION_TTL_DAYS)
+    try:
+        return ChatBotSession.objects.get(pk=session_id, user=session_owner(user), updated_at__gte=cutoff)
+    except (ChatBotSession.DoesNotExist, ValidationError):
+        return None
+
+
+def save_session(session_id, user, memory):
+    ChatBotSession.objects.update_or_create(
+        pk=session_id,
+        defaults={
+            "user": session_owner(user),
+            "turns": memory.turns,
+            "earlier_questions": memory.earlier_questions,
+            "token_count": memory.token_count(),
+        },
+    )
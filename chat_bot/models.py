@@ -1,3 +1,24 @@
+import uuid
+from django.conf import settings
 from django.db import models
 
 
+class ChatBotSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chatbot_sessions', null=True, blank=True)
+    # [[question, answer], ...] for the turns still inside the token budget,
+    # and the questions of older turns that were trimmed away.
+    turns = models.JSONField(default=list, blank=True)
+    earlier_questions = models.JSONField(default=list, blank=True)
+    token_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['updated_at'], name='chatbot_session_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"Chatbot session {self.id}"
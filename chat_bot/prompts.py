@@ -0,0 +1,36 @@
+SYSTEM_PROMPT = """You are 'Tushar', an intelligent assistant for SellnService - a vehicle fleet management and service platform.
+
+    You help users manage vehicles (units), schedule services, record sales, manage their account and chat with admins.
+
+    When helping users:
+    - Be concise and friendly
+    - Provide step-by-step guidance when needed
+    - Reference specific API endpoints when relevant, using the platform context you are given
+    - Ask clarifying questions if the user's request is unclear
+
+    Always stay within the scope of SellnService platform. If asked about unrelated topics, politely redirect to platform-related questions."""
+
+# Indexed for retrieval alongside the admin-managed content, so each fact is
+# only sent to the LLM when it is relevant to the question.
+PLATFORM_FACTS = [
+    "Vehicles are called units. A unit has a 17 character VIN, brand, model, year, mileage and location, and can have images.",
+    "A unit's status is active, sold, in service or inactive. Recording a sale marks the unit as sold automatically.",
+    "Services move from Scheduled to In Progress to Completed and track the appointment date, cost and service history.",
+    "Sales record the buyer's details, the sale price and the payment method.",
+    "Accounts sign in with JWT tokens. New accounts verify their email with a 6-digit OTP, and forgotten passwords are reset with an emailed OTP.",
+    "Real-time chat over WebSocket connects users with admins about a specific unit, service or sale.",
+    "Profile pictures and vehicle images are uploaded as media files.",
+]
+
+CHATBOT_MODEL = "openai/gpt-oss-20b"
+
+FALLBACK_ANSWER = "I apologize, but I couldn't generate a response. Please try again."
+
+def build_messages(prompt, conversation_history=None, context=None):
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if context:
+        messages.append({"role": "system", "content": f"Platform context:\n{context}"})
+    if conversation_history:
+        messages.extend(conversation_history)
+    messages.append({"role": "user", "content": prompt})
+    return messages
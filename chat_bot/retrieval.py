@@ -0,0 +1,264 @@
+import re
+import math
+import heapq
+import threading
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import URLResolver, get_resolver
+from rest_framework.permissions import IsAdminUser
+from admin.models import AboutUs, PrivacyPolicy, TermsAndConditions
+from .answers import STOP_WORDS
+from .prompts import PLATFORM_FACTS
+
+QUERY_STOP_WORDS = STOP_WORDS | {
+    "how", "what", "when", "where", "why", "who", "which", "and", "or", "in", "on",
+    "at", "by", "with", "from", "into", "if", "not", "no", "yes", "ok", "okay",
+    "int", "pk", "str", "slug",
+}
+
+# Endpoint names use the code's vocabulary; users ask in their own.
+ENDPOINT_SYNONYMS = {
+    "unit": "vehicle car truck",
+    "sell": "sale sold buyer",
+    "token": "login jwt authentication",
+    "otp": "code",
+    "profile": "account",
+}
+METHOD_WORDS = {
+    "GET": "view list show get",
+    "POST": "create add new send",
+    "PUT": "update edit change",
+    "PATCH": "update edit change",
+    "DELETE": "delete remove",
+}
+
+PASSAGE_MIN_WORDS = 20
+PASSAGE_MAX_WORDS = 80
+
+
+def tokenize(text):
+    terms = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word in QUERY_STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def split_passages(text):
+    # Paragraphs are kept together, short ones (headings) are joined to the
+    # next, and long ones are cut into PASSAGE_MAX_WORDS pieces.
+    passages = []
+    current = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if not words:
+            continue
+        if len(current) >= PASSAGE_MIN_WORDS:
+            passages.append(" ".join(current))
+            current = []
+        current.extend(words)
+        while len(current) > PASSAGE_MAX_WORDS:
+            passages.append(" ".join(current[:PASSAGE_MAX_WORDS]))
+            current = current[PASSAGE_MAX_WORDS:]
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def content_passages(model, title, ordering):
+    document = model.objects.order_by(ordering, "-pk").first()
+    if document is None:
+        return []
+    return [
+        {"title": title, "text": text, "answer": f"{text}\n\n(From our {title})"}
+        for text in split_passages(document.content)
+    ]
+
+
+def walk_urls(patterns, prefix=""):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from walk_urls(pattern.url_patterns, prefix + str(pattern.pattern))
+        else:
+            yield prefix + str(pattern.pattern), pattern
+
+
+def humanize(name):
+    name = re.sub(r"View$", "", name)
+    return re.sub(r"(?<=[a-z])(?=[A-Z])|[-_]", " ", name).lower().strip()
+
+
+def endpoint_passages():
+    passages = []
+    for route, pattern in walk_urls(get_resolver().url_patterns):
+        view = getattr(pattern.callback, "view_class", None)
+        if view is None or route.startswith("admin/"):
+            continue
+        # Staff-only endpoints are of no use to the people talking to the bot.
+        if IsAdminUser in getattr(view, "permission_classes", ()):
+            continue
+        methods = [method.upper() for method in ("get", "post", "put", "patch", "delete") if hasattr(view, method)]
+        label = humanize(pattern.name or view.__name__)
+        terms = label.split() + humanize(view.__name__).split()
+        keywords = " ".join([ENDPOINT_SYNONYMS.get(term, "") for term in terms] + [METHOD_WORDS[method] for method in methods])
+        path = f"/{route}"
+        passages.append({
+            "title": "API",
+            "text": f"{label}: {', '.join(methods)} {path}",
+            "index_text": f"{label} {humanize(view.__name__)} {route} {keywords}",
+            "answer": None,
+        })
+    return passages
+
+
+# Facts and endpoints rarely answer a question on their own (resetting a
+# password takes three endpoints), so only the admin-managed documents are
+# used for direct answers and the rest only feeds the LLM's context.
+def fact_passages():
+    return [{"title": "Platform", "text": fact, "answer": None} for fact in PLATFORM_FACTS]
+
+
+SOURCES = {
+    "privacy_policy": lambda: content_passages(PrivacyPolicy, "Privacy Policy", "-effective_date"),
+    "terms": lambda: content_passages(TermsAndConditions, "Terms and Conditions", "-effective_date"),
+    "about_us": lambda: content_passages(AboutUs, "About Us", "-updated_at"),
+    "endpoints": endpoint_passages,
+    "facts": fact_passages,
+}
+MODEL_SOURCES = {
+    PrivacyPolicy: "privacy_policy",
+    TermsAndConditions: "terms",
+    AboutUs: "about_us",
+}
+
+
+class BM25Index:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.passages = {}
+        self.lengths = {}
+        self.terms = {}
+        self.postings = {}
+        self.sources = {}
+        self.total_length = 0
+        self.next_id = 0
+
+    def remove(self, source):
+        for passage_id in self.sources.pop(source, []):
+            del self.passages[passage_id]
+            self.total_length -= self.lengths.pop(passage_id)
+            for term in self.terms.pop(passage_id):
+                postings = self.postings[term]
+                del postings[passage_id]
+                if not postings:
+                    del self.postings[term]
+
+    def add(self, source, passages):
+        ids = []
+        for passage in passages:
+            terms = Counter(tokenize(passage.get("index_text", passage["text"])))
+            if not terms:
+                continue
+            passage_id = self.next_id
+            self.next_id += 1
+            self.passages[passage_id] = passage
+            self.lengths[passage_id] = sum(terms.values())
+            self.terms[passage_id] = list(terms)
+            self.total_length += self.lengths[passage_id]
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[passage_id] = frequency
+            ids.append(passage_id)
+        self.sources[source] = ids
+
+    def replace(self, source, passages):
+        self.remove(source)
+        self.add(source, passages)
+
+    def idf(self, term):
+        document_frequency = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.passages) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def search(self, terms, limit):
+        terms = set(terms)
+        if not terms or not self.passages:
+            return []
+        average_length = self.total_length / len(self.passages)
+        scores = Counter()
+        for term in terms:
+            idf = self.idf(term)
+            for passage_id, frequency in self.postings.get(term, {}).items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[passage_id] / average_length)
+                scores[passage_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        # BM25 scores are unbounded, so confidence is measured against the
+        # best score any passage could reach for these terms. Terms the index
+        # has never seen count against it.
+        ceiling = sum(self.idf(term) * (self.k1 + 1) for term in terms)
+        return [
+            (self.passages[passage_id], score, score / ceiling)
+            for passage_id, score in heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        ]
+
+
+_index = BM25Index()
+_versions = {}
+_lock = threading.Lock()
+
+
+def version_key(source):
+    return f"chatbot_retrieval_version_{source}"
+
+
+def bump_source(source):
+    key = version_key(source)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def refresh_index():
+    # Saves bump a version in the shared cache, so every worker rebuilds just
+    # the changed source the next time it is asked a question.
+    versions = cache.get_many([version_key(source) for source in SOURCES])
+    with _lock:
+        for source, load in SOURCES.items():
+            version = versions.get(version_key(source))
+            if source not in _versions or _versions[source] != version:
+                _index.replace(source, load())
+                _versions[source] = version
+    return _index
+
+
+def retrieve(prompt):
+    terms = tokenize(prompt)
+    if not terms:
+        return None, ""
+    index = refresh_index()
+    with _lock:
+        results = index.search(terms, settings.CHATBOT_RETRIEVAL_CONTEXT_PASSAGES)
+
+    answer = None
+    if results and len(set(terms)) >= 2:
+        passage, score, confidence = results[0]
+        runner_up = results[1][1] if len(results) > 1 else 0
+        if passage["answer"] and confidence >= settings.CHATBOT_RETRIEVAL_ANSWER_CONFIDENCE and score >= settings.CHATBOT_RETRIEVAL_ANSWER_MARGIN * runner_up:
+            answer = passage["answer"]
+
+    context = []
+    length = 0
+    for passage, score, confidence in results:
+        if confidence < settings.CHATBOT_RETRIEVAL_CONTEXT_CONFIDENCE:
+            break
+        line = f"[{passage['title']}] {passage['text']}"
+        if length + len(line) > settings.CHATBOT_RETRIEVAL_CONTEXT_CHARS:
+            break
+        context.append(line)
+        length += len(line)
+    return answer, "\n".join(context)
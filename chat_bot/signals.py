@@ -0,0 +1,26 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from main.models import Sell, Service, Unit
+from .intents import invalidate_snapshot
+from .retrieval import MODEL_SOURCES, bump_source
+
+
+def content_changed(sender, **kwargs):
+    source = MODEL_SOURCES[sender]
+    transaction.on_commit(lambda: bump_source(source))
+
+
+for model in MODEL_SOURCES:
+    post_save.connect(content_changed, sender=model, dispatch_uid=f'chatbot_retrieval_save_{model.__name__}')
+    post_delete.connect(content_changed, sender=model, dispatch_uid=f'chatbot_retrieval_delete_{model.__name__}')
+
+
+def fleet_changed(sender, instance, **kwargs):
+    user_id = instance.user_id if sender is Unit else Unit.objects.filter(pk=instance.unit_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        transaction.on_commit(lambda: invalidate_snapshot(user_id))
+
+
+for model in (Unit, Service, Sell):
+    post_save.connect(fleet_changed, sender=model, dispatch_uid=f'chatbot_fleet_save_{model.__name__}')
+    post_delete.connect(fleet_changed, sender=model, dispatch_uid=f'chatbot_fleet_delete_{model.__name__}')
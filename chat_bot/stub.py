@@ -0,0 +1,129 @@
+import os
+import json
+import asyncio
+import threading
+from .prompts import CHATBOT_MODEL
+
+_recordings = {}
+
+
+def load_recordings(path):
+    # One conversation per line: {"turns": [{"prompt": ..., "chunks": [...]}]}.
+    # Turns are indexed by prompt, so the stub answers a recorded question
+    # with its recorded stream wherever it appears in a conversation.
+    if not path:
+        return {}
+    mtime = os.stat(path).st_mtime_ns
+    cached = _recordings.get(path)
+    if cached is None or cached[0] != mtime:
+        turns = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    for turn in json.loads(line)["turns"]:
+                        if turn.get("chunks"):
+                            turns[turn["prompt"].strip()] = turn
+        cached = _recordings[path] = (mtime, turns)
+    return cached[1]
+
+
+def read_conversations(path):
+    with open(path) as f:
+        return [json.loads(line)["turns"] for line in f if line.strip()]
+
+
+class StubResponder:
+    # Streams the recorded chunks for known prompts and numbered filler
+    # tokens for anything else. Timing comes from the arguments, or from the
+    # recording when recorded_timing is set and the turn has it.
+    def __init__(self, recordings=None, first_token=0.0, token_interval=0.0, answer_tokens=20, recorded_timing=False):
+        self.recordings = recordings or {}
+        self.first_token = first_token
+        self.token_interval = token_interval
+        self.answer_tokens = answer_tokens
+        self.recorded_timing = recorded_timing
+
+    def reply(self, messages):
+        prompt = next((message["content"] for message in reversed(messages) if message["role"] == "user"), "")
+        turn = self.recordings.get(prompt.strip())
+        if turn is None:
+            return self.first_token, self.token_interval, [f"token{i} " for i in range(self.answer_tokens)]
+        first_token, token_interval = self.first_token, self.token_interval
+        if self.recorded_timing:
+            first_token = turn.get("first_token_ms", first_token * 1000) / 1000
+            token_interval = turn.get("token_ms", token_interval * 1000) / 1000
+        return first_token, token_interval, turn["chunks"]
+
+    async def stream(self, messages):
+        first_token, token_interval, chunks = self.reply(messages)
+        await asyncio.sleep(first_token)
+        for i, chunk in enumerate(chunks):
+            if i and token_interval:
+                await asyncio.sleep(token_interval)
+            yield chunk
+
+
+class StubLLMServer:
+    # Minimal OpenAI-compatible streaming endpoint with HTTP/1.1 keep-alive.
+    # start() serves it from its own thread so it never competes with the
+    # clients being measured.
+    def __init__(self, responder):
+        self.responder = responder
+        self.connections = 0
+        self.requests = 0
+        self.port = None
+        self.ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=asyncio.run, args=(self.serve(),), daemon=True).start()
+        self.ready.wait()
+        return f"http://127.0.0.1:{self.port}"
+
+    async def serve(self, host="127.0.0.1", port=0):
+        server = await asyncio.start_server(self.handle, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with server:
+            await server.serve_forever()
+
+    def chunk(self, text):
+        event = {
+            "id": "stub",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": CHATBOT_MODEL,
+            "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+        }
+        return f"data: {json.dumps(event)}\n\n".encode()
+
+    def write_chunk(self, writer, data):
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                body = await reader.readexactly(length)
+                self.requests += 1
+                try:
+                    messages = json.loads(body).get("messages", [])
+                except ValueError:
+                    messages = []
+
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+                async for text in self.responder.stream(messages):
+                    self.write_chunk(writer, self.chunk(text))
+                    await writer.drain()
+                self.write_chunk(writer, b"data: [DONE]\n\n")
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -1,3 +1,529 @@
-from django.test import TestCase
+import os
+import time
+import asyncio
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from main.models import Sell, Service, Unit
+from users.models import CustomUser
+from . import answers
+from .admission import get_controller, llm_slot
+from .answers import (
+    answer_cache, answer_cache_stats, answer_key, get_cached_answer, normalize_prompt,
+    reset_answer_cache_stats, store_answer,
+)
+from .consumers import ChatBotConsumer
+from .intents import answer_intent, invalidate_snapshot, match_intent, sale_period
+from .llm import GroqBackend, close_client, get_client
+from .memory import ConversationMemory
+from .models import ChatBotSession
+from .retrieval import BM25Index, split_passages, tokenize
+from .stub import StubLLMServer, StubResponder
+from .topics import KeywordMatcher, is_exit, is_on_topic, reload_keywords
 
 
+class KeywordMatcherTests(SimpleTestCase):
+    def test_accepts_platform_questions(self):
+        for prompt in [
+            "Hi there",
+            "How do I add a vehicle?",
+            "My BRAKES are squeaking",
+            "I need an oil change",
+            "Can I book an   oil\nchange tomorrow?",
+            "What's the VIN on my car's title",
+            "sellnservice login problem",
+        ]:
+            with self.subTest(prompt=prompt):
+                self.assertTrue(is_on_topic(prompt))
+
+    def test_rejects_unrelated_prompts(self):
+        for prompt in [
+            "this is nice",
+            "Write a poem on penguins",
+            "weather in Paris",
+            "his dog is cute",
+            "canes for grandma",
+            "",
+        ]:
+            with self.subTest(prompt=prompt):
+                self.assertFalse(is_on_topic(prompt))
+
+    def test_matches_whole_words_only(self):
+        matcher = KeywordMatcher(["hi", "car", "oil change"])
+        self.assertFalse(matcher.matches("this"))
+        self.assertFalse(matcher.matches("scary"))
+        self.assertFalse(matcher.matches("oil changer"))
+        self.assertFalse(matcher.matches("his"))
+        self.assertFalse(matcher.matches("two cars"))
+        self.assertTrue(matcher.matches("hi!"))
+        self.assertTrue(KeywordMatcher(["cars"]).matches("two cars"))
+        self.assertTrue(matcher.matches("Oil Change"))
+
+    def test_keywords_are_normalized_and_deduplicated(self):
+        matcher = KeywordMatcher(["Help", "help", " oil  change ", "", "oil change"])
+        self.assertEqual(matcher.keywords, ["help", "oil change"])
+
+    def test_empty_keyword_list_matches_nothing(self):
+        self.assertFalse(KeywordMatcher([]).matches("hello"))
+
+    def test_exit_words(self):
+        self.assertTrue(is_exit("ok bye"))
+        self.assertTrue(is_exit("Goodbye!"))
+        self.assertFalse(is_exit("I am quite sure"))
+        self.assertFalse(is_exit("exits on the highway"))
+        self.assertFalse(is_exit("byes"))
+
+
+class KeywordReloadTests(SimpleTestCase):
+    def tearDown(self):
+        reload_keywords()
+
+    def test_reload_keywords(self):
+        reload_keywords(["penguin"])
+        self.assertTrue(is_on_topic("penguin facts"))
+        self.assertFalse(is_on_topic("hello"))
+        reload_keywords()
+        self.assertTrue(is_on_topic("hello"))
+
+    def test_keywords_file_is_reloaded_when_it_changes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "keywords.txt")
+            with open(path, "w") as f:
+                f.write("# topics\npenguin\n\nice floe  # phrases work too\n")
+
+            with override_settings(CHATBOT_KEYWORDS_FILE=path):
+                self.assertTrue(is_on_topic("penguin"))
+                self.assertTrue(is_on_topic("on the ice floe"))
+                self.assertFalse(is_on_topic("hello"))
+
+                with open(path, "w") as f:
+                    f.write("hello\n")
+                stat = os.stat(path)
+                os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+                self.assertTrue(is_on_topic("hello"))
+                self.assertFalse(is_on_topic("penguin"))
+
+                os.remove(path)
+                self.assertTrue(is_on_topic("hello"))
+
+
+class BM25IndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add("policy", [
+            {"text": "We never sell your personal data to third parties."},
+            {"text": "You can request deletion of your account at any time."},
+        ])
+        self.index.add("about", [{"text": "SellnService was founded to help dealers manage fleets."}])
+
+    def search(self, query):
+        return self.index.search(tokenize(query), 3)
+
+    def test_ranks_the_matching_passage_first(self):
+        passage, score, confidence = self.search("Do you sell my data?")[0]
+        self.assertIn("never sell", passage["text"])
+        self.assertTrue(0 < confidence <= 1)
+
+    def test_unknown_terms_lower_confidence(self):
+        known = self.search("sell data")[0][2]
+        mixed = self.search("sell data spaceship")[0][2]
+        self.assertLess(mixed, known)
+
+    def test_replace_only_touches_one_source(self):
+        self.index.replace("policy", [{"text": "We share data with financing partners."}])
+        self.assertEqual(self.search("deletion"), [])
+        self.assertIn("partners", self.search("financing partners")[0][0]["text"])
+        self.assertIn("dealers", self.search("dealers fleets")[0][0]["text"])
+        self.index.remove("policy")
+        self.assertNotIn("partner", self.index.postings)
+
+    def test_split_passages_joins_headings_to_their_paragraph(self):
+        text = "Data sharing\n\n" + "word " * 30 + "\n\nShort tail."
+        passages = split_passages(text)
+        self.assertEqual(len(passages), 2)
+        self.assertTrue(passages[0].startswith("Data sharing word"))
+
+
+@override_settings(CHATBOT_HISTORY_TOKENS=300, CHATBOT_HISTORY_SUMMARY_TOKENS=40)
+class ConversationMemoryTests(SimpleTestCase):
+    def test_history_stays_within_budget(self):
+        memory = ConversationMemory()
+        for i in range(20):
+            memory.add(f"question {i}", "answer " * 50)
+            self.assertLessEqual(memory.token_count(), 340)
+        self.assertEqual(memory.turns[-1][0], "question 19")
+        self.assertIn("question 16", memory.earlier_questions)
+        self.assertNotIn("question 0", memory.earlier_questions)
+
+    def test_long_answers_are_clipped(self):
+        memory = ConversationMemory()
+        memory.add("question", "x" * 10000)
+        self.assertLessEqual(len(memory.turns[0][1]), 150 * 4)
+        self.assertTrue(memory.turns[0][1].endswith("…"))
+
+    def test_messages_include_earlier_questions(self):
+        memory = ConversationMemory([["latest", "reply"]], ["first question"])
+        self.assertEqual(memory.messages(), [
+            {"role": "system", "content": "Earlier in this conversation the user asked: first question"},
+            {"role": "user", "content": "latest"},
+            {"role": "assistant", "content": "reply"},
+        ])
+        self.assertFalse(ConversationMemory())
+
+
+class AnswerCacheTests(SimpleTestCase):
+    def setUp(self):
+        answer_cache().clear()
+        reset_answer_cache_stats()
+
+    def test_prompts_are_normalized(self):
+        self.assertEqual(normalize_prompt("Hi! How do I ADD a vehicle??"), "how add vehicle")
+        self.assertEqual(answer_key("how do i add a vehicle"), answer_key("Hi, how to add vehicle?"))
+        self.assertNotEqual(answer_key("how do i add a vehicle"), answer_key("how do i add a vehicle", "context"))
+        self.assertIsNone(answer_key("Hi there!"))
+
+    def test_hits_and_misses(self):
+        self.assertIsNone(get_cached_answer("How do I add a vehicle?"))
+        store_answer("How do I add a vehicle?", "Use the units page.")
+        self.assertEqual(get_cached_answer("how to add vehicle"), "Use the units page.")
+        self.assertIsNone(get_cached_answer("How do I add a vehicle?", "context"))
+        stats = answer_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["stores"]), (1, 2, 1))
+        self.assertEqual(stats["hit_rate"], 0.3333)
+
+    def test_changing_the_prompt_or_model_retires_answers(self):
+        store_answer("How do I add a vehicle?", "Use the units page.")
+        with mock.patch.object(answers, "ANSWER_CACHE_VERSION", "other"):
+            self.assertIsNone(get_cached_answer("How do I add a vehicle?"))
+        self.assertEqual(get_cached_answer("How do I add a vehicle?"), "Use the units page.")
+
+    @override_settings(CHATBOT_ANSWER_CACHE_TTL=1)
+    def test_answers_expire(self):
+        store_answer("How do I add a vehicle?", "Use the units page.")
+        self.assertIsNotNone(get_cached_answer("How do I add a vehicle?"))
+        time.sleep(1.1)
+        self.assertIsNone(get_cached_answer("How do I add a vehicle?"))
+
+
+@override_settings(CHATBOT_LLM_MAX_IN_FLIGHT=2, CHATBOT_LLM_CLUSTER_MAX_IN_FLIGHT=0)
+class AdmissionControllerTests(SimpleTestCase):
+    def run_jobs(self, jobs):
+        served = []
+        positions = {}
+        running = []
+
+        async def job(user, number):
+            async def notify(position):
+                positions.setdefault((user, number), []).append(position)
+
+            async with llm_slot(user, notify):
+                running.append(user)
+                self.assertLessEqual(len(running), 2)
+                served.append(user)
+                await asyncio.sleep(0.01)
+                running.remove(user)
+
+        async def main():
+            tasks = []
+            for user, count in jobs:
+                tasks += [asyncio.create_task(job(user, number)) for number in range(count)]
+                await asyncio.sleep(0)
+            await asyncio.gather(*tasks)
+            controller = get_controller()
+            return controller.in_flight, controller.waiting
+
+        self.assertEqual(asyncio.run(main()), (0, 0))
+        return served, positions
+
+    def test_users_are_served_in_turn(self):
+        served, positions = self.run_jobs([("hog", 6), ("a", 1), ("b", 1)])
+        self.assertEqual(served, ["hog", "hog", "hog", "a", "b", "hog", "hog", "hog"])
+        self.assertEqual(positions[("b", 0)], [3, 1])
+        self.assertNotIn(("hog", 0), positions)
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        async def main():
+            async def hold():
+                async with llm_slot("a", None):
+                    await asyncio.sleep(0.02)
+
+            async def notify(position):
+                pass
+
+            async def wait():
+                async with llm_slot("b", notify):
+                    pass
+
+            holders = [asyncio.create_task(hold()) for _ in range(2)]
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(wait())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            self.assertEqual(get_controller().waiting, 0)
+            await asyncio.gather(*holders)
+            self.assertEqual(get_controller().in_flight, 0)
+
+        asyncio.run(main())
+
+
+class StubResponderTests(SimpleTestCase):
+    def collect(self, responder, prompt):
+        async def main():
+            return [chunk async for chunk in responder.stream([{"role": "user", "content": prompt}])]
+        return asyncio.run(main())
+
+    def test_replays_recorded_chunks(self):
+        responder = StubResponder({"How do I add a vehicle?": {"chunks": ["To", " add"], "first_token_ms": 5000}})
+        self.assertEqual(self.collect(responder, " How do I add a vehicle? "), ["To", " add"])
+
+    def test_unrecorded_prompts_get_filler(self):
+        self.assertEqual(self.collect(StubResponder(answer_tokens=3), "anything"), ["token0 ", "token1 ", "token2 "])
+
+    def test_recorded_timing(self):
+        turn = {"chunks": ["a"], "first_token_ms": 250, "token_ms": 10}
+        self.assertEqual(StubResponder({"q": turn}, 0.1, 0.02).reply([{"role": "user", "content": "q"}])[:2], (0.1, 0.02))
+        self.assertEqual(StubResponder({"q": turn}, 0.1, 0.02, recorded_timing=True).reply([{"role": "user", "content": "q"}])[:2], (0.25, 0.01))
+
+
+@override_settings(CHATBOT_LLM_BACKEND="stub", CHATBOT_STUB_FIRST_TOKEN_MS=10, CHATBOT_STUB_TOKEN_MS=50, CHATBOT_STUB_ANSWER_TOKENS=100)
+class GenerationCancellationTests(TransactionTestCase):
+    def setUp(self):
+        # A cached answer would finish before it could be cancelled.
+        answer_cache().clear()
+        reset_answer_cache_stats()
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(ChatBotConsumer.as_asgi(), "/ws/chatbot/")
+        communicator.scope["user"] = AnonymousUser()
+        await communicator.connect()
+        await communicator.receive_json_from()
+        return communicator
+
+    async def receive_until(self, communicator, frame_type):
+        while True:
+            frame = await communicator.receive_json_from(timeout=5)
+            if frame.get("type") == frame_type:
+                return frame
+
+    def test_stop_and_newer_question_cancel_the_answer(self):
+        async def main():
+            communicator = await self.connect()
+            await communicator.send_json_to({"message": "How do I add a vehicle?"})
+            await self.receive_until(communicator, "delta")
+            await communicator.send_json_to({"type": "stop"})
+            self.assertEqual(await self.receive_until(communicator, "cancelled"), {"type": "cancelled", "reason": "stop"})
+            self.assertEqual(get_controller().in_flight, 0)
+
+            await communicator.send_json_to({"message": "How do I add a car?"})
+            await self.receive_until(communicator, "delta")
+            await communicator.send_json_to({"message": "How do I sell a car?"})
+            self.assertEqual((await self.receive_until(communicator, "cancelled"))["reason"], "superseded")
+            await self.receive_until(communicator, "delta")
+            await communicator.disconnect()
+            self.assertEqual(get_controller().in_flight, 0)
+
+        asyncio.run(main())
+        stats = answer_cache_stats()
+        self.assertEqual((stats["cancelled_stop"], stats["cancelled_superseded"], stats["cancelled_disconnect"]), (1, 1, 1))
+
+
+@override_settings(CHATBOT_LLM_BACKEND="stub", CHATBOT_STUB_FIRST_TOKEN_MS=0, CHATBOT_STUB_TOKEN_MS=0, CHATBOT_STUB_ANSWER_TOKENS=3)
+class ChatBotSocketTests(TransactionTestCase):
+    def setUp(self):
+        answer_cache().clear()
+        reset_answer_cache_stats()
+
+    async def connect(self, path="/ws/chatbot/"):
+        communicator = WebsocketCommunicator(ChatBotConsumer.as_asgi(), path)
+        communicator.scope["user"] = AnonymousUser()
+        await communicator.connect()
+        return communicator, await communicator.receive_json_from()
+
+    async def ask(self, communicator, prompt):
+        await communicator.send_json_to({"message": prompt})
+        frames = []
+        while True:
+            frame = await communicator.receive_json_from(timeout=5)
+            frames.append(frame)
+            if frame.get("type") == "done":
+                # The session is saved after the answer is sent.
+                await communicator.receive_nothing(0.2)
+                return frames
+
+    def test_answer_is_streamed_then_cached(self):
+        async def main():
+            communicator, _ = await self.connect()
+            frames = await self.ask(communicator, "How do I add a vehicle?")
+            await communicator.disconnect()
+
+            communicator, _ = await self.connect()
+            cached = await self.ask(communicator, "how to add vehicle")
+            await communicator.disconnect()
+            return frames, cached
+
+        frames, cached = asyncio.run(main())
+        self.assertEqual(frames, [
+            {"type": "delta", "delta": "token0 "},
+            {"type": "delta", "delta": "token1 "},
+            {"type": "delta", "delta": "token2 "},
+            {"type": "done", "message": "'Tushar' the Bot: token0 token1 token2"},
+        ])
+        self.assertEqual(cached, [
+            {"type": "delta", "delta": "token0 token1 token2"},
+            {"type": "done", "message": "'Tushar' the Bot: token0 token1 token2"},
+        ])
+        self.assertEqual(answer_cache_stats()["hits"], 1)
+
+    def test_session_is_resumed_after_reconnect(self):
+        async def main():
+            communicator, hello = await self.connect()
+            self.assertFalse(hello["resumed"])
+            await self.ask(communicator, "How do I add a vehicle?")
+            await communicator.disconnect()
+
+            communicator, resumed = await self.connect(f"/ws/chatbot/?session={hello['session_id']}")
+            # The resumed conversation is not empty, so the same question
+            # goes to the LLM instead of the cache.
+            frames = await self.ask(communicator, "How do I add a vehicle?")
+            await communicator.disconnect()
+
+            communicator, fresh = await self.connect("/ws/chatbot/?session=not-a-session")
+            await communicator.disconnect()
+            return hello, resumed, frames, fresh
+
+        hello, resumed, frames, fresh = asyncio.run(main())
+        self.assertEqual((resumed["session_id"], resumed["resumed"]), (hello["session_id"], True))
+        self.assertEqual(len(frames), 4)
+        self.assertEqual(answer_cache_stats()["hits"], 0)
+        session = ChatBotSession.objects.get(pk=hello["session_id"])
+        self.assertEqual([turn[0] for turn in session.turns], ["How do I add a vehicle?"] * 2)
+        self.assertEqual(session.token_count, ConversationMemory(session.turns).token_count())
+        self.assertNotEqual(fresh["session_id"], hello["session_id"])
+        self.assertFalse(fresh["resumed"])
+
+
+class LLMClientTests(SimpleTestCase):
+    def test_client_is_shared_per_loop_and_closed(self):
+        server = StubLLMServer(StubResponder(answer_tokens=3))
+        base_url = server.start()
+
+        async def main():
+            backend = GroqBackend()
+            first = get_client()
+            replies = []
+            for _ in range(2):
+                replies.append("".join([delta async for delta in backend.stream([{"role": "user", "content": "hi"}])]))
+            self.assertIs(get_client(), first)
+            await close_client()
+            self.assertTrue(first.is_closed())
+            self.assertIsNot(get_client(), first)
+            await close_client()
+            return replies
+
+        with override_settings(GROQ_API_KEY="stub", GROQ_BASE_URL=base_url):
+            replies = asyncio.run(main())
+        # Both answers came over one kept-alive connection.
+        self.assertEqual(replies, ["token0 token1 token2 "] * 2)
+        self.assertEqual((server.requests, server.connections), (2, 1))
+
+    @override_settings(GROQ_API_KEY="", GROQ_BASE_URL=None)
+    def test_missing_api_key(self):
+        async def main():
+            with mock.patch.dict(os.environ, {"GROQ_API_KEY": ""}):
+                get_client()
+
+        with self.assertRaisesMessage(RuntimeError, "GROQ_API_KEY is not set"):
+            asyncio.run(main())
+
+
+class IntentMatchTests(SimpleTestCase):
+    def test_data_questions(self):
+        for prompt, intent in [
+            ("How many units do I have?", "unit_count"),
+            ("how many cars are in my fleet", "unit_count"),
+            ("When is my next service?", "next_service"),
+            ("What services do I have coming up?", "next_service"),
+            ("Hi, do I have any upcoming services?", "next_service"),
+            ("What did I sell last month?", "sales"),
+            ("how many vehicles have I sold", "sales"),
+            ("How much were my total sales this year?", "sales"),
+        ]:
+            with self.subTest(prompt=prompt):
+                self.assertEqual(match_intent(prompt), intent)
+
+    def test_how_to_questions_are_left_to_the_llm(self):
+        for prompt in [
+            "How do I add a vehicle?",
+            "How many units can I add?",
+            "How do I sell my car?",
+            "How do I schedule my next service?",
+            "When is the next service available?",
+        ]:
+            with self.subTest(prompt=prompt):
+                self.assertIsNone(match_intent(prompt))
+
+    def test_statements_that_mention_sales_or_services(self):
+        for prompt in [
+            "I want to sell my truck, what is the process?",
+            "I sold my car, what should I do next?",
+            "Is my data sold to third parties?",
+            "My car is due for service, where is the nearest garage?",
+            "What should I do next, my service light is on",
+        ]:
+            with self.subTest(prompt=prompt):
+                self.assertIsNone(match_intent(prompt))
+
+    def test_sale_periods(self):
+        today = date(2026, 3, 18)
+        self.assertEqual(sale_period("last month", today)[1:], (date(2026, 2, 1), date(2026, 3, 1)))
+        self.assertEqual(sale_period("in december", today)[1:], (date(2025, 12, 1), date(2026, 1, 1)))
+        self.assertEqual(sale_period("what may i have sold", today)[1:], (None, None))
+
+
+class IntentAnswerTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user("fleet@example.com", "Fleet", "Owner", "password", is_active=True)
+        today = timezone.localdate()
+        self.units = [
+            Unit.objects.create(user=self.user, vin=f"VIN{i:014d}", brand="Toyota", model="Corolla", year="2019", status=status)
+            for i, status in enumerate(["active", "active", "sold"])
+        ]
+        Service.objects.create(unit=self.units[0], appointment=today + timedelta(days=10))
+        Service.objects.create(unit=self.units[1], appointment=today + timedelta(days=3), location="Main St")
+        Service.objects.create(unit=self.units[1], appointment=today - timedelta(days=3))
+        Sell.objects.create(unit=self.units[2], sale_price=Decimal("15000"), sale_date=today)
+        invalidate_snapshot(self.user.id)
+
+    def ask(self, prompt):
+        return answer_intent(match_intent(prompt), prompt, self.user)
+
+    def test_answers_from_one_cached_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.ask("How many units do I have?"), "You have 3 units: 2 active, 1 sold.")
+            self.assertIn("(VIN00000000000001) at Main St.", self.ask("When is my next service?"))
+            self.assertIn("You sold 1 unit this month", self.ask("What did I sell this month?"))
+
+    def test_every_sale_of_a_unit_counts(self):
+        today = timezone.localdate()
+        last_month = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+        Sell.objects.create(unit=self.units[2], sale_price=Decimal("14000"), sale_date=last_month)
+        invalidate_snapshot(self.user.id)
+        answer = self.ask("What did I sell last month?")
+        self.assertIn("You sold 1 unit last month", answer)
+        self.assertIn("for $14,000.00", answer)
+        self.assertIn("You sold 2 units in total for $29,000.00", self.ask("How much have I sold?"))
+
+    def test_changes_invalidate_the_snapshot(self):
+        self.ask("How many units do I have?")
+        with self.captureOnCommitCallbacks(execute=True):
+            Unit.objects.create(user=self.user, vin="VIN99999999999999", brand="Ford", model="F150", year="2020")
+        self.assertEqual(self.ask("How many units do I have?"), "You have 4 units: 3 active, 1 sold.")
+
+    def test_anonymous_users_are_asked_to_sign_in(self):
+        self.assertIn("Sign in", answer_intent("unit_count", "How many units do I have?", AnonymousUser()))
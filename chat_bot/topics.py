@@ -0,0 +1,168 @@
+import os
+import re
+from django.conf import settings
+
+ALLOWED_KEYWORDS = [
+
+    "hello", "hi", "greetings", "hey", "good morning", "good afternoon", "good evening",
+    
+
+    "thank you", "thanks", "appreciate", "grateful", "much obliged", "thankful", "cheers",
+    
+
+    "how", "what", "when", "where", "why", "who", "which", "can", "could", "would", "should",
+    
+
+    "exit", "quit", "bye", "goodbye", "see you", "later",
+    
+
+    "sellnservice", "sells and services", "sellsandservices", "platform", "app", "application",
+    
+
+    "vehicle", "car", "truck", "auto", "automobile", "unit", "fleet", "vin",
+    "vehicles", "cars", "trucks", "autos", "automobiles", "units", "fleets", "vins",
+    "brand", "model", "year", "mileage", "honda", "toyota", "ford", "chevrolet",
+    "brands", "models", "years",
+    "purchase", "bought", "own", "owned", "inventory", "stock",
+    
+
+    "active", "sold", "inactive", "in service", "available", "status",
+    
+
+    "service", "maintenance", "repair", "fix", "appointment", "schedule",
+    "mechanic", "garage", "workshop", "oil change", "tire", "brake", "inspection",
+    "services", "repairs", "appointments", "mechanics", "garages", "workshops",
+    "oil changes", "tires", "brakes", "inspections", "costs", "prices",
+    "scheduled", "in progress", "completed", "cancelled", "cost", "price",
+    
+
+    "sell", "sale", "selling", "buyer", "purchase", "buy", "buying",
+    "payment", "transaction", "deal", "sold", "revenue", "profit",
+    "sales", "buyers", "payments", "transactions", "deals", "profits",
+    
+
+    "account", "profile", "register", "login", "logout", "password", "email",
+    "verify", "verification", "otp", "reset", "forgot", "user", "authentication",
+    "accounts", "profiles", "passwords", "emails", "users",
+    
+
+    "chat", "message", "talk", "speak", "communicate", "support", "help",
+    "admin", "contact", "question", "ask", "answer", "reply",
+    "chats", "messages", "admins", "contacts", "questions", "answers", "replies",
+    
+
+    "feature", "function", "capability", "option", "setting", "configuration",
+    "upload", "image", "photo", "picture", "media", "file",
+    "features", "functions", "options", "settings", "uploads", "images", "photos",
+    "pictures", "files",
+    
+
+    "help", "support", "guide", "tutorial", "how to", "instruction",
+    "privacy", "policy", "terms", "conditions", "about",
+    "guides", "tutorials", "instructions",
+    
+
+    "create", "add", "new", "update", "edit", "modify", "delete", "remove",
+    "view", "see", "show", "display", "list", "search", "find",
+    
+
+    "customer", "client", "dealer", "business", "manage", "management",
+    "track", "tracking", "record", "history", "report", "data",
+    "customers", "clients", "dealers", "records", "reports",
+    
+
+    "location", "address", "where", "zip", "code", "city", "state",
+    "locations", "addresses", "cities",
+    
+
+    "date", "time", "today", "tomorrow", "yesterday", "week", "month", "year",
+    "dates", "weeks", "months",
+    "appointment", "schedule", "calendar",
+]
+
+EXIT_KEYWORDS = ["exit", "quit", "bye", "goodbye"]
+
+
+def normalize_keywords(keywords):
+    normalized = (" ".join(keyword.lower().split()) for keyword in keywords)
+    return list(dict.fromkeys(keyword for keyword in normalized if keyword))
+
+
+def trie_pattern(keywords):
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [
+            (r"\s+" if char == " " else re.escape(char)) + build(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if "" in node else group
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    # Keywords share one regex built from a prefix trie, so the work done at
+    # each word start is bounded by the longest keyword rather than the
+    # number of keywords. Whole words only: plurals are listed as keywords of
+    # their own, since a blanket suffix lets "hi" match "his".
+    def __init__(self, keywords):
+        self.keywords = normalize_keywords(keywords)
+        if self.keywords:
+            self.pattern = re.compile(r"\b" + trie_pattern(self.keywords) + r"\b")
+        else:
+            self.pattern = re.compile(r"(?!)")
+
+    def matches(self, text):
+        # Lower-casing once is cheaper than a case-insensitive pattern.
+        return self.pattern.search(text.lower()) is not None
+
+
+_topic_matcher = KeywordMatcher(ALLOWED_KEYWORDS)
+_topic_source_mtime = None
+_exit_matcher = KeywordMatcher(EXIT_KEYWORDS)
+
+
+def load_keywords(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.split("#", 1)[0] for line in f]
+
+
+def reload_keywords(keywords=None):
+    global _topic_matcher, _topic_source_mtime
+    _topic_matcher = KeywordMatcher(ALLOWED_KEYWORDS if keywords is None else keywords)
+    _topic_source_mtime = None
+    return _topic_matcher
+
+
+def topic_matcher():
+    global _topic_matcher, _topic_source_mtime
+    path = settings.CHATBOT_KEYWORDS_FILE
+    if path:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            # Keep serving the last list that loaded.
+            return _topic_matcher
+        if mtime != _topic_source_mtime:
+            _topic_matcher = KeywordMatcher(load_keywords(path))
+            _topic_source_mtime = mtime
+    return _topic_matcher
+
+
+def is_on_topic(prompt):
+    return topic_matcher().matches(prompt)
+
+
+def is_exit(prompt):
+    return _exit_matcher.matches(prompt)
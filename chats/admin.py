@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ChatMessage, ChatRoom
+from .models import ChatMessage, ChatRoom, ChatReadCursor, ChatBroadcast, ChatResponseDaily
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
@@ -12,11 +12,49 @@ class ChatRoomAdmin(admin.ModelAdmin):
 @admin.register(ChatMessage)
 class ChatMessageAdmin(admin.ModelAdmin):
     list_display = ['id', 'chat_room', 'sender', 'message_preview', 'timestamp', 'is_read']
-    list_filter = ['is_read', 'timestamp']
-    search_fields = ['sender__email', 'message', 'chat_room__subject']
+    list_filter = ['timestamp']
+    search_fields = ['sender__email', 'chat_room__subject']
     readonly_fields = ['timestamp']
     ordering = ['-timestamp']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_read_state()
+    
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            # Loaded on first use, so the admin module does not pull in the
+            # search backends.
+            from .search import search_messages
+            matches = search_messages(ChatMessage.objects.all(), search_term).values('pk')
+            results = results | queryset.filter(pk__in=matches)
+        return results, may_have_duplicates
+    
     def message_preview(self, obj):
         return obj.message[:50] + '...' if len(obj.message) > 50 else obj.message
     message_preview.short_description = 'Message'
+
+
+@admin.register(ChatReadCursor)
+class ChatReadCursorAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'chat_room', 'last_read_message_id', 'updated_at']
+    search_fields = ['user__email', 'chat_room__subject']
+    readonly_fields = ['updated_at']
+    ordering = ['-updated_at']
+
+
+@admin.register(ChatBroadcast)
+class ChatBroadcastAdmin(admin.ModelAdmin):
+    list_display = ['id', 'admin', 'status', 'processed_rooms', 'total_rooms', 'created_at', 'completed_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['admin__email', 'message']
+    readonly_fields = ['created_at', 'completed_at']
+    ordering = ['-created_at']
+
+
+@admin.register(ChatResponseDaily)
+class ChatResponseDailyAdmin(admin.ModelAdmin):
+    list_display = ['id', 'admin', 'date', 'kind', 'bucket', 'count', 'total_seconds', 'max_seconds']
+    list_filter = ['kind', 'date']
+    search_fields = ['admin__email']
+    ordering = ['-date']
@@ -0,0 +1,96 @@
+import gzip
+import json
+from datetime import datetime
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from .models import ChatMessage, ChatRoom
+
+
+def archive_storage():
+    return FileSystemStorage(location=settings.CHAT_ARCHIVE_ROOT)
+
+
+def room_dir(room_id):
+    return f'room_{room_id}'
+
+
+def chunk_name(room_id, first_id, last_id):
+    # Zero padded so chunk files sort by message id.
+    return f'{room_dir(room_id)}/{first_id:012d}-{last_id:012d}.jsonl.gz'
+
+
+def list_chunks(storage, room_id):
+    if not storage.exists(room_dir(room_id)):
+        return []
+    chunks = []
+    for name in storage.listdir(room_dir(room_id))[1]:
+        if name.endswith('.jsonl.gz'):
+            first_id, last_id = name[:-len('.jsonl.gz')].split('-')
+            chunks.append((int(first_id), int(last_id), f'{room_dir(room_id)}/{name}'))
+    return sorted(chunks)
+
+
+def write_chunk(storage, room_id, messages):
+    lines = [
+        json.dumps({
+            'id': msg.id,
+            'sender_id': msg.sender_id,
+            'message': msg.message,
+            'timestamp': msg.timestamp.isoformat(),
+        })
+        for msg in messages
+    ]
+    name = chunk_name(room_id, messages[0].id, messages[-1].id)
+    # A chunk left behind by an interrupted run covers the same ids, so replace it.
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(gzip.compress(('\n'.join(lines) + '\n').encode())))
+
+
+def read_chunk(storage, name):
+    with storage.open(name, 'rb') as chunk:
+        data = gzip.decompress(chunk.read()).decode()
+    return [json.loads(line) for line in data.splitlines() if line]
+
+
+def archive_room(room_id, through_id, batch_size, storage=None):
+    storage = storage or archive_storage()
+    archived = 0
+    while True:
+        room = ChatRoom.objects.only('archived_through_id').get(pk=room_id)
+        batch = list(
+            ChatMessage.objects.filter(chat_room_id=room_id, pk__gt=room.archived_through_id, pk__lte=through_id)
+            .order_by('pk')[:batch_size]
+        )
+        if not batch:
+            return archived
+
+        write_chunk(storage, room_id, batch)
+        with transaction.atomic():
+            ChatMessage.objects.filter(chat_room_id=room_id, pk__lte=batch[-1].id).delete()
+            ChatRoom.objects.filter(pk=room_id).update(archived_through_id=batch[-1].id)
+        archived += len(batch)
+
+
+def archived_messages(room_id, before_id, limit, storage=None):
+    storage = storage or archive_storage()
+    messages = []
+    for first_id, last_id, name in reversed(list_chunks(storage, room_id)):
+        if first_id >= before_id:
+            continue
+        records = [record for record in read_chunk(storage, name) if record['id'] < before_id]
+        messages = [
+            ChatMessage(
+                id=record['id'],
+                chat_room_id=room_id,
+                sender_id=record['sender_id'],
+                message=record['message'],
+                timestamp=datetime.fromisoformat(record['timestamp']),
+            )
+            for record in records
+        ] + messages
+        if len(messages) >= limit:
+            break
+    return messages[-limit:] if limit else []
@@ -0,0 +1,153 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from users.models import CustomUser
+from .models import ChatMessage, ChatReadCursor, ChatRoom
+from .presence import online_users
+
+ASSIGNMENT_CHANNEL = 'chat-assignment'
+
+
+def rooms_key(admin_id):
+    return f'chat_load_rooms_{admin_id}'
+
+
+def backlog_key(admin_id):
+    return f'chat_load_backlog_{admin_id}'
+
+
+def adjust(key, delta):
+    # A missing counter is seeded from the database on the next read, so an
+    # increment that arrives before that can be dropped.
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        pass
+
+
+def adjust_rooms(admin_id, delta):
+    adjust(rooms_key(admin_id), delta)
+
+
+def adjust_backlog(admin_id, delta):
+    adjust(backlog_key(admin_id), delta)
+
+
+def reset_load(admin_ids):
+    cache.delete_many([key(admin_id) for admin_id in admin_ids for key in (rooms_key, backlog_key)])
+
+
+def seed_load(admin_ids):
+    last_read = ChatReadCursor.objects.filter(user=OuterRef('admin'), chat_room=OuterRef('pk')).values('last_read_message_id')[:1]
+    unread = (
+        ChatMessage.objects.filter(chat_room=OuterRef('pk'), pk__gt=OuterRef('last_read_id'))
+        .exclude(sender=OuterRef('admin'))
+        .order_by()
+        .values('chat_room')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    rooms = (
+        ChatRoom.objects.filter(admin_id__in=admin_ids, is_active=True)
+        .annotate(last_read_id=Coalesce(Subquery(last_read), Value(0)))
+        .annotate(unread=Coalesce(Subquery(unread), Value(0)))
+        .values_list('admin_id', 'unread')
+    )
+
+    load = {admin_id: [0, 0] for admin_id in admin_ids}
+    for admin_id, unread in rooms:
+        load[admin_id][0] += 1
+        load[admin_id][1] += unread
+
+    values = {}
+    for admin_id, (room_count, backlog) in load.items():
+        values[rooms_key(admin_id)] = room_count
+        values[backlog_key(admin_id)] = backlog
+    cache.set_many(values, settings.CHAT_LOAD_COUNTER_TTL)
+    return {admin_id: tuple(counts) for admin_id, counts in load.items()}
+
+
+def admin_load(admin_ids):
+    found = cache.get_many([key(admin_id) for admin_id in admin_ids for key in (rooms_key, backlog_key)])
+    load = {}
+    missing = []
+    for admin_id in admin_ids:
+        if rooms_key(admin_id) in found and backlog_key(admin_id) in found:
+            load[admin_id] = (max(found[rooms_key(admin_id)], 0), max(found[backlog_key(admin_id)], 0))
+        else:
+            missing.append(admin_id)
+    if missing:
+        load.update(seed_load(missing))
+    return load
+
+
+def load_score(room_count, backlog):
+    return room_count + settings.CHAT_ASSIGNMENT_BACKLOG_WEIGHT * backlog
+
+
+def eligible_admins(exclude=()):
+    staff = list(
+        CustomUser.objects.filter(is_staff=True, is_active=True)
+        .exclude(pk__in=exclude)
+        .order_by('pk')
+        .values_list('pk', flat=True)
+    )
+    return online_users(staff), staff
+
+
+def plan_assignments(rooms, exclude=(), online_only=False):
+    online, staff = eligible_admins(exclude)
+    candidates = online or ([] if online_only else staff)
+    if not candidates:
+        return {}
+
+    load = admin_load(candidates)
+    scores = {candidate: load_score(*load[candidate]) for candidate in candidates}
+    plan = {}
+    for key, backlog in rooms:
+        admin_id = min(scores, key=lambda candidate: (scores[candidate], candidate))
+        scores[admin_id] += load_score(1, backlog)
+        plan[key] = admin_id
+    return plan
+
+
+def pick_admin():
+    return plan_assignments([(None, 0)]).get(None)
+
+
+def rebalance_admin(admin_id):
+    rooms = list(
+        ChatRoom.objects.filter(admin_id=admin_id, is_active=True)
+        .with_unread_count(CustomUser(pk=admin_id))
+        .unread_only(CustomUser(pk=admin_id))
+        .order_by('last_message_at')
+        .values_list('pk', 'unread_count')[:settings.CHAT_ASSIGNMENT_REBALANCE_LIMIT]
+    )
+    if not rooms:
+        return 0
+    plan = plan_assignments(rooms, exclude=[admin_id], online_only=True)
+    if not plan:
+        return 0
+
+    moves = {}
+    for room_id, target in plan.items():
+        moves.setdefault(target, []).append(room_id)
+
+    # The new admin takes over where the previous one stopped reading, so
+    # only the pending backlog moves with the room.
+    cursors = dict(
+        ChatReadCursor.objects.filter(user_id=admin_id, chat_room_id__in=[room_id for room_id, _ in rooms])
+        .values_list('chat_room_id', 'last_read_message_id')
+    )
+    with transaction.atomic():
+        for target, room_ids in moves.items():
+            ChatRoom.objects.filter(pk__in=room_ids).update(admin_id=target, updated_at=timezone.now())
+            ChatReadCursor.objects.bulk_create([
+                ChatReadCursor(user_id=target, chat_room_id=room_id, last_read_message_id=cursors[room_id])
+                for room_id in room_ids if room_id in cursors
+            ], ignore_conflicts=True)
+    reset_load([admin_id, *moves])
+    return len(rooms)
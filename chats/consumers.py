@@ -1,12 +1,49 @@
-import json
+import asyncio
+import logging
+from asgiref.sync import sync_to_async
+from channels.consumer import AsyncConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import ChatMessage, ChatRoom
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import ChatMessage, ChatRoom, ChatBroadcast, LAST_MESSAGE_PREVIEW_LENGTH
+from .protocol import FrameProtocolMixin
+from .throttling import ThrottleMixin
+from .presence import PresenceMixin, online_users
+from .assignment import ASSIGNMENT_CHANNEL, rebalance_admin
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
-class ChatConsumer(AsyncWebsocketConsumer):
+BROADCAST_CHANNEL = 'chat-broadcast'
+
+def room_group_name(room_id):
+    return f"chat_room_{room_id}"
+
+def counterpart_id(room, user):
+    return room.user_id if room.admin_id == user.id else room.admin_id
+
+def serialize_message(msg, sender):
+    return {
+        'id': msg.id,
+        'sender': {
+            'id': sender.id,
+            'email': sender.email,
+            'first_name': sender.first_name,
+            'last_name': sender.last_name,
+        },
+        'message': msg.message,
+        'timestamp': msg.timestamp.isoformat(),
+        'is_read': msg.is_read
+    }
+
+class ChatConsumer(PresenceMixin, ThrottleMixin, FrameProtocolMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
         
@@ -26,7 +63,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        self.room_group_name = f"chat_room_{self.chat_room_id}"
+        self.room_group_name = room_group_name(self.chat_room_id)
         
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -36,10 +73,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.accept()
         
         chat_history = await self.get_chat_history(self.chat_room_id)
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'chat_history',
+            'room_id': int(self.chat_room_id),
             'messages': chat_history
-        }))
+        })
+        
+        await self.join_presence()
+        await self.watch_presence([(int(self.chat_room_id), counterpart_id(chat_room, self.user))])
     
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name'):
@@ -47,42 +88,61 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+            await self.leave_presence()
     
-    async def receive(self, text_data):
+    async def went_offline(self):
+        if not self.user.is_staff:
+            return
+        if not channel_layer_is_shared(self.channel_layer):
+            # No chat-assignment worker can receive the event.
+            schedule_rebalance(self.user.id)
+            return
+        try:
+            await self.channel_layer.send(ASSIGNMENT_CHANNEL, {
+                'type': 'admin.offline',
+                'admin_id': self.user.id
+            })
+        except ChannelFull:
+            logger.warning('%s is full, admin %s will not be rebalanced', ASSIGNMENT_CHANNEL, self.user.id)
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        if await self.throttle():
+            return
+        
         try:
-            data = json.loads(text_data)
+            data = self.decode_frame(text_data, bytes_data)
+            event_type = data.get('type', 'chat_message')
+            
+            if event_type == 'heartbeat':
+                await self.heartbeat()
+                return
+            
+            if event_type == 'typing':
+                await self.typing(int(self.chat_room_id), self.room_group_name)
+                return
+            
             message = data.get('message', '').strip()
             
             if not message:
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     'type': 'error',
                     'message': 'Message cannot be empty'
-                }))
+                })
                 return
             
             chat_message = await self.save_message(self.chat_room_id, self.user, message)
             
             if not chat_message:
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     'type': 'error',
                     'message': 'Failed to save message'
-                }))
+                })
                 return
             
             message_data = {
                 'type': 'chat_message',
-                'message': {
-                    'id': chat_message.id,
-                    'sender': {
-                        'id': self.user.id,
-                        'email': self.user.email,
-                        'first_name': self.user.first_name,
-                        'last_name': self.user.last_name,
-                    },
-                    'message': message,
-                    'timestamp': chat_message.timestamp.isoformat(),
-                    'is_read': chat_message.is_read
-                }
+                'room_id': int(self.chat_room_id),
+                'message': serialize_message(chat_message, self.user)
             }
             
             await self.channel_layer.group_send(
@@ -91,13 +151,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
         
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 'type': 'error',
                 'message': str(e)
-            }))
+            })
     
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
     
     @database_sync_to_async
     def get_chat_room(self, room_id):
@@ -131,22 +191,281 @@ class ChatConsumer(AsyncWebsocketConsumer):
     def get_chat_history(self, room_id):
         try:
             chat_room = ChatRoom.objects.get(id=room_id)
-            messages = chat_room.messages.all().order_by('timestamp')[:100]
+            messages = chat_room.messages.with_read_state().select_related('sender').order_by('-timestamp')[:100]
             
-            return [
-                {
-                    'id': msg.id,
-                    'sender': {
-                        'id': msg.sender.id,
-                        'email': msg.sender.email,
-                        'first_name': msg.sender.first_name,
-                        'last_name': msg.sender.last_name,
-                    },
-                    'message': msg.message,
-                    'timestamp': msg.timestamp.isoformat(),
-                    'is_read': msg.is_read
-                }
-                for msg in messages
-            ]
+            return [serialize_message(msg, msg.sender) for msg in reversed(messages)]
         except ChatRoom.DoesNotExist:
             return []
+
+
+class UserChatConsumer(ChatConsumer):
+    async def connect(self):
+        self.user = self.scope['user']
+        self.rooms = {}
+        
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        
+        rooms = await self.get_active_rooms()
+        await asyncio.gather(*[
+            self.channel_layer.group_add(room_group_name(room_id), self.channel_name)
+            for room_id in rooms
+        ])
+        self.rooms.update(rooms)
+        
+        await self.accept()
+        await self.send_event({
+            'type': 'subscribed',
+            'rooms': sorted(self.rooms)
+        })
+        
+        await self.join_presence()
+        await self.watch_presence(list(self.rooms.items()))
+    
+    async def disconnect(self, close_code):
+        await asyncio.gather(*[
+            self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+            for room_id in getattr(self, 'rooms', ())
+        ])
+        await self.leave_presence()
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        if await self.throttle():
+            return
+        
+        try:
+            data = self.decode_frame(text_data, bytes_data)
+            action = data.get('type', 'chat_message')
+            
+            if action == 'heartbeat':
+                await self.heartbeat()
+                return
+            
+            try:
+                room_id = int(data.get('room_id'))
+            except (TypeError, ValueError):
+                await self.send_error('room_id is required')
+                return
+            
+            if action == 'subscribe':
+                await self.subscribe(room_id)
+            elif action == 'unsubscribe':
+                await self.unsubscribe(room_id)
+            elif room_id not in self.rooms:
+                await self.send_error('Not subscribed to this chat room', room_id)
+            elif action == 'typing':
+                await self.typing(room_id, room_group_name(room_id))
+            elif action == 'chat_history':
+                await self.send_event({
+                    'type': 'chat_history',
+                    'room_id': room_id,
+                    'messages': await self.get_chat_history(room_id)
+                })
+            elif action == 'chat_message':
+                await self.post_message(room_id, data.get('message', '').strip())
+            else:
+                await self.send_error(f'Unknown type: {action}', room_id)
+        
+        except Exception as e:
+            await self.send_error(str(e))
+    
+    async def subscribe(self, room_id):
+        if room_id in self.rooms:
+            await self.send_event({
+                'type': 'subscribed',
+                'rooms': [room_id]
+            })
+            return
+        
+        chat_room = await self.get_chat_room(room_id)
+        if not chat_room:
+            await self.send_error('Chat room not found', room_id)
+            return
+        
+        await self.channel_layer.group_add(room_group_name(room_id), self.channel_name)
+        self.rooms[room_id] = counterpart_id(chat_room, self.user)
+        
+        await self.send_event({
+            'type': 'subscribed',
+            'rooms': [room_id]
+        })
+        await self.watch_presence([(room_id, self.rooms[room_id])])
+    
+    async def unsubscribe(self, room_id):
+        if room_id in self.rooms:
+            await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+            await self.unwatch_presence(room_id, self.rooms.pop(room_id))
+        
+        await self.send_event({
+            'type': 'unsubscribed',
+            'rooms': [room_id]
+        })
+    
+    async def post_message(self, room_id, message):
+        if not message:
+            await self.send_error('Message cannot be empty', room_id)
+            return
+        
+        chat_message = await self.save_message(room_id, self.user, message)
+        
+        if not chat_message:
+            await self.send_error('Failed to save message', room_id)
+            return
+        
+        await self.channel_layer.group_send(room_group_name(room_id), {
+            'type': 'chat_message',
+            'room_id': room_id,
+            'message': serialize_message(chat_message, self.user)
+        })
+    
+    async def send_error(self, message, room_id=None):
+        await self.send_event({
+            'type': 'error',
+            'room_id': room_id,
+            'message': message
+        })
+    
+    @database_sync_to_async
+    def get_active_rooms(self):
+        if self.user.is_staff:
+            rooms = ChatRoom.objects.filter(admin=self.user, is_active=True).values_list('id', 'user_id')
+        else:
+            rooms = ChatRoom.objects.filter(user=self.user, is_active=True).values_list('id', 'admin_id')
+        return dict(rooms)
+
+
+def channel_layer_is_shared(channel_layer):
+    # The in-memory layer only reaches consumers in the same process, so a
+    # separate chat-broadcast worker would never see the job.
+    return not isinstance(channel_layer, InMemoryChannelLayer)
+
+async def run_broadcast(broadcast_id, channel_layer, claimed_at=None):
+    broadcast = await database_sync_to_async(start_broadcast)(broadcast_id, claimed_at)
+    if not broadcast:
+        return
+    
+    try:
+        while True:
+            delivered = await database_sync_to_async(deliver_chunk)(broadcast)
+            if delivered is None:
+                # Another worker took the job over while this one stalled.
+                return
+            if not delivered:
+                break
+            
+            batch_size = settings.CHAT_BROADCAST_SEND_BATCH
+            for i in range(0, len(delivered), batch_size):
+                await asyncio.gather(*[
+                    channel_layer.group_send(room_group_name(room_id), message_data)
+                    for room_id, message_data in delivered[i:i + batch_size]
+                ])
+                await asyncio.sleep(settings.CHAT_BROADCAST_PAUSE_MS / 1000)
+        
+        await database_sync_to_async(finish_broadcast)(broadcast, 'completed')
+    except Exception as e:
+        await database_sync_to_async(finish_broadcast)(broadcast, 'failed', str(e))
+        raise
+
+def start_broadcast(broadcast_id, claimed_at=None):
+    broadcasts = ChatBroadcast.objects.filter(pk=broadcast_id)
+    if claimed_at is None:
+        broadcasts = broadcasts.filter(status='pending')
+    else:
+        # A requeued job is only taken over if it has made no progress since
+        # requeue_broadcasts saw it, so a slow but live worker keeps it.
+        broadcasts = broadcasts.filter(status__in=['pending', 'running'], updated_at=claimed_at)
+    updated = broadcasts.update(status='running', updated_at=timezone.now())
+    if not updated:
+        return None
+    return ChatBroadcast.objects.select_related('admin').get(pk=broadcast_id)
+
+def deliver_chunk(broadcast):
+    room_ids = list(
+        broadcast.get_rooms()
+        .filter(pk__gt=broadcast.last_room_id)
+        .order_by('pk')
+        .values_list('pk', flat=True)[:settings.CHAT_BROADCAST_CHUNK_SIZE]
+    )
+    if not room_ids:
+        return []
+    
+    with transaction.atomic():
+        # Heartbeat first: the row lock keeps a requeue from claiming the job
+        # while this chunk is written, and a lost claim writes nothing.
+        now = timezone.now()
+        claimed = ChatBroadcast.objects.filter(pk=broadcast.pk, updated_at=broadcast.updated_at).update(
+            processed_rooms=F('processed_rooms') + len(room_ids),
+            last_room_id=room_ids[-1],
+            updated_at=now,
+        )
+        if not claimed:
+            return None
+        
+        messages = ChatMessage.objects.bulk_create([
+            ChatMessage(chat_room_id=room_id, sender=broadcast.admin, message=broadcast.message)
+            for room_id in room_ids
+        ])
+        sent_at = max(msg.timestamp for msg in messages)
+        ChatRoom.objects.filter(pk__in=room_ids, last_message_at__lte=sent_at).update(
+            last_message_at=sent_at,
+            last_message_preview=broadcast.message[:LAST_MESSAGE_PREVIEW_LENGTH],
+            last_sender_id=broadcast.admin_id,
+            updated_at=sent_at,
+        )
+    broadcast.processed_rooms += len(room_ids)
+    broadcast.last_room_id = room_ids[-1]
+    broadcast.updated_at = now
+    
+    delivered = []
+    for msg in messages:
+        msg.is_read = False
+        delivered.append((msg.chat_room_id, {
+            'type': 'chat_message',
+            'room_id': msg.chat_room_id,
+            'message': serialize_message(msg, broadcast.admin)
+        }))
+    return delivered
+
+def finish_broadcast(broadcast, status, error=''):
+    now = timezone.now()
+    ChatBroadcast.objects.filter(pk=broadcast.pk, updated_at=broadcast.updated_at).update(
+        status=status, error=error, completed_at=now, updated_at=now
+    )
+
+
+class ChatBroadcastConsumer(AsyncConsumer):
+    async def broadcast_run(self, event):
+        claimed_at = event.get('claimed_at')
+        await run_broadcast(event['broadcast_id'], self.channel_layer, claimed_at and parse_datetime(claimed_at))
+
+
+rebalance_tasks = {}
+
+def schedule_rebalance(admin_id):
+    # One pending rebalance per admin: a newer offline event replaces the
+    # older one instead of stacking another grace period.
+    task = rebalance_tasks.pop(admin_id, None)
+    if task is not None:
+        task.cancel()
+    task = rebalance_tasks[admin_id] = asyncio.ensure_future(rebalance_later(admin_id))
+    task.add_done_callback(lambda done: rebalance_done(admin_id, done))
+
+def rebalance_done(admin_id, task):
+    if rebalance_tasks.get(admin_id) is task:
+        del rebalance_tasks[admin_id]
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Rebalancing chat rooms of admin %s failed', admin_id, exc_info=task.exception())
+
+async def rebalance_later(admin_id):
+    # Give the admin a chance to reconnect (page reloads, flaky networks)
+    # before their pending conversations are handed to someone else.
+    await asyncio.sleep(settings.CHAT_ASSIGNMENT_OFFLINE_GRACE)
+    if await sync_to_async(online_users, thread_sensitive=False)([admin_id]):
+        return
+    await database_sync_to_async(rebalance_admin)(admin_id)
+
+
+class ChatAssignmentConsumer(AsyncConsumer):
+    async def admin_offline(self, event):
+        schedule_rebalance(event['admin_id'])
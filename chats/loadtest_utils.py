@@ -0,0 +1,54 @@
+import json
+import resource
+
+# Shared by the chat and chatbot load test and benchmark commands.
+STUB_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {'capacity': 1000},
+    }
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def rss_mb(pid=None):
+    try:
+        with open(f'/proc/{pid or "self"}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return 0.0
+
+
+class CommunicatorClient:
+    def __init__(self, application, path):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        return connected
+
+    async def send(self, data):
+        await self.communicator.send_to(text_data=json.dumps(data))
+
+    async def receive(self):
+        while True:
+            message = await self.communicator.output_queue.get()
+            if message['type'] == 'websocket.close':
+                return None
+            if message.get('text') is not None:
+                return json.loads(message['text'])
+
+    async def close(self):
+        await self.communicator.disconnect()
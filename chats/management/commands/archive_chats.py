@@ -0,0 +1,41 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F, Max, Q
+from django.utils import timezone
+from chats.archive import archive_room, archive_storage
+from chats.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = 'Move messages from inactive rooms, and messages older than the retention period, into gzipped JSONL archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHAT_RETENTION_DAYS, help='Archive messages older than this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.CHAT_ARCHIVE_BATCH_SIZE, help='Messages per archive chunk and delete')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        rooms = (
+            ChatRoom.objects.annotate(
+                through_id=Max('messages__id', filter=Q(is_active=False) | Q(messages__timestamp__lt=cutoff))
+            )
+            .filter(through_id__gt=F('archived_through_id'))
+            .order_by('pk')
+            .values_list('pk', 'through_id', 'archived_through_id')
+        )
+
+        storage = archive_storage()
+        room_count = message_count = 0
+        for room_id, through_id, archived_through_id in rooms.iterator():
+            room_count += 1
+            if options['dry_run']:
+                self.stdout.write(f'Room {room_id}: messages after id {archived_through_id} through id {through_id}')
+                continue
+            message_count += archive_room(room_id, through_id, options['batch_size'], storage)
+
+        if options['dry_run']:
+            self.stdout.write(f'{room_count} rooms have messages to archive')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Archived {message_count} messages from {room_count} rooms to {storage.location}'))
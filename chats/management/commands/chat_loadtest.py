@@ -0,0 +1,333 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import signal
+import struct
+import subprocess
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from chats.loadtest_utils import STUB_CHANNEL_LAYERS, CommunicatorClient, percentile, rss_mb
+
+STUB_LLM_SETTINGS = {
+    'CHATBOT_LLM_BACKEND': 'stub',
+    'CHATBOT_STUB_FIRST_TOKEN_MS': 50,
+    'CHATBOT_STUB_TOKEN_MS': 5,
+}
+
+BOT_QUESTIONS = [
+    'How do I add a vehicle?',
+    'How do I reset my password?',
+    'When is my next service appointment?',
+    'How do I record a sale?',
+]
+
+
+def create_fixtures(user_count, room_count, admin_count):
+    from rest_framework_simplejwt.tokens import AccessToken
+    from users.models import CustomUser
+    from chats.models import ChatRoom
+
+    def create(email, **extra):
+        user = CustomUser.objects.create_user(email, 'Load', 'Test', None, is_active=True, **extra)
+        return user.id, str(AccessToken.for_user(user))
+
+    admins = [create(f'loadtest-admin{i}@example.com', is_staff=True) for i in range(admin_count)]
+    users = [create(f'loadtest-user{i}@example.com') for i in range(user_count)]
+
+    rooms = ChatRoom.objects.bulk_create([
+        ChatRoom(user_id=users[i % user_count][0], admin_id=admins[i % admin_count][0], subject=f'Load test room {i}', object_id=i)
+        for i in range(room_count)
+    ])
+    return {
+        'admins': admins,
+        'users': users,
+        'rooms': [[room.id, room.user_id, room.admin_id] for room in rooms],
+    }
+
+
+class SocketClient:
+    # Minimal RFC 6455 client over asyncio streams. Daphne pins txaio to
+    # twisted as soon as it is imported, so autobahn's asyncio client is
+    # not usable from a management command.
+    def __init__(self, host, port, path):
+        self.host = host
+        self.port = port
+        self.path = path
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write((
+            f'GET {self.path} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n'
+        ).encode())
+        response = await self.reader.readuntil(b'\r\n\r\n')
+        return response.split(b' ', 2)[1] == b'101'
+
+    async def send(self, data):
+        self.write_frame(0x1, json.dumps(data).encode())
+        await self.writer.drain()
+
+    def write_frame(self, opcode, payload):
+        header = bytearray([0x80 | opcode])
+        if len(payload) < 126:
+            header.append(0x80 | len(payload))
+        elif len(payload) < 65536:
+            header += bytes([0x80 | 126]) + struct.pack('!H', len(payload))
+        else:
+            header += bytes([0x80 | 127]) + struct.pack('!Q', len(payload))
+        mask = os.urandom(4)
+        self.writer.write(bytes(header) + mask + bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload)))
+
+    async def receive(self):
+        while True:
+            try:
+                first, second = await self.reader.readexactly(2)
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+                payload = await self.reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return None
+
+            opcode = first & 0x0F
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self.write_frame(0xA, payload)
+            elif opcode == 0x1:
+                return json.loads(payload)
+
+    async def close(self):
+        self.write_frame(0x8, struct.pack('!H', 1000))
+        await self.writer.drain()
+        self.writer.close()
+
+
+class LoadTest:
+    def __init__(self, make_client, fixtures, options):
+        self.make_client = make_client
+        self.fixtures = fixtures
+        self.options = options
+        self.sent_at = {}
+        self.connect_latency = []
+        self.delivery_latency = {'normal': [], 'flood': []}
+        self.bot_latency = []
+        self.bot_first_token = []
+        self.counts = {'sent': 0, 'delivered': 0, 'throttled': 0, 'errors': 0, 'closed': 0}
+        self.closed = set()
+
+    async def connect(self, path):
+        client = self.make_client(path)
+        start = time.perf_counter()
+        if not await client.connect():
+            raise CommandError(f'Connection to {path} was refused')
+        self.connect_latency.append(time.perf_counter() - start)
+        return client
+
+    async def read_chat(self, client, user_id):
+        while True:
+            event = await client.receive()
+            if event is None:
+                self.counts['closed'] += 1
+                self.closed.add(user_id)
+                return
+            if event.get('type') == 'throttled':
+                self.counts['throttled'] += 1
+            elif event.get('type') == 'error':
+                self.counts['errors'] += 1
+            elif event.get('type') == 'chat_message':
+                text = event['message']['message']
+                if event['message']['sender']['id'] != user_id and text in self.sent_at:
+                    sent_at, kind = self.sent_at[text]
+                    self.delivery_latency[kind].append(time.perf_counter() - sent_at)
+                    self.counts['delivered'] += 1
+
+    async def write_chat(self, client, user_id, room_ids, flood, deadline):
+        interval = 1 / (self.options['flood_rate'] if flood else self.options['rate'])
+        seq = 0
+        while time.perf_counter() < deadline and user_id not in self.closed:
+            seq += 1
+            text = f'lt:{user_id}:{seq}'
+            self.sent_at[text] = (time.perf_counter(), 'flood' if flood else 'normal')
+            await client.send({'type': 'chat_message', 'room_id': random.choice(room_ids), 'message': text})
+            self.counts['sent'] += 1
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+
+    async def run_bot(self, client, deadline):
+        await client.receive()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await client.send({'message': random.choice(BOT_QUESTIONS)})
+            first_token = None
+            while True:
+                event = await client.receive()
+                if event is None:
+                    return
+                if first_token is None and event.get('type') == 'delta':
+                    first_token = time.perf_counter() - start
+                    self.bot_first_token.append(first_token)
+                if 'message' in event or 'error' in event:
+                    break
+            self.bot_latency.append(time.perf_counter() - start)
+            await asyncio.sleep(1 / self.options['rate'])
+
+    async def run(self):
+        rooms_by_user = {}
+        for room_id, user_id, _ in self.fixtures['rooms']:
+            rooms_by_user.setdefault(user_id, []).append(room_id)
+
+        semaphore = asyncio.Semaphore(self.options['connect_concurrency'])
+
+        async def open_socket(path):
+            async with semaphore:
+                return await self.connect(path)
+
+        chatters = [(user_id, token) for user_id, token in self.fixtures['users'] if user_id in rooms_by_user]
+        admin_clients = await asyncio.gather(*[open_socket(f'/ws/chat/?token={token}') for _, token in self.fixtures['admins']])
+        user_clients = await asyncio.gather(*[open_socket(f'/ws/chat/?token={token}') for _, token in chatters])
+        bot_clients = await asyncio.gather(*[
+            open_socket(f'/ws/chatbot/?token={token}')
+            for _, token in self.fixtures['users'][-self.options['chatbot']:]
+        ]) if self.options['chatbot'] else []
+
+        readers = [
+            asyncio.ensure_future(self.read_chat(client, user_id))
+            for client, (user_id, _) in zip(admin_clients + user_clients, self.fixtures['admins'] + chatters)
+        ]
+
+        start = time.perf_counter()
+        deadline = start + self.options['duration']
+        await asyncio.gather(
+            *[
+                self.write_chat(client, user_id, rooms_by_user[user_id], index < self.options['flood'], deadline)
+                for index, (client, (user_id, _)) in enumerate(zip(user_clients, chatters))
+            ],
+            *[self.run_bot(client, deadline) for client in bot_clients],
+        )
+        await asyncio.sleep(self.options['grace'])
+        elapsed = time.perf_counter() - start
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*[client.close() for client in admin_clients + user_clients + bot_clients], return_exceptions=True)
+        return elapsed
+
+
+class Command(BaseCommand):
+    help = 'Load test the chat and chatbot WebSocket consumers with local channel layer and LLM stand-ins'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transport', choices=['communicator', 'daphne'], default='communicator')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--admins', type=int, default=2)
+        parser.add_argument('--rate', type=float, default=1.0, help='Messages per second per user')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to send messages for')
+        parser.add_argument('--grace', type=float, default=1.0, help='Seconds to wait for in-flight deliveries')
+        parser.add_argument('--flood', type=int, default=0, help='Users that send far above the rate limit')
+        parser.add_argument('--flood-rate', type=float, default=100.0, help='Messages per second per flooding user')
+        parser.add_argument('--chatbot', type=int, default=0, help='Users (taken from the end of the list) that also talk to the chatbot')
+        parser.add_argument('--connect-concurrency', type=int, default=50)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--serve', action='store_true', help='Internal: run the stubbed daphne server')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['rooms'] < 1 or options['admins'] < 1:
+            raise CommandError('--users, --rooms and --admins must be at least 1')
+
+        if options['transport'] == 'daphne' and not options['serve']:
+            self.run_daphne(options)
+            return
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, serialize=False)
+        try:
+            with override_settings(CHANNEL_LAYERS=STUB_CHANNEL_LAYERS, **STUB_LLM_SETTINGS):
+                if options['serve']:
+                    self.serve(options)
+                else:
+                    self.run_communicator(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run_communicator(self, options):
+        from SellsAndServices.asgi import application
+
+        fixtures = create_fixtures(options['users'], options['rooms'], options['admins'])
+        test = LoadTest(lambda path: CommunicatorClient(application, path), fixtures, options)
+        elapsed = asyncio.run(test.run())
+        self.report(test, elapsed, rss_mb())
+
+    def run_daphne(self, options):
+        command = [sys.executable, sys.argv[0], 'chat_loadtest', '--serve', '--port', str(options['port'])]
+        for name in ('users', 'rooms', 'admins'):
+            command += [f'--{name}', str(options[name])]
+
+        server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, env=os.environ.copy())
+        try:
+            line = server.stdout.readline()
+            if not line:
+                raise CommandError('Load test server exited before it was ready')
+            fixtures = json.loads(line)
+            test = LoadTest(lambda path: SocketClient('127.0.0.1', options['port'], path), fixtures, options)
+            elapsed = asyncio.run(test.run())
+            self.report(test, elapsed, rss_mb(server.pid))
+        finally:
+            server.send_signal(signal.SIGINT)
+            server.wait()
+
+    def serve(self, options):
+        from daphne.endpoints import build_endpoint_description_strings
+        from daphne.server import Server
+        from SellsAndServices.asgi import application
+
+        fixtures = create_fixtures(options['users'], options['rooms'], options['admins'])
+
+        def ready():
+            sys.stdout.write(json.dumps(fixtures) + '\n')
+            sys.stdout.flush()
+
+        Server(
+            application=application,
+            endpoints=build_endpoint_description_strings(host='127.0.0.1', port=options['port']),
+            ready_callable=ready,
+            verbosity=0,
+        ).run()
+
+    def report(self, test, elapsed, server_rss):
+        def line(label, values):
+            values_ms = [value * 1000 for value in values]
+            self.stdout.write(
+                f'{label:<22}n={len(values_ms):<7}p50={percentile(values_ms, 50):8.2f}ms '
+                f'p95={percentile(values_ms, 95):8.2f}ms p99={percentile(values_ms, 99):8.2f}ms '
+                f'max={max(values_ms, default=0):8.2f}ms'
+            )
+
+        line('connect', test.connect_latency)
+        line('delivery', test.delivery_latency['normal'])
+        if test.delivery_latency['flood']:
+            line('delivery (flooders)', test.delivery_latency['flood'])
+        if test.bot_latency:
+            line('chatbot first token', test.bot_first_token)
+            line('chatbot round trip', test.bot_latency)
+
+        counts = test.counts
+        self.stdout.write(
+            f"sent={counts['sent']} delivered={counts['delivered']} throttled={counts['throttled']} "
+            f"errors={counts['errors']} closed={counts['closed']}"
+        )
+        self.stdout.write(f"throughput={counts['delivered'] / elapsed:.1f} msg/s over {elapsed:.1f}s")
+        self.stdout.write(f'server rss={server_rss:.1f} MB')
@@ -0,0 +1,74 @@
+import json
+import random
+import time
+import msgpack
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chats.protocol import CompactEncoder
+
+
+class Command(BaseCommand):
+    help = 'Compare bytes on the wire and CPU per message for the JSON and msgpack chat protocols'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000)
+        parser.add_argument('--senders', type=int, default=2)
+        parser.add_argument('--batch', type=int, default=8, help='Events coalesced into one msgpack frame')
+        parser.add_argument('--length', type=int, default=80, help='Average message length in characters')
+
+    def handle(self, *args, **options):
+        events = self.build_events(options['messages'], options['senders'], options['length'])
+        batch = max(options['batch'], 1)
+
+        start = time.process_time()
+        json_frames = [json.dumps(event) for event in events]
+        json_cpu = time.process_time() - start
+        json_bytes = sum(len(frame.encode()) for frame in json_frames)
+
+        start = time.process_time()
+        encoder = CompactEncoder()
+        msgpack_frames = []
+        for i in range(0, len(events), batch):
+            compact = []
+            for event in events[i:i + batch]:
+                compact.extend(encoder.encode(event))
+            msgpack_frames.append(msgpack.packb(compact))
+        msgpack_cpu = time.process_time() - start
+        msgpack_bytes = sum(len(frame) for frame in msgpack_frames)
+
+        count = len(events)
+        self.stdout.write(f"{'protocol':<10}{'frames':>10}{'bytes':>12}{'bytes/msg':>12}{'us/msg':>10}")
+        for name, frames, size, cpu in (
+            ('json', json_frames, json_bytes, json_cpu),
+            ('msgpack', msgpack_frames, msgpack_bytes, msgpack_cpu),
+        ):
+            self.stdout.write(f"{name:<10}{len(frames):>10}{size:>12}{size / count:>12.1f}{cpu / count * 1e6:>10.2f}")
+
+        self.stdout.write(self.style.SUCCESS(f'msgpack uses {msgpack_bytes / json_bytes:.0%} of the JSON bytes'))
+
+    def build_events(self, count, senders, length):
+        rng = random.Random(0)
+        words = ['service', 'unit', 'brake', 'oil', 'appointment', 'tomorrow', 'thanks', 'invoice', 'vin', 'ok']
+        users = [
+            {'id': i, 'email': f'user{i}@example.com', 'first_name': f'First{i}', 'last_name': f'Last{i}'}
+            for i in range(1, senders + 1)
+        ]
+        now = timezone.now()
+
+        events = []
+        for i in range(count):
+            text = ''
+            while len(text) < length:
+                text += rng.choice(words) + ' '
+            events.append({
+                'type': 'chat_message',
+                'room_id': 1,
+                'message': {
+                    'id': i + 1,
+                    'sender': rng.choice(users),
+                    'message': text.strip(),
+                    'timestamp': now.isoformat(),
+                    'is_read': False
+                }
+            })
+        return events
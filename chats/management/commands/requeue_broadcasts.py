@@ -0,0 +1,55 @@
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from chats.consumers import BROADCAST_CHANNEL, channel_layer_is_shared, run_broadcast
+from chats.models import ChatBroadcast
+
+
+class Command(BaseCommand):
+    help = 'Queue pending or running broadcasts that have made no progress again, e.g. after a worker crashed. Without a shared channel layer, run them and any new broadcasts here'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', type=int, default=settings.CHAT_BROADCAST_STALE_SECONDS, help='Seconds without progress before a broadcast is requeued')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the stale broadcasts')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['stale'])
+        channel_layer = get_channel_layer()
+        shared = channel_layer_is_shared(channel_layer)
+        due = Q(updated_at__lt=cutoff)
+        if not shared:
+            # No worker was sent new broadcasts, so they wait for this command.
+            due |= Q(status='pending')
+        broadcasts = list(
+            ChatBroadcast.objects.filter(due, status__in=['pending', 'running'])
+            .order_by('pk')
+            .values_list('pk', 'processed_rooms', 'total_rooms', 'updated_at')
+        )
+
+        for broadcast_id, processed_rooms, total_rooms, updated_at in broadcasts:
+            self.stdout.write(f'Broadcast {broadcast_id}: {processed_rooms} of {total_rooms} rooms done')
+            if options['dry_run']:
+                continue
+            # The worker claims the job only if it is still at updated_at, so a
+            # job queued twice, or one whose worker woke up again, runs once.
+            if shared:
+                async_to_sync(channel_layer.send)(BROADCAST_CHANNEL, {
+                    'type': 'broadcast.run',
+                    'broadcast_id': broadcast_id,
+                    'claimed_at': updated_at.isoformat(),
+                })
+            else:
+                # Without a shared layer no worker would get the job. Messages
+                # are saved, but only sockets in this process are notified.
+                async_to_sync(run_broadcast)(broadcast_id, channel_layer, updated_at)
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(broadcasts)} broadcasts are stale')
+        elif shared:
+            self.stdout.write(self.style.SUCCESS(f'Requeued {len(broadcasts)} broadcasts on {BROADCAST_CHANNEL}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Ran {len(broadcasts)} broadcasts in this process'))
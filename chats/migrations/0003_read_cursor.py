@@ -0,0 +1,77 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def seed_read_cursors(apps, schema_editor):
+    ChatRoom = apps.get_model('chats', 'ChatRoom')
+    ChatMessage = apps.get_model('chats', 'ChatMessage')
+    ChatReadCursor = apps.get_model('chats', 'ChatReadCursor')
+
+    participants = {
+        room['id']: (room['user_id'], room['admin_id'])
+        for room in ChatRoom.objects.values('id', 'user_id', 'admin_id')
+    }
+
+    cursors = {}
+    read = ChatMessage.objects.filter(is_read=True).values('chat_room_id', 'sender_id').annotate(last=Max('id'))
+    for row in read:
+        user_id, admin_id = participants[row['chat_room_id']]
+        reader_id = admin_id if row['sender_id'] == user_id else user_id
+        key = (reader_id, row['chat_room_id'])
+        cursors[key] = max(cursors.get(key, 0), row['last'])
+
+    ChatReadCursor.objects.bulk_create([
+        ChatReadCursor(user_id=user_id, chat_room_id=room_id, last_read_message_id=last)
+        for (user_id, room_id), last in cursors.items()
+    ], batch_size=1000)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_chatroom_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Chat Read Cursor',
+                'verbose_name_plural': 'Chat Read Cursors',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['chat_room', 'id'], name='chats_chatm_chat_ro_f67a1d_idx'),
+        ),
+        migrations.AddField(
+            model_name='chatreadcursor',
+            name='chat_room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='chats.chatroom'),
+        ),
+        migrations.AddField(
+            model_name='chatreadcursor',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_cursors', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='chatreadcursor',
+            unique_together={('user', 'chat_room')},
+        ),
+        migrations.RunPython(seed_read_cursors, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='chatmessage',
+            name='is_read',
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Left
+
+
+def backfill_last_message(apps, schema_editor):
+    ChatRoom = apps.get_model('chats', 'ChatRoom')
+    ChatMessage = apps.get_model('chats', 'ChatMessage')
+
+    ChatRoom.objects.update(last_message_at=F('created_at'))
+
+    latest = ChatMessage.objects.filter(chat_room=OuterRef('pk')).order_by('-timestamp', '-id')
+    ChatRoom.objects.filter(messages__isnull=False).update(
+        last_message_at=Subquery(latest.values('timestamp')[:1]),
+        last_message_preview=Subquery(latest.annotate(preview=Left('message', 100)).values('preview')[:1]),
+        last_sender_id=Subquery(latest.values('sender_id')[:1]),
+    )
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0003_read_cursor'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='chatroom',
+            options={'ordering': ['-last_message_at'], 'verbose_name': 'Chat Room', 'verbose_name_plural': 'Chat Rooms'},
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Time of the last message, or of room creation'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['admin', '-last_message_at'], name='chat_room_admin_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['user', '-last_message_at'], name='chat_room_user_inbox_idx'),
+        ),
+    ]
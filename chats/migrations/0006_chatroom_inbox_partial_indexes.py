@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_chatbroadcast'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chatroom',
+            name='chat_room_admin_inbox_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='chatroom',
+            name='chat_room_user_inbox_idx',
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['admin', '-last_message_at'], name='chat_room_admin_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', '-last_message_at'], name='chat_room_user_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['admin', 'content_type', '-last_message_at'], name='chat_room_admin_related_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE chats_chatmessage_fts USING fts5("
+    "message, content='chats_chatmessage', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER chats_chatmessage_fts_insert AFTER INSERT ON chats_chatmessage BEGIN "
+    "INSERT INTO chats_chatmessage_fts(rowid, message) VALUES (new.id, new.message); END",
+    "CREATE TRIGGER chats_chatmessage_fts_delete AFTER DELETE ON chats_chatmessage BEGIN "
+    "INSERT INTO chats_chatmessage_fts(chats_chatmessage_fts, rowid, message) VALUES ('delete', old.id, old.message); END",
+    "CREATE TRIGGER chats_chatmessage_fts_update AFTER UPDATE OF message ON chats_chatmessage BEGIN "
+    "INSERT INTO chats_chatmessage_fts(chats_chatmessage_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+    "INSERT INTO chats_chatmessage_fts(rowid, message) VALUES (new.id, new.message); END",
+    "INSERT INTO chats_chatmessage_fts(chats_chatmessage_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS chats_chatmessage_fts_update",
+    "DROP TRIGGER IF EXISTS chats_chatmessage_fts_delete",
+    "DROP TRIGGER IF EXISTS chats_chatmessage_fts_insert",
+    "DROP TABLE IF EXISTS chats_chatmessage_fts",
+]
+
+
+def search_index():
+    # Only built on PostgreSQL, so other backends never load the contrib app.
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    return GinIndex(SearchVector('message', config='english'), name='chat_message_search_idx')
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('chats', 'ChatMessage'), search_index())
+    elif vendor == 'sqlite':
+        for statement in SQLITE_FORWARD:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('chats', 'ChatMessage'), search_index())
+    elif vendor == 'sqlite':
+        for statement in SQLITE_REVERSE:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0006_chatroom_inbox_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0007_chatmessage_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='archived_through_id',
+            field=models.BigIntegerField(default=0, help_text='Messages up to this id have been moved to the cold archive'),
+        ),
+    ]
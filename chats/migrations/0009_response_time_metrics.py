@@ -0,0 +1,90 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_awaiting_reply(apps, schema_editor):
+    ChatRoom = apps.get_model('chats', 'ChatRoom')
+    ChatMessage = apps.get_model('chats', 'ChatMessage')
+
+    last_reply = (
+        ChatMessage.objects.filter(chat_room=OuterRef(OuterRef('pk')))
+        .exclude(sender=OuterRef(OuterRef('user')))
+        .order_by('-id')
+        .values('id')[:1]
+    )
+    first_waiting = (
+        ChatMessage.objects.filter(chat_room=OuterRef('pk'), sender=OuterRef('user'))
+        .filter(id__gt=Coalesce(Subquery(last_reply), Value(0)))
+        .order_by('id')
+        .values('timestamp')[:1]
+    )
+    ChatRoom.objects.update(awaiting_reply_since=Subquery(first_waiting))
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0008_chatroom_archived_through_id'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatResponseDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('kind', models.CharField(choices=[('reply', 'Reply'), ('first_response', 'First response')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+                ('max_seconds', models.FloatField(default=0)),
+                ('buckets', models.JSONField(default=list, help_text='Counts per RESPONSE_TIME_BUCKETS bucket, plus one overflow bucket')),
+            ],
+            options={
+                'verbose_name': 'Chat Response Day',
+                'verbose_name_plural': 'Chat Response Days',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='awaiting_reply_since',
+            field=models.DateTimeField(blank=True, help_text='Time of the oldest customer message that has no staff reply yet', null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='first_response_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='reply_seconds_total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(condition=models.Q(('awaiting_reply_since__isnull', False)), fields=['admin', 'awaiting_reply_since'], name='chat_room_awaiting_idx'),
+        ),
+        migrations.AddField(
+            model_name='chatresponsedaily',
+            name='admin',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_response_days', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='chatresponsedaily',
+            unique_together={('admin', 'date', 'kind')},
+        ),
+        migrations.RunPython(backfill_awaiting_reply, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0009_response_time_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbroadcast',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
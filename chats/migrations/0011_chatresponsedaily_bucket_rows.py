@@ -0,0 +1,74 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+# Kept here so later changes to the model constant do not change history.
+RESPONSE_TIME_BUCKETS = [60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400, 259200]
+
+
+def split_buckets(apps, schema_editor):
+    ChatResponseDaily = apps.get_model('chats', 'ChatResponseDaily')
+    for row in ChatResponseDaily.objects.all():
+        counts = [(bucket, count) for bucket, count in enumerate(row.buckets or []) if count]
+        if not counts:
+            row.delete()
+            continue
+        split = []
+        for bucket, count in counts:
+            # Only the day totals were kept, so spread the total evenly and cap
+            # each bucket's maximum at its upper bound.
+            upper = RESPONSE_TIME_BUCKETS[bucket] if bucket < len(RESPONSE_TIME_BUCKETS) else row.max_seconds
+            split.append(ChatResponseDaily(
+                admin_id=row.admin_id, date=row.date, kind=row.kind, bucket=bucket, count=count,
+                total_seconds=row.total_seconds * count / row.count,
+                max_seconds=min(upper, row.max_seconds),
+            ))
+        row.delete()
+        ChatResponseDaily.objects.bulk_create(split)
+
+
+def merge_buckets(apps, schema_editor):
+    ChatResponseDaily = apps.get_model('chats', 'ChatResponseDaily')
+    merged = {}
+    for row in ChatResponseDaily.objects.order_by('pk'):
+        key = (row.admin_id, row.date, row.kind)
+        if key not in merged:
+            merged[key] = ChatResponseDaily(
+                admin_id=row.admin_id, date=row.date, kind=row.kind,
+                buckets=[0] * (len(RESPONSE_TIME_BUCKETS) + 1),
+            )
+        day = merged[key]
+        day.count += row.count
+        day.total_seconds += row.total_seconds
+        day.max_seconds = max(day.max_seconds, row.max_seconds)
+        day.buckets[row.bucket] += row.count
+    ChatResponseDaily.objects.all().delete()
+    ChatResponseDaily.objects.bulk_create(merged.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0010_chatbroadcast_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='chatresponsedaily',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='chatresponsedaily',
+            name='bucket',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Index into RESPONSE_TIME_BUCKETS, or its length for the overflow bucket'),
+        ),
+        migrations.RunPython(split_buckets, merge_buckets),
+        migrations.RemoveField(
+            model_name='chatresponsedaily',
+            name='buckets',
+        ),
+        migrations.AlterUniqueTogether(
+            name='chatresponsedaily',
+            unique_together={('admin', 'date', 'kind', 'bucket')},
+        ),
+    ]
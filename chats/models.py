@@ -1,8 +1,45 @@
-from django.db import models
+from bisect import bisect_left
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, Count, Exists, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
 from users.models import CustomUser
 from main.models import Unit, Service, Sell
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+LAST_MESSAGE_PREVIEW_LENGTH = 100
+
+RELATED_MODELS = {'unit': Unit, 'service': Service, 'sell': Sell}
+
+# Upper bounds, in seconds, of the response time histogram buckets. The last
+# bucket counts everything slower than three days.
+RESPONSE_TIME_BUCKETS = [60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400, 259200]
+
+class ChatRoomQuerySet(models.QuerySet):
+    def with_unread_count(self, user):
+        last_read = ChatReadCursor.objects.filter(user=user, chat_room=OuterRef('pk')).values('last_read_message_id')[:1]
+        unread = (
+            ChatMessage.objects.filter(chat_room=OuterRef('pk'), pk__gt=OuterRef('last_read_id'))
+            .exclude(sender=user)
+            .order_by()
+            .values('chat_room')
+            .annotate(count=Count('pk'))
+            .values('count')
+        )
+        return self.annotate(
+            last_read_id=Coalesce(Subquery(last_read), Value(0)),
+            unread_count=Coalesce(Subquery(unread), Value(0)),
+        )
+    
+    def unread_only(self, user):
+        unread = ChatMessage.objects.filter(chat_room=OuterRef('pk'), pk__gt=OuterRef('last_read_id')).exclude(sender=user)
+        return self.filter(Exists(unread))
+    
+    def related_to(self, related_type):
+        if related_type == 'none':
+            return self.filter(content_type__isnull=True)
+        return self.filter(content_type=ContentType.objects.get_for_model(RELATED_MODELS[related_type]))
 
 class ChatRoom(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='chat_rooms')
@@ -14,23 +51,52 @@ class ChatRoom(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    last_message_at = models.DateTimeField(default=timezone.now, help_text='Time of the last message, or of room creation')
+    last_message_preview = models.CharField(max_length=LAST_MESSAGE_PREVIEW_LENGTH, blank=True, default='')
+    last_sender = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    archived_through_id = models.BigIntegerField(default=0, help_text='Messages up to this id have been moved to the cold archive')
+    awaiting_reply_since = models.DateTimeField(null=True, blank=True, help_text='Time of the oldest customer message that has no staff reply yet')
+    first_response_seconds = models.FloatField(null=True, blank=True)
+    reply_count = models.PositiveIntegerField(default=0)
+    reply_seconds_total = models.FloatField(default=0)
+    
+    objects = ChatRoomQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Chat Room'
         verbose_name_plural = 'Chat Rooms'
-        ordering = ['-updated_at']
+        ordering = ['-last_message_at']
         unique_together = [['user', 'content_type', 'object_id']]
+        indexes = [
+            models.Index(fields=['admin', '-last_message_at'], name='chat_room_admin_inbox_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['user', '-last_message_at'], name='chat_room_user_inbox_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['admin', 'content_type', '-last_message_at'], name='chat_room_admin_related_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['admin', 'awaiting_reply_since'], name='chat_room_awaiting_idx', condition=models.Q(awaiting_reply_since__isnull=False)),
+        ]
     
     def __str__(self):
         related_obj = f" - {self.content_object}" if self.content_object else ""
         return f"Chat: {self.user.email} with Admin{related_obj}"
 
+class ChatMessageQuerySet(models.QuerySet):
+    def with_read_state(self):
+        read = ChatReadCursor.objects.filter(
+            chat_room=OuterRef('chat_room'),
+            last_read_message_id__gte=OuterRef('pk'),
+        ).exclude(user=OuterRef('sender'))
+        return self.annotate(is_read=Exists(read))
+    
+    def unread_by(self, user):
+        last_read = ChatReadCursor.objects.filter(user=user, chat_room=OuterRef('chat_room')).values('last_read_message_id')[:1]
+        return self.exclude(sender=user).filter(pk__gt=Coalesce(Subquery(last_read), Value(0)))
+
 class ChatMessage(models.Model):
     chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='sent_messages')
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+    
+    objects = ChatMessageQuerySet.as_manager()
     
     class Meta:
         ordering = ['timestamp']
@@ -38,7 +104,183 @@ class ChatMessage(models.Model):
         verbose_name_plural = 'Chat Messages'
         indexes = [
             models.Index(fields=['chat_room', '-timestamp']),
+            models.Index(fields=['chat_room', 'id']),
         ]
     
     def __str__(self):
         return f"{self.sender.email} in {self.chat_room}: {self.message[:50]}"
+    
+    @property
+    def is_read(self):
+        # Set by with_read_state(); None rather than a query per message when
+        # the queryset was not annotated.
+        return getattr(self, '_is_read', None)
+    
+    @is_read.setter
+    def is_read(self, value):
+        self._is_read = value
+    
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if not adding:
+            super().save(*args, **kwargs)
+            return
+        
+        with transaction.atomic():
+            room = ChatRoom.objects.filter(pk=self.chat_room_id).values(
+                'user_id', 'admin_id', 'is_active', 'awaiting_reply_since', 'first_response_seconds'
+            ).get()
+            # Read by the count_backlog signal instead of another room query.
+            self._room_admin_id = room['admin_id'] if room['is_active'] else None
+            super().save(*args, **kwargs)
+            self.update_room(room)
+        self._is_read = False
+    
+    def update_room(self, room):
+        # One UPDATE keeps both the last message summary and the response
+        # time counters current. The summary only moves forward in time.
+        newer = Q(last_message_at__lte=self.timestamp)
+        updates = {
+            field: Case(When(newer, then=Value(value)), default=F(field), output_field=ChatRoom._meta.get_field(field))
+            for field, value in [
+                ('last_message_at', self.timestamp),
+                ('last_message_preview', self.message[:LAST_MESSAGE_PREVIEW_LENGTH]),
+                ('last_sender_id', self.sender_id),
+                ('updated_at', self.timestamp),
+            ]
+        }
+        rooms = ChatRoom.objects.filter(pk=self.chat_room_id)
+        
+        if self.sender_id == room['user_id']:
+            updates['awaiting_reply_since'] = Coalesce(F('awaiting_reply_since'), Value(self.timestamp))
+        elif room['awaiting_reply_since'] is not None:
+            seconds = max((self.timestamp - room['awaiting_reply_since']).total_seconds(), 0)
+            # Compare-and-set on the wait being answered, so two concurrent
+            # replies count it once.
+            if rooms.filter(awaiting_reply_since=room['awaiting_reply_since']).update(
+                awaiting_reply_since=None,
+                reply_count=F('reply_count') + 1,
+                reply_seconds_total=F('reply_seconds_total') + seconds,
+                first_response_seconds=Coalesce(F('first_response_seconds'), Value(seconds)),
+                **updates
+            ):
+                day = timezone.localdate(self.timestamp)
+                ChatResponseDaily.record(self.sender_id, day, 'reply', seconds)
+                if room['first_response_seconds'] is None:
+                    ChatResponseDaily.record(self.sender_id, day, 'first_response', seconds)
+                return
+        
+        rooms.update(**updates)
+
+class ChatReadCursor(models.Model):
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='chat_read_cursors')
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_cursors')
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Chat Read Cursor'
+        verbose_name_plural = 'Chat Read Cursors'
+        unique_together = [['user', 'chat_room']]
+    
+    def __str__(self):
+        return f"{self.user.email} read {self.chat_room_id} up to {self.last_read_message_id}"
+    
+    @classmethod
+    def advance(cls, user_id, chat_room_id, message_id):
+        # One upsert that only ever moves the cursor forward: a request that
+        # saw fewer messages can finish after one that saw more. Returns
+        # whether the row changed.
+        table = cls._meta.db_table
+        now = cls._meta.get_field('updated_at').get_db_prep_value(timezone.now(), connection)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, chat_room_id, last_read_message_id, updated_at) '
+                f'VALUES (%s, %s, %s, %s) '
+                f'ON CONFLICT (user_id, chat_room_id) DO UPDATE SET '
+                f'last_read_message_id = excluded.last_read_message_id, updated_at = excluded.updated_at '
+                f'WHERE {table}.last_read_message_id < excluded.last_read_message_id',
+                [user_id, chat_room_id, message_id, now],
+            )
+            return cursor.rowcount > 0
+
+class ChatBroadcast(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    admin = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='chat_broadcasts', limit_choices_to={'is_staff': True})
+    message = models.TextField()
+    filters = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total_rooms = models.PositiveIntegerField(default=0)
+    processed_rooms = models.PositiveIntegerField(default=0)
+    last_room_id = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Chat Broadcast'
+        verbose_name_plural = 'Chat Broadcasts'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Broadcast by {self.admin.email} to {self.total_rooms} rooms"
+    
+    def get_rooms(self):
+        rooms = ChatRoom.objects.filter(admin=self.admin)
+        if not self.filters.get('include_inactive'):
+            rooms = rooms.filter(is_active=True)
+        if self.filters.get('related_type'):
+            rooms = rooms.related_to(self.filters['related_type'])
+        if self.filters.get('room_ids'):
+            rooms = rooms.filter(pk__in=self.filters['room_ids'])
+        return rooms
+
+class ChatResponseDaily(models.Model):
+    KIND_CHOICES = [
+        ('reply', 'Reply'),
+        ('first_response', 'First response'),
+    ]
+    
+    admin = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='chat_response_days')
+    date = models.DateField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+    total_seconds = models.FloatField(default=0)
+    max_seconds = models.FloatField(default=0)
+    bucket = models.PositiveSmallIntegerField(default=0, help_text='Index into RESPONSE_TIME_BUCKETS, or its length for the overflow bucket')
+    
+    class Meta:
+        verbose_name = 'Chat Response Day'
+        verbose_name_plural = 'Chat Response Days'
+        unique_together = [['admin', 'date', 'kind', 'bucket']]
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"{self.admin.email} {self.kind} on {self.date}: {self.count}"
+    
+    @classmethod
+    def record(cls, admin_id, date, kind, seconds):
+        # One row per latency bucket, so a response is a single atomic
+        # increment. The row is only created on the first hit of the day.
+        key = {'admin_id': admin_id, 'date': date, 'kind': kind, 'bucket': bisect_left(RESPONSE_TIME_BUCKETS, seconds)}
+        rows = cls.objects.filter(**key)
+        increment = {
+            'count': F('count') + 1,
+            'total_seconds': F('total_seconds') + seconds,
+            'max_seconds': Greatest(F('max_seconds'), Value(seconds)),
+        }
+        if rows.update(**increment):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(count=1, total_seconds=seconds, max_seconds=seconds, **key)
+        except IntegrityError:
+            # Another reply created the row first.
+            rows.update(**increment)
@@ -0,0 +1,124 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+
+def presence_key(user_id):
+    return f'chat_presence_{user_id}'
+
+
+def presence_group_name(user_id):
+    return f'chat_presence_{user_id}'
+
+
+def connect_user(user_id):
+    key = presence_key(user_id)
+    cache.add(key, 0, settings.CHAT_PRESENCE_TTL)
+    try:
+        return cache.incr(key) == 1
+    except ValueError:
+        cache.set(key, 1, settings.CHAT_PRESENCE_TTL)
+        return True
+
+
+def disconnect_user(user_id):
+    key = presence_key(user_id)
+    try:
+        remaining = cache.decr(key)
+    except ValueError:
+        return True
+    if remaining <= 0:
+        cache.delete(key)
+        return True
+    return False
+
+
+def refresh_user(user_id):
+    if cache.touch(presence_key(user_id), settings.CHAT_PRESENCE_TTL):
+        return False
+    return connect_user(user_id)
+
+
+def online_users(user_ids):
+    found = cache.get_many([presence_key(user_id) for user_id in user_ids])
+    return [user_id for user_id in user_ids if presence_key(user_id) in found]
+
+
+def start_typing(room_id, user_id):
+    return cache.add(f'chat_typing_{room_id}_{user_id}', 1, settings.CHAT_TYPING_DEBOUNCE)
+
+
+class PresenceMixin:
+    async def join_presence(self):
+        self.watched = {}
+        if await sync_to_async(connect_user, thread_sensitive=False)(self.user.id):
+            await self.broadcast_presence('online')
+
+    async def leave_presence(self):
+        watched = getattr(self, 'watched', None)
+        if watched is None:
+            return
+        await asyncio.gather(*[
+            self.channel_layer.group_discard(presence_group_name(user_id), self.channel_name)
+            for user_id in watched
+        ])
+        self.watched = None
+        if await sync_to_async(disconnect_user, thread_sensitive=False)(self.user.id):
+            await self.broadcast_presence('offline')
+            await self.went_offline()
+    
+    async def went_offline(self):
+        pass
+
+    async def heartbeat(self):
+        if await sync_to_async(refresh_user, thread_sensitive=False)(self.user.id):
+            await self.broadcast_presence('online')
+
+    async def broadcast_presence(self, status):
+        await self.channel_layer.group_send(presence_group_name(self.user.id), {
+            'type': 'presence',
+            'user_id': self.user.id,
+            'status': status
+        })
+
+    async def watch_presence(self, rooms):
+        new_users = set()
+        for room_id, user_id in rooms:
+            if user_id not in self.watched:
+                self.watched[user_id] = set()
+                new_users.add(user_id)
+            self.watched[user_id].add(room_id)
+
+        await asyncio.gather(*[
+            self.channel_layer.group_add(presence_group_name(user_id), self.channel_name)
+            for user_id in new_users
+        ])
+        online = await sync_to_async(online_users, thread_sensitive=False)(sorted({user_id for _, user_id in rooms}))
+        await self.send_event({
+            'type': 'presence_state',
+            'online': online
+        })
+
+    async def unwatch_presence(self, room_id, user_id):
+        room_ids = self.watched.get(user_id, set())
+        room_ids.discard(room_id)
+        if not room_ids and user_id in self.watched:
+            del self.watched[user_id]
+            await self.channel_layer.group_discard(presence_group_name(user_id), self.channel_name)
+
+    async def typing(self, room_id, group_name):
+        if await sync_to_async(start_typing, thread_sensitive=False)(room_id, self.user.id):
+            await self.channel_layer.group_send(group_name, {
+                'type': 'chat_typing',
+                'room_id': room_id,
+                'user_id': self.user.id
+            })
+
+    async def presence(self, event):
+        if event['user_id'] != self.user.id and self.watched:
+            await self.send_event(dict(event, rooms=sorted(self.watched.get(event['user_id'], ()))))
+
+    async def chat_typing(self, event):
+        if event['user_id'] != self.user.id:
+            await self.send_event(event)
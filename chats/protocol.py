@@ -0,0 +1,119 @@
+import json
+import asyncio
+from datetime import datetime
+import msgpack
+from django.conf import settings
+
+MSGPACK_SUBPROTOCOL = 'msgpack'
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+# Compact msgpack schema. Every binary frame is an array of events, and an
+# event is either one of the arrays below or a plain map for anything else
+# (errors, subscription acks, chatbot replies).
+#
+#   [EVENT_SENDER, user_id, email, first_name, last_name]  once per sender
+#   [EVENT_MESSAGE, room_id, message_id, sender_id, message, timestamp_ms, is_read]
+#   [EVENT_HISTORY, room_id, [[message_id, sender_id, message, timestamp_ms, is_read], ...]]
+EVENT_SENDER = 0
+EVENT_MESSAGE = 1
+EVENT_HISTORY = 2
+
+
+class CompactEncoder:
+    def __init__(self):
+        self.known_senders = set()
+
+    def encode(self, event):
+        event_type = event.get('type')
+
+        if event_type == 'chat_message':
+            events = []
+            row = self._message_row(event['message'], events)
+            return events + [[EVENT_MESSAGE, event.get('room_id')] + row]
+
+        if event_type == 'chat_history':
+            events = []
+            rows = [self._message_row(msg, events) for msg in event['messages']]
+            return events + [[EVENT_HISTORY, event.get('room_id'), rows]]
+
+        return [event]
+
+    def _message_row(self, msg, events):
+        sender = msg['sender']
+        if sender['id'] not in self.known_senders:
+            self.known_senders.add(sender['id'])
+            events.append([EVENT_SENDER, sender['id'], sender['email'], sender['first_name'], sender['last_name']])
+
+        timestamp = int(datetime.fromisoformat(msg['timestamp']).timestamp() * 1000)
+        return [msg['id'], sender['id'], msg['message'], timestamp, msg['is_read']]
+
+
+class FrameProtocolMixin:
+    encoder = None
+    outbox = None
+
+    async def accept(self, subprotocol=None, headers=None):
+        if subprotocol is None and MSGPACK_SUBPROTOCOL in self.scope.get('subprotocols', []):
+            subprotocol = MSGPACK_SUBPROTOCOL
+            self.encoder = CompactEncoder()
+        # Both protocols queue outgoing events so CHAT_SEND_QUEUE_LIMIT bounds
+        # every socket. JSON events are still sent one per frame, without
+        # waiting for the coalescing interval.
+        self.outbox = []
+        self.flush_task = None
+        self.flush_lock = asyncio.Lock()
+        await super().accept(subprotocol, headers)
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            return msgpack.unpackb(bytes_data)
+        return json.loads(text_data)
+
+    async def send_event(self, event):
+        if self.encoder is None:
+            self.outbox.append(json.dumps(event))
+        else:
+            self.outbox.extend(self.encoder.encode(event))
+        if len(self.outbox) > settings.CHAT_SEND_QUEUE_LIMIT:
+            self.outbox = []
+            await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+            return
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_outbox())
+
+    async def flush_outbox(self):
+        await asyncio.sleep(settings.CHAT_FRAME_COALESCE_MS / 1000 if self.encoder is not None else 0)
+        self.flush_task = None
+        await self.flush_now()
+
+    async def flush_now(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        # A JSON flush is several sends; the lock keeps a later flush from
+        # overtaking one that is still sending.
+        async with self.flush_lock:
+            events, self.outbox = self.outbox, []
+            if not events:
+                return
+            if self.encoder is None:
+                for event in events:
+                    await self.send(text_data=event)
+            else:
+                await self.send(bytes_data=msgpack.packb(events))
+
+    async def close(self, code=None, reason=None):
+        # The last events before a close (goodbyes, throttle notices) are
+        # still in the outbox; they have to reach the client first.
+        if self.outbox is not None:
+            await self.flush_now()
+        await super().close(code, reason)
+
+    async def websocket_disconnect(self, message):
+        # The client is gone, so anything still buffered is dropped.
+        if self.outbox is not None:
+            if self.flush_task is not None:
+                self.flush_task.cancel()
+                self.flush_task = None
+            self.outbox = []
+        await super().websocket_disconnect(message)
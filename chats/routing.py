@@ -2,5 +2,11 @@ from django.urls import path
 from . import consumers
 
 websocket_urlpatterns = [
+    path('ws/chat/', consumers.UserChatConsumer.as_asgi()),
     path('ws/chat/<int:room_id>/', consumers.ChatConsumer.as_asgi()),
 ]
+
+channel_routes = {
+    consumers.BROADCAST_CHANNEL: consumers.ChatBroadcastConsumer.as_asgi(),
+    consumers.ASSIGNMENT_CHANNEL: consumers.ChatAssignmentConsumer.as_asgi(),
+}
@@ -0,0 +1,65 @@
+import base64
+import json
+import re
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = 'english'
+SEARCH_INDEX_NAME = 'chat_message_search_idx'
+FTS_TABLE = 'chats_chatmessage_fts'
+
+
+def fts_query(query):
+    # Quote every word so user input can never be parsed as FTS5 syntax.
+    return ' '.join(f'"{word}"' for word in re.findall(r'\w+', query))
+
+
+def search_messages(queryset, query):
+    if connection.vendor == 'postgresql':
+        # Imported here so other backends never load the postgres contrib app.
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        vector = SearchVector('message', config=SEARCH_CONFIG)
+        search_query = SearchQuery(query, config=SEARCH_CONFIG)
+        # ts_rank is a float4. Widen it so the cursor, which round-trips a
+        # float8 through JSON, compares equal to the row it came from.
+        return queryset.annotate(
+            search=vector,
+            rank=Cast(SearchRank(vector, search_query), FloatField()),
+        ).filter(search=search_query)
+
+    if connection.vendor == 'sqlite':
+        match = fts_query(query)
+        if not match:
+            return queryset.none()
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+        ).annotate(rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = "chats_chatmessage"."id"',
+            (match,),
+            output_field=FloatField(),
+        ))
+
+    return queryset.filter(message__icontains=query).annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def encode_cursor(message):
+    return base64.urlsafe_b64encode(json.dumps([message.rank, message.id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        rank, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(message_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def page_after(queryset, cursor=None):
+    if cursor:
+        rank, message_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=message_id))
+    return queryset.order_by('-rank', '-id')
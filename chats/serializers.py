@@ -1,8 +1,15 @@
 from rest_framework import serializers
-from .models import ChatMessage, ChatRoom
+from .models import ChatMessage, ChatRoom, ChatBroadcast, RELATED_MODELS
 from users.serializers import CustomUserSerializer
-from main.models import Unit, Service, Sell
-from django.contrib.contenttypes.models import ContentType
+
+RELATED_OWNER_FIELDS = {'unit': 'user_id', 'service': 'unit__user_id', 'sell': 'unit__user_id'}
+RELATED_LABELS = {'unit': 'Unit', 'service': 'Service', 'sell': 'Sale'}
+
+def check_related(attrs):
+    # A type without an id, or an id without a type, would save a room
+    # pointing at nothing.
+    if bool(attrs.get('related_type')) != bool(attrs.get('related_id')):
+        raise serializers.ValidationError("related_type and related_id must be given together.")
 
 class ChatRoomSerializer(serializers.ModelSerializer):
     user_details = CustomUserSerializer(source='user', read_only=True)
@@ -16,8 +23,10 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         model = ChatRoom
         fields = ['id', 'user', 'admin', 'user_details', 'admin_details', 
                   'subject', 'related_type', 'related_id', 'related_info',
-                  'is_active', 'created_at', 'updated_at', 'unread_count']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+                  'is_active', 'created_at', 'updated_at', 'unread_count',
+                  'last_message_at', 'last_message_preview', 'last_sender']
+        read_only_fields = ['id', 'created_at', 'updated_at',
+                            'last_message_at', 'last_message_preview', 'last_sender']
     
     def get_related_type(self, obj):
         if obj.content_type:
@@ -33,9 +42,11 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         return None
     
     def get_unread_count(self, obj):
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count
         request = self.context.get('request')
         if request and request.user:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
+            return obj.messages.unread_by(request.user).count()
         return 0
 
 class ChatRoomCreateSerializer(serializers.Serializer):
@@ -43,10 +54,12 @@ class ChatRoomCreateSerializer(serializers.Serializer):
     subject = serializers.CharField(max_length=255, required=True)
     related_type = serializers.ChoiceField(choices=['unit', 'service', 'sell'], required=False, allow_null=True)
     related_id = serializers.IntegerField(required=False, allow_null=True)
+    auto_assign = serializers.BooleanField(required=False, default=False)
     
     def validate(self, attrs):
         from users.models import CustomUser
         
+        check_related(attrs)
         user_id = attrs.get('user_id')
         try:
             user = CustomUser.objects.get(id=user_id)
@@ -58,22 +71,65 @@ class ChatRoomCreateSerializer(serializers.Serializer):
         related_type = attrs.get('related_type')
         related_id = attrs.get('related_id')
         
+        attrs['user'] = user
+        attrs['content_object'] = None
         if related_type and related_id:
-            if related_type == 'unit':
-                if not Unit.objects.filter(id=related_id, user=user).exists():
-                    raise serializers.ValidationError("Unit not found or does not belong to this user.")
-            elif related_type == 'service':
-                if not Service.objects.filter(id=related_id, unit__user=user).exists():
-                    raise serializers.ValidationError("Service not found or does not belong to this user.")
-            elif related_type == 'sell':
-                if not Sell.objects.filter(id=related_id, unit__user=user).exists():
-                    raise serializers.ValidationError("Sale not found or does not belong to this user.")
+            model = RELATED_MODELS[related_type]
+            content_object = model.objects.filter(id=related_id, **{RELATED_OWNER_FIELDS[related_type]: user.id}).first()
+            if content_object is None:
+                raise serializers.ValidationError(f"{RELATED_LABELS[related_type]} not found or does not belong to this user.")
+            attrs['content_object'] = content_object
         
         return attrs
 
+class ChatRoomBatchEntrySerializer(serializers.Serializer):
+    user_id = serializers.IntegerField(required=True)
+    subject = serializers.CharField(max_length=255, required=True)
+    related_type = serializers.ChoiceField(choices=['unit', 'service', 'sell'], required=False, allow_null=True)
+    related_id = serializers.IntegerField(required=False, allow_null=True)
+    
+    def validate(self, attrs):
+        check_related(attrs)
+        return attrs
+
+class ChatRoomBatchCreateSerializer(serializers.Serializer):
+    rooms = serializers.ListField(child=ChatRoomBatchEntrySerializer(), allow_empty=False, max_length=1000)
+    auto_assign = serializers.BooleanField(required=False, default=False)
+    
+    def validate_rooms(self, rooms):
+        from users.models import CustomUser
+        
+        users = CustomUser.objects.in_bulk({room['user_id'] for room in rooms})
+        
+        owners = {}
+        for related_type, owner_field in RELATED_OWNER_FIELDS.items():
+            ids = {room['related_id'] for room in rooms if room.get('related_type') == related_type and room.get('related_id')}
+            if ids:
+                owners[related_type] = dict(
+                    RELATED_MODELS[related_type].objects.filter(id__in=ids).values_list('id', owner_field)
+                )
+        
+        errors = {}
+        for index, room in enumerate(rooms):
+            user = users.get(room['user_id'])
+            related_type = room.get('related_type')
+            related_id = room.get('related_id')
+            
+            if user is None:
+                errors[index] = ["User not found."]
+            elif user.is_staff:
+                errors[index] = ["Cannot create chat room with another admin user."]
+            elif related_type and related_id and owners[related_type].get(related_id) != user.id:
+                errors[index] = [f"{RELATED_LABELS[related_type]} not found or does not belong to this user."]
+        
+        if errors:
+            raise serializers.ValidationError(errors)
+        return rooms
+
 class ChatMessageSerializer(serializers.ModelSerializer):
     sender_details = CustomUserSerializer(source='sender', read_only=True)
     chat_room_details = ChatRoomSerializer(source='chat_room', read_only=True)
+    is_read = serializers.BooleanField(read_only=True)
     
     class Meta:
         model = ChatMessage
@@ -81,6 +137,15 @@ class ChatMessageSerializer(serializers.ModelSerializer):
                   'message', 'timestamp', 'is_read']
         read_only_fields = ['id', 'timestamp', 'sender']
 
+class ChatMessageSearchSerializer(serializers.ModelSerializer):
+    sender_details = CustomUserSerializer(source='sender', read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = ChatMessage
+        fields = ['id', 'chat_room', 'sender', 'sender_details', 'message', 'timestamp', 'rank']
+        read_only_fields = fields
+
 class ChatMessageCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatMessage
@@ -96,3 +161,23 @@ class ChatMessageCreateSerializer(serializers.ModelSerializer):
                 if value.user != request.user:
                     raise serializers.ValidationError("You can only send messages to your own chat rooms.")
         return value
+
+
+class ChatRoomFilterSerializer(serializers.Serializer):
+    unread_only = serializers.BooleanField(required=False, default=False)
+    related_type = serializers.ChoiceField(choices=['unit', 'service', 'sell', 'none'], required=False)
+    is_active = serializers.ChoiceField(choices=['true', 'false', 'all'], required=False, default='true')
+    q = serializers.CharField(required=False, allow_blank=True, max_length=255)
+
+class ChatBroadcastCreateSerializer(serializers.Serializer):
+    message = serializers.CharField(required=True)
+    related_type = serializers.ChoiceField(choices=['unit', 'service', 'sell'], required=False, allow_null=True)
+    room_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    include_inactive = serializers.BooleanField(required=False, default=False)
+
+class ChatBroadcastSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatBroadcast
+        fields = ['id', 'admin', 'message', 'filters', 'status', 'total_rooms',
+                  'processed_rooms', 'error', 'created_at', 'completed_at']
+        read_only_fields = fields
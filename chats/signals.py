@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .assignment import adjust_backlog, adjust_rooms, reset_load
+from .models import ChatMessage, ChatRoom
+
+
+@receiver(post_save, sender=ChatRoom)
+def count_new_room(sender, instance, created, **kwargs):
+    if created and instance.is_active:
+        transaction.on_commit(lambda: adjust_rooms(instance.admin_id, 1))
+
+
+@receiver(post_delete, sender=ChatRoom)
+def forget_deleted_room(sender, instance, **kwargs):
+    transaction.on_commit(lambda: reset_load([instance.admin_id]))
+
+
+@receiver(post_save, sender=ChatMessage)
+def count_backlog(sender, instance, created, **kwargs):
+    if not created:
+        return
+    admin_id = instance._room_admin_id
+    if admin_id is not None and instance.sender_id != admin_id:
+        transaction.on_commit(lambda: adjust_backlog(admin_id, 1))
@@ -0,0 +1,47 @@
+from .models import RESPONSE_TIME_BUCKETS
+
+
+def estimate_percentile(buckets, count, max_seconds, pct):
+    if not count:
+        return None
+    target = pct * count
+    lower = 0
+    seen = 0
+    for index, bucket_count in enumerate(buckets):
+        upper = RESPONSE_TIME_BUCKETS[index] if index < len(RESPONSE_TIME_BUCKETS) else max_seconds
+        upper = min(upper, max_seconds)
+        if bucket_count and seen + bucket_count >= target:
+            # Assume responses are spread evenly inside the bucket.
+            return round(lower + (upper - lower) * (target - seen) / bucket_count, 1)
+        seen += bucket_count
+        lower = upper
+    return round(max_seconds, 1)
+
+
+def merge_days(rows):
+    merged = {}
+    for row in rows:
+        key = (row['admin_id'], row['kind'])
+        total = merged.setdefault(key, {
+            'count': 0,
+            'total_seconds': 0,
+            'max_seconds': 0,
+            'buckets': [0] * (len(RESPONSE_TIME_BUCKETS) + 1),
+        })
+        total['count'] += row['count']
+        total['total_seconds'] += row['total_seconds']
+        total['max_seconds'] = max(total['max_seconds'], row['max_seconds'])
+        total['buckets'][row['bucket']] += row['count']
+    return merged
+
+
+def summarize(total):
+    if not total or not total['count']:
+        return {'count': 0, 'avg_seconds': None, 'median_seconds': None, 'p90_seconds': None, 'max_seconds': None}
+    return {
+        'count': total['count'],
+        'avg_seconds': round(total['total_seconds'] / total['count'], 1),
+        'median_seconds': estimate_percentile(total['buckets'], total['count'], total['max_seconds'], 0.5),
+        'p90_seconds': estimate_percentile(total['buckets'], total['count'], total['max_seconds'], 0.9),
+        'max_seconds': round(total['max_seconds'], 1),
+    }
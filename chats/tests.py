@@ -1,2 +1,659 @@
-from django.test import TestCase
+import os
+import shutil
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from main.models import Unit
+from users.models import CustomUser
+from .assignment import admin_load, rebalance_admin
+from .consumers import deliver_chunk, rebalance_tasks, schedule_rebalance, start_broadcast
+from .models import ChatBroadcast, ChatMessage, ChatReadCursor, ChatResponseDaily, ChatRoom
+from .presence import connect_user
+from .protocol import EVENT_MESSAGE, EVENT_SENDER, SLOW_CONSUMER_CLOSE_CODE, FrameProtocolMixin
+from .routing import websocket_urlpatterns
+from .throttling import THROTTLED_CLOSE_CODE, ThrottleMixin, TokenBucket, consume_tokens
 
+
+def create_admin(email='admin@example.com'):
+    return CustomUser.objects.create_user(email, 'Ada', 'Admin', 'password', is_staff=True, is_active=True)
+
+
+def create_customer(email='user@example.com'):
+    return CustomUser.objects.create_user(email, 'Uma', 'User', 'password', is_active=True)
+
+
+class GoodbyeConsumer(FrameProtocolMixin, AsyncWebsocketConsumer):
+    async def connect(self):
+        await self.accept()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.send_event({'type': 'goodbye'})
+        await self.close(code=4000)
+
+
+class BurstConsumer(FrameProtocolMixin, AsyncWebsocketConsumer):
+    async def connect(self):
+        await self.accept()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        for i in range(self.decode_frame(text_data, bytes_data)['count']):
+            await self.send_event({'type': 'burst', 'i': i})
+
+
+class EchoConsumer(ThrottleMixin, FrameProtocolMixin, AsyncWebsocketConsumer):
+    async def connect(self):
+        await self.accept()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if await self.throttle():
+            return
+        await self.send_event({'type': 'echo'})
+
+
+@override_settings(CHAT_FRAME_COALESCE_MS=1000)
+class FrameProtocolTests(SimpleTestCase):
+    def test_buffered_frames_are_sent_before_close(self):
+        async def main():
+            communicator = WebsocketCommunicator(GoodbyeConsumer.as_asgi(), '/ws/', subprotocols=['msgpack'])
+            self.assertEqual(await communicator.connect(), (True, 'msgpack'))
+            await communicator.send_to(bytes_data=msgpack.packb({'type': 'bye'}))
+            frame = await communicator.receive_output()
+            self.assertEqual(msgpack.unpackb(frame['bytes']), [{'type': 'goodbye'}])
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4000})
+
+        asyncio.run(main())
+
+    def test_json_clients_are_not_buffered(self):
+        async def main():
+            communicator = WebsocketCommunicator(GoodbyeConsumer.as_asgi(), '/ws/')
+            await communicator.connect()
+            await communicator.send_to(text_data='{}')
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'goodbye'})
+            self.assertEqual((await communicator.receive_output())['type'], 'websocket.close')
+
+        asyncio.run(main())
+
+    @override_settings(CHAT_SEND_QUEUE_LIMIT=3)
+    def test_send_queue_is_bounded_for_json_clients(self):
+        async def main():
+            communicator = WebsocketCommunicator(BurstConsumer.as_asgi(), '/ws/')
+            await communicator.connect()
+            await communicator.send_json_to({'count': 3})
+            self.assertEqual([(await communicator.receive_json_from())['i'] for _ in range(3)], [0, 1, 2])
+            await communicator.send_json_to({'count': 4})
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': SLOW_CONSUMER_CLOSE_CODE})
+
+        asyncio.run(main())
+
+
+class ThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_consumers_share_the_burst(self):
+        bucket = TokenBucket('test_bucket', 0.001, 50)
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: bucket.consume(), range(200)))
+        self.assertEqual(results.count(0), 50)
+
+    def test_rejected_frames_are_refunded(self):
+        connection = TokenBucket('test_conn', 0.001, 10)
+        user = TokenBucket('test_user', 0.001, 1)
+        self.assertEqual(consume_tokens([connection, user]), 0)
+        for _ in range(5):
+            self.assertGreater(consume_tokens([connection, user]), 0)
+        self.assertEqual(cache.get(connection.charged), 1)
+
+    def test_debt_is_carried(self):
+        bucket = TokenBucket('test_debt', 0.001, 10)
+        self.assertEqual(bucket.consume(25, force=True), 0)
+        self.assertGreater(bucket.consume(), 0)
+
+    @override_settings(CHAT_CONNECTION_RATE=20, CHAT_CONNECTION_BURST=2, CHAT_THROTTLE_MAX_STRIKES=5)
+    def test_sustained_flood_is_closed(self):
+        async def main():
+            communicator = WebsocketCommunicator(EchoConsumer.as_asgi(), '/ws/')
+            await communicator.connect()
+            for _ in range(100):
+                await communicator.send_to(text_data='{}')
+                await asyncio.sleep(0.01)
+            frames = []
+            while True:
+                output = await communicator.receive_output()
+                if output['type'] == 'websocket.close':
+                    return frames, output['code']
+                frames.append(output['text'])
+
+        frames, code = asyncio.run(main())
+        self.assertEqual(code, THROTTLED_CLOSE_CODE)
+        self.assertIn('{"type": "echo"}', frames)
+
+
+class ReadCursorTests(APITestCase):
+    def setUp(self):
+        self.admin = create_admin()
+        self.user = create_customer()
+        self.room = ChatRoom.objects.create(user=self.user, admin=self.admin, subject='Brakes')
+        self.other_room = ChatRoom.objects.create(user=self.user, admin=self.admin, subject='Tyres', object_id=1)
+        self.messages = [ChatMessage.objects.create(chat_room=self.room, sender=self.user, message=f'm{i}') for i in range(3)]
+        ChatMessage.objects.create(chat_room=self.other_room, sender=self.user, message='tyres')
+        ChatMessage.objects.create(chat_room=self.room, sender=self.admin, message='reply')
+        self.client.force_authenticate(self.admin)
+
+    def unread_count(self):
+        return self.client.get('/api/chat/messages/unread-count/').data['unread_count']
+
+    def test_unread_count_sums_rooms(self):
+        self.assertEqual(self.unread_count(), 4)
+        response = self.client.post('/api/chat/messages/mark-read/', {'chat_room_id': self.room.id})
+        self.assertEqual(response.data['message'], '3 messages marked as read')
+        self.assertEqual(self.unread_count(), 1)
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.unread_count(), 1)
+
+    def test_cursor_never_moves_back(self):
+        ChatReadCursor.objects.create(user=self.admin, chat_room=self.room, last_read_message_id=10 ** 9)
+        response = self.client.post('/api/chat/messages/mark-read/', {'chat_room_id': self.room.id})
+        self.assertEqual(response.data['message'], '0 messages marked as read')
+        self.assertEqual(ChatReadCursor.objects.get(user=self.admin, chat_room=self.room).last_read_message_id, 10 ** 9)
+        self.assertFalse(ChatReadCursor.advance(self.admin.id, self.room.id, 1))
+        self.assertEqual(ChatReadCursor.objects.get(user=self.admin, chat_room=self.room).last_read_message_id, 10 ** 9)
+
+    def test_mark_read_upserts_the_cursor(self):
+        ChatReadCursor.objects.create(user=self.admin, chat_room=self.room, last_read_message_id=self.messages[0].id)
+        with self.assertNumQueries(2):
+            response = self.client.post('/api/chat/messages/mark-read/', {'chat_room_id': self.room.id})
+        self.assertEqual(response.data['message'], '2 messages marked as read')
+        cursor = ChatReadCursor.objects.get(user=self.admin, chat_room=self.room)
+        self.assertEqual(cursor.last_read_message_id, self.room.messages.latest('id').id)
+
+    def test_read_state(self):
+        self.client.post('/api/chat/messages/mark-read/', {'chat_room_id': self.room.id})
+        results = self.client.get(f'/api/chat/messages/?chat_room_id={self.room.id}').data['results']
+        self.assertEqual([msg['is_read'] for msg in results], [True, True, True, False])
+        self.assertIsNone(ChatMessage.objects.get(pk=self.messages[0].pk).is_read)
+        self.assertIs(ChatMessage.objects.with_read_state().get(pk=self.messages[0].pk).is_read, True)
+
+
+@override_settings(CHAT_BROADCAST_CHUNK_SIZE=2, CHAT_BROADCAST_PAUSE_MS=0)
+class BroadcastTests(APITestCase):
+    def setUp(self):
+        self.admin = create_admin()
+        self.rooms = [
+            ChatRoom.objects.create(user=create_customer(f'user{i}@example.com'), admin=self.admin, subject=f'Room {i}', is_active=i != 4)
+            for i in range(5)
+        ]
+        self.client.force_authenticate(self.admin)
+
+    def test_in_memory_layer_leaves_the_job_to_requeue_broadcasts(self):
+        response = self.client.post('/api/chat/broadcasts/', {'message': 'Recall notice'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['data']['status'], response.data['data']['total_rooms']), ('pending', 4))
+        self.assertFalse(ChatMessage.objects.filter(message='Recall notice').exists())
+
+        out = StringIO()
+        call_command('requeue_broadcasts', stdout=out)
+        self.assertIn('Ran 1 broadcasts', out.getvalue())
+        broadcast = ChatBroadcast.objects.get(pk=response.data['data']['id'])
+        self.assertEqual((broadcast.status, broadcast.processed_rooms), ('completed', 4))
+        self.assertEqual(ChatMessage.objects.filter(message='Recall notice').count(), 4)
+        self.assertEqual(ChatRoom.objects.get(pk=self.rooms[0].pk).last_message_preview, 'Recall notice')
+
+    def test_no_matching_rooms(self):
+        response = self.client.post('/api/chat/broadcasts/', {'message': 'Hi', 'room_ids': [self.rooms[4].id]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_stale_broadcasts_are_resumed(self):
+        stale = ChatBroadcast.objects.create(
+            admin=self.admin, message='Outage', status='running', total_rooms=4,
+            processed_rooms=1, last_room_id=self.rooms[0].id
+        )
+        live = ChatBroadcast.objects.create(admin=self.admin, message='Later', status='running', total_rooms=4)
+        ChatBroadcast.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        out = StringIO()
+        call_command('requeue_broadcasts', stdout=out)
+        self.assertIn('Ran 1 broadcasts', out.getvalue())
+
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.processed_rooms), ('completed', 4))
+        self.assertEqual(
+            sorted(ChatMessage.objects.filter(message='Outage').values_list('chat_room_id', flat=True)),
+            [room.id for room in self.rooms[1:4]]
+        )
+        self.assertEqual(ChatBroadcast.objects.get(pk=live.pk).status, 'running')
+
+    def test_requeued_job_runs_once(self):
+        broadcast = ChatBroadcast.objects.create(admin=self.admin, message='Outage', status='running', total_rooms=4)
+        seen_at = broadcast.updated_at
+        self.assertIsNone(start_broadcast(broadcast.id))
+
+        worker = start_broadcast(broadcast.id, seen_at)
+        self.assertEqual(worker.status, 'running')
+        self.assertIsNone(start_broadcast(broadcast.id, seen_at))
+
+        # The stalled worker wakes up after another one took the job over.
+        stalled = ChatBroadcast.objects.get(pk=broadcast.pk)
+        self.assertEqual(len(deliver_chunk(worker)), 2)
+        self.assertIsNone(deliver_chunk(stalled))
+        self.assertEqual(ChatMessage.objects.filter(message='Outage').count(), 2)
+
+
+@override_settings(CHAT_ASSIGNMENT_OFFLINE_GRACE=60)
+class RebalanceScheduleTests(SimpleTestCase):
+    def test_one_pending_rebalance_per_admin(self):
+        async def main():
+            schedule_rebalance(1)
+            first = rebalance_tasks[1]
+            schedule_rebalance(1)
+            schedule_rebalance(2)
+            await asyncio.sleep(0)
+            self.assertTrue(first.cancelled())
+            self.assertEqual(sorted(rebalance_tasks), [1, 2])
+            tasks = list(rebalance_tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.sleep(0)
+            self.assertEqual(rebalance_tasks, {})
+
+        asyncio.run(main())
+
+
+class ResponseTimeTests(APITestCase):
+    def setUp(self):
+        self.admin = create_admin()
+        self.user = create_customer()
+        self.room = ChatRoom.objects.create(user=self.user, admin=self.admin, subject='Brakes')
+        ChatMessage.objects.create(chat_room=self.room, sender=self.user, message='Hello?')
+        ChatMessage.objects.create(chat_room=self.room, sender=self.admin, message='Hi')
+        self.client.force_authenticate(self.admin)
+
+    def test_admin_metrics(self):
+        response = self.client.get('/api/admin/chat/response-times/', {'admin_id': self.admin.id})
+        self.assertEqual(response.status_code, 200)
+        [row] = response.data['admins']
+        self.assertEqual((row['replies']['count'], row['first_responses']['count']), (1, 1))
+        self.assertEqual(row['backlog']['waiting_rooms'], 0)
+
+    def test_each_wait_is_answered_once(self):
+        ChatMessage.objects.create(chat_room=self.room, sender=self.admin, message='Anything else?')
+        ChatMessage.objects.create(chat_room=self.room, sender=self.user, message='Yes')
+        with self.assertNumQueries(6):
+            ChatMessage.objects.create(chat_room=self.room, sender=self.admin, message='Sure')
+        room = ChatRoom.objects.get(pk=self.room.pk)
+        self.assertEqual((room.reply_count, room.awaiting_reply_since, room.last_message_preview), (2, None, 'Sure'))
+        self.assertEqual(
+            list(ChatResponseDaily.objects.values_list('kind', 'bucket', 'count')),
+            [('reply', 0, 2), ('first_response', 0, 1)]
+        )
+
+    def test_room_metrics(self):
+        ChatMessage.objects.create(chat_room=self.room, sender=self.user, message='Still there?')
+        response = self.client.get('/api/admin/chat/response-times/rooms/', {'waiting_only': 'true', 'page_size': 1000})
+        self.assertEqual(response.status_code, 200)
+        [room] = response.data['results']
+        self.assertEqual((room['id'], room['reply_count']), (self.room.id, 1))
+        self.assertIsNotNone(room['waiting_seconds'])
+
+    def test_bad_parameters(self):
+        for url, params in [
+            ('/api/admin/chat/response-times/', {'admin_id': 'me'}),
+            ('/api/admin/chat/response-times/', {'start': 'yesterday'}),
+            ('/api/admin/chat/response-times/', {'end': '2026-02-30'}),
+            ('/api/admin/chat/response-times/rooms/', {'page_size': 'all'}),
+            ('/api/admin/chat/response-times/rooms/', {'admin_id': 'me'}),
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+class ChatSocketTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        async_to_sync(get_channel_layer().flush)()
+        self.admin = create_admin()
+        self.user = create_customer()
+        self.room = ChatRoom.objects.create(user=self.user, admin=self.admin, subject='Brakes')
+        self.other_room = ChatRoom.objects.create(user=self.user, admin=self.admin, subject='Tyres', object_id=1)
+
+    async def connect(self, user, path, **kwargs):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path, **kwargs)
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def test_multiplexed_socket(self):
+        async def main():
+            admin = await self.connect(self.admin, '/ws/chat/')
+            self.assertEqual(await admin.receive_json_from(), {'type': 'subscribed', 'rooms': [self.room.id, self.other_room.id]})
+            self.assertEqual(await admin.receive_json_from(), {'type': 'presence_state', 'online': []})
+
+            user = await self.connect(self.user, f'/ws/chat/{self.room.id}/')
+            history = await user.receive_json_from()
+            self.assertEqual((history['type'], history['messages']), ('chat_history', []))
+            self.assertEqual(await user.receive_json_from(), {'type': 'presence_state', 'online': [self.admin.id]})
+            self.assertEqual(
+                await admin.receive_json_from(),
+                {'type': 'presence', 'user_id': self.user.id, 'status': 'online', 'rooms': [self.room.id, self.other_room.id]}
+            )
+
+            await user.send_json_to({'message': 'Squeaky brakes'})
+            event = await admin.receive_json_from()
+            self.assertEqual((event['type'], event['room_id'], event['message']['message']), ('chat_message', self.room.id, 'Squeaky brakes'))
+            self.assertEqual((await user.receive_json_from())['message']['id'], event['message']['id'])
+
+            await admin.send_json_to({'type': 'chat_message', 'room_id': self.room.id, 'message': 'Book a check'})
+            self.assertEqual((await user.receive_json_from())['message']['message'], 'Book a check')
+            self.assertEqual((await admin.receive_json_from())['message']['message'], 'Book a check')
+
+            await admin.send_json_to({'type': 'chat_history', 'room_id': self.room.id})
+            history = await admin.receive_json_from()
+            self.assertEqual([msg['message'] for msg in history['messages']], ['Squeaky brakes', 'Book a check'])
+
+            await admin.send_json_to({'type': 'unsubscribe', 'room_id': self.room.id})
+            self.assertEqual(await admin.receive_json_from(), {'type': 'unsubscribed', 'rooms': [self.room.id]})
+            await admin.send_json_to({'type': 'chat_message', 'room_id': self.room.id, 'message': 'Hello?'})
+            self.assertEqual((await admin.receive_json_from())['message'], 'Not subscribed to this chat room')
+            await admin.send_json_to({'type': 'subscribe', 'room_id': 999999})
+            self.assertEqual((await admin.receive_json_from())['message'], 'Chat room not found')
+
+            await admin.send_json_to({'type': 'subscribe', 'room_id': self.room.id})
+            self.assertEqual(await admin.receive_json_from(), {'type': 'subscribed', 'rooms': [self.room.id]})
+            self.assertEqual(await admin.receive_json_from(), {'type': 'presence_state', 'online': [self.user.id]})
+            await user.disconnect()
+            self.assertEqual(
+                await admin.receive_json_from(),
+                {'type': 'presence', 'user_id': self.user.id, 'status': 'offline', 'rooms': [self.room.id, self.other_room.id]}
+            )
+            await admin.disconnect()
+
+        asyncio.run(main())
+
+        room = ChatRoom.objects.get(pk=self.room.pk)
+        self.assertEqual((room.last_message_preview, room.last_sender_id), ('Book a check', self.admin.id))
+        self.assertEqual(ChatRoom.objects.get(pk=self.other_room.pk).last_message_preview, '')
+
+    def test_typing_is_debounced(self):
+        async def main():
+            admin = await self.connect(self.admin, '/ws/chat/')
+            await admin.receive_json_from()
+            await admin.receive_json_from()
+            user = await self.connect(self.user, f'/ws/chat/{self.room.id}/')
+            await user.receive_json_from()
+            await user.receive_json_from()
+            await admin.receive_json_from()
+
+            await user.send_json_to({'type': 'typing'})
+            await user.send_json_to({'type': 'typing'})
+            self.assertEqual(await admin.receive_json_from(), {'type': 'chat_typing', 'room_id': self.room.id, 'user_id': self.user.id})
+            self.assertTrue(await admin.receive_nothing())
+            await user.disconnect()
+            await admin.disconnect()
+
+        asyncio.run(main())
+
+    def test_msgpack_subprotocol(self):
+        async def main():
+            admin = await self.connect(self.admin, '/ws/chat/', subprotocols=['msgpack'])
+            self.assertEqual(
+                msgpack.unpackb(await admin.receive_from()),
+                [{'type': 'subscribed', 'rooms': [self.room.id, self.other_room.id]}, {'type': 'presence_state', 'online': []}]
+            )
+            await admin.send_to(bytes_data=msgpack.packb({'type': 'chat_message', 'room_id': self.room.id, 'message': 'Hi'}))
+            sender, message = msgpack.unpackb(await admin.receive_from())
+            self.assertEqual(sender, [EVENT_SENDER, self.admin.id, self.admin.email, 'Ada', 'Admin'])
+            self.assertEqual(message[:2] + message[3:5], [EVENT_MESSAGE, self.room.id, self.admin.id, 'Hi'])
+            self.assertEqual(message[-1], False)
+            await admin.disconnect()
+
+        asyncio.run(main())
+
+    def test_rejects_other_rooms_and_anonymous_users(self):
+        stranger = create_customer('stranger@example.com')
+
+        async def main():
+            for user, path in [(AnonymousUser(), '/ws/chat/'), (stranger, f'/ws/chat/{self.room.id}/')]:
+                communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+                communicator.scope['user'] = user
+                self.assertFalse((await communicator.connect())[0])
+
+        asyncio.run(main())
+
+
+class InboxTests(APITestCase):
+    def setUp(self):
+        self.admin = create_admin()
+        self.user = create_customer()
+        self.unit = Unit.objects.create(user=self.user, vin='VIN00000000000001', brand='Toyota', model='Corolla', year='2019')
+        self.unit_room = ChatRoom.objects.create(user=self.user, admin=self.admin, subject='Brake noise', content_object=self.unit)
+        self.general_room = ChatRoom.objects.create(user=self.user, admin=self.admin, subject='Billing')
+        self.closed_room = ChatRoom.objects.create(user=self.user, admin=self.admin, subject='Old brake job', object_id=2, is_active=False)
+        ChatMessage.objects.create(chat_room=self.general_room, sender=self.user, message='Invoice?')
+        ChatMessage.objects.create(chat_room=self.unit_room, sender=self.admin, message='Bring it in')
+        self.client.force_authenticate(self.admin)
+
+    def rooms(self, **params):
+        response = self.client.get('/api/chat/rooms/', params)
+        self.assertEqual(response.status_code, 200)
+        return [(room['id'], room['unread_count']) for room in response.data['results']]
+
+    def test_newest_conversation_first(self):
+        self.assertEqual(self.rooms(), [(self.unit_room.id, 0), (self.general_room.id, 1)])
+        room = self.client.get('/api/chat/rooms/').data['results'][0]
+        self.assertEqual((room['last_message_preview'], room['last_sender'], room['related_type']), ('Bring it in', self.admin.id, 'unit'))
+
+    def test_filters(self):
+        self.assertEqual(self.rooms(unread_only='true'), [(self.general_room.id, 1)])
+        self.assertEqual(self.rooms(related_type='unit'), [(self.unit_room.id, 0)])
+        self.assertEqual(self.rooms(related_type='none'), [(self.general_room.id, 1)])
+        self.assertEqual(self.rooms(is_active='false'), [(self.closed_room.id, 0)])
+        self.assertEqual(sorted(self.rooms(is_active='all', q='brake')), [(self.unit_room.id, 0), (self.closed_room.id, 0)])
+        self.assertEqual(self.client.get('/api/chat/rooms/', {'related_type': 'boat'}).status_code, 400)
+
+    def test_customer_sees_own_rooms(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.rooms(unread_only='true'), [(self.unit_room.id, 1)])
+
+
+class MessageSearchTests(APITestCase):
+    def setUp(self):
+        self.admin = create_admin()
+        other_admin = create_admin('other@example.com')
+        user = create_customer()
+        room = ChatRoom.objects.create(user=user, admin=self.admin, subject='Brakes')
+        other_room = ChatRoom.objects.create(user=user, admin=other_admin, subject='Brakes', object_id=1)
+        self.messages = [
+            ChatMessage.objects.create(chat_room=room, sender=user, message=f'brakes squeak {i} ' + 'brakes ' * (i % 3))
+            for i in range(7)
+        ]
+        ChatMessage.objects.create(chat_room=room, sender=user, message='oil change')
+        ChatMessage.objects.create(chat_room=other_room, sender=user, message='brakes again')
+        self.client.force_authenticate(self.admin)
+
+    def test_pages_cover_every_match_once(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'q': 'brakes', 'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get('/api/chat/messages/search/', params)
+            self.assertEqual(response.status_code, 200)
+            seen += [(result['rank'], result['id']) for result in response.data['results']]
+            cursor = response.data['next']
+            if not cursor:
+                break
+        self.assertEqual(sorted(message_id for _, message_id in seen), [msg.id for msg in self.messages])
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_bad_input(self):
+        self.assertEqual(self.client.get('/api/chat/messages/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/chat/messages/search/', {'q': 'brakes', 'cursor': 'zzz'}).status_code, 400)
+        # Search syntax in the query is matched as plain words.
+        response = self.client.get('/api/chat/messages/search/', {'q': '"oil" change ('})
+        self.assertEqual([result['message'] for result in response.data['results']], ['oil change'])
+
+
+class ArchiveTests(APITestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.admin = create_admin()
+        self.user = create_customer()
+        self.room = ChatRoom.objects.create(user=self.user, admin=self.admin, subject='Brakes')
+        self.old = [
+            ChatMessage.objects.create(chat_room=self.room, sender=self.user if i % 2 else self.admin, message=f'old {i}')
+            for i in range(12)
+        ]
+        ChatMessage.objects.filter(pk__in=[msg.pk for msg in self.old]).update(timestamp=timezone.now() - timedelta(days=400))
+        self.new = [ChatMessage.objects.create(chat_room=self.room, sender=self.user, message=f'new {i}') for i in range(3)]
+        ChatReadCursor.objects.create(user=self.admin, chat_room=self.room, last_read_message_id=self.old[5].id)
+
+    def test_history_reads_through_the_archive(self):
+        with override_settings(CHAT_ARCHIVE_ROOT=self.root):
+            call_command('archive_chats', '--batch-size', '5', stdout=StringIO())
+            self.assertEqual(ChatMessage.objects.filter(chat_room=self.room).count(), 3)
+            self.assertEqual(ChatRoom.objects.get(pk=self.room.pk).archived_through_id, self.old[-1].id)
+            self.assertEqual(len(os.listdir(os.path.join(self.root, f'room_{self.room.id}'))), 3)
+
+            self.client.force_authenticate(self.user)
+            pages = []
+            before = None
+            while True:
+                params = {'limit': 4}
+                if before:
+                    params['before'] = before
+                response = self.client.get(f'/api/chat/rooms/{self.room.id}/history/', params)
+                pages.insert(0, response.data['messages'])
+                before = response.data['next_before']
+                if not before:
+                    break
+
+        messages = [msg for page in pages for msg in page]
+        self.assertEqual([msg['id'] for msg in messages], [msg.id for msg in self.old + self.new])
+        self.assertEqual([msg['is_read'] for msg in messages[:7]], [False, True, False, True, False, True, False])
+
+
+class BatchCreateTests(APITestCase):
+    def setUp(self):
+        self.admin = create_admin()
+        self.users = [create_customer(f'user{i}@example.com') for i in range(3)]
+        self.unit = Unit.objects.create(user=self.users[0], vin='VIN00000000000001', brand='Toyota', model='Corolla', year='2019')
+        self.client.force_authenticate(self.admin)
+
+    def post(self, rooms, **data):
+        return self.client.post('/api/chat/rooms/batch/', {'rooms': rooms, **data}, format='json')
+
+    def test_creates_then_updates(self):
+        rooms = [{'user_id': user.id, 'subject': 'Recall'} for user in self.users]
+        rooms.append({'user_id': self.users[0].id, 'subject': 'Your Corolla', 'related_type': 'unit', 'related_id': self.unit.id})
+        response = self.post(rooms)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['data']['created']), 4)
+        room = ChatRoom.objects.get(user=self.users[0], object_id=self.unit.id)
+        self.assertEqual((room.content_object, room.admin_id), (self.unit, self.admin.id))
+
+        ChatRoom.objects.filter(user=self.users[1]).update(is_active=False)
+        response = self.post(rooms[:1] + rooms[1:2])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], '0 chat rooms created, 2 updated')
+        self.assertTrue(ChatRoom.objects.get(user=self.users[1]).is_active)
+        self.assertEqual(ChatRoom.objects.count(), 4)
+
+    def test_reports_errors_per_entry(self):
+        response = self.post([
+            {'user_id': self.users[1].id, 'subject': 'x', 'related_type': 'unit', 'related_id': self.unit.id},
+            {'user_id': self.admin.id, 'subject': 'x'},
+            {'user_id': 999999, 'subject': 'x'},
+            {'user_id': self.users[0].id, 'subject': 'fine'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.data['rooms']), [0, 1, 2])
+        self.assertFalse(ChatRoom.objects.exists())
+
+    def test_related_type_and_id_go_together(self):
+        response = self.post([
+            {'user_id': self.users[0].id, 'subject': 'x', 'related_type': 'unit'},
+            {'user_id': self.users[0].id, 'subject': 'x', 'related_id': self.unit.id},
+            {'user_id': self.users[0].id, 'subject': 'fine', 'related_type': None, 'related_id': None},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.data['rooms']), [0, 1])
+
+        response = self.client.post('/api/chat/rooms/create/', {'user_id': self.users[0].id, 'subject': 'x', 'related_type': 'unit'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ChatRoom.objects.exists())
+
+
+class AssignmentTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admins = [create_admin(f'admin{i}@example.com') for i in range(2)]
+        self.users = [create_customer(f'user{i}@example.com') for i in range(4)]
+        self.rooms = [
+            ChatRoom.objects.create(user=self.users[i], admin=self.admins[0], subject='Help')
+            for i in range(2)
+        ]
+        self.client.force_authenticate(self.admins[0])
+
+    def create_room(self, user):
+        # The load counters are updated once the room is committed.
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/chat/rooms/create/', {'user_id': user.id, 'subject': 'New', 'auto_assign': True}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['data']['admin']
+
+    def test_auto_assign_picks_the_least_loaded_admin(self):
+        self.assertEqual(self.create_room(self.users[2]), self.admins[1].id)
+        self.assertEqual(self.create_room(self.users[3]), self.admins[1].id)
+        self.assertEqual(admin_load([admin.id for admin in self.admins]), {self.admins[0].id: (2, 0), self.admins[1].id: (2, 0)})
+
+    def test_online_admins_are_preferred(self):
+        connect_user(self.admins[0].id)
+        self.assertEqual(self.create_room(self.users[2]), self.admins[0].id)
+
+    def test_backlog_counter_follows_messages(self):
+        admin_id = self.admins[0].id
+        admin_load([admin_id])
+        with self.captureOnCommitCallbacks(execute=True):
+            ChatMessage.objects.create(chat_room=self.rooms[0], sender=self.users[0], message='Hello?')
+            ChatMessage.objects.create(chat_room=self.rooms[0], sender=self.users[0], message='Anyone?')
+            ChatMessage.objects.create(chat_room=self.rooms[0], sender=self.admins[0], message='Here')
+        self.assertEqual(admin_load([admin_id]), {admin_id: (2, 2)})
+        self.client.post('/api/chat/messages/mark-read/', {'chat_room_id': self.rooms[0].id})
+        self.assertEqual(admin_load([admin_id]), {admin_id: (2, 0)})
+
+    def test_deleted_room_resets_the_counters(self):
+        admin_id = self.admins[0].id
+        self.assertEqual(admin_load([admin_id]), {admin_id: (2, 0)})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rooms[0].delete()
+        self.assertEqual(admin_load([admin_id]), {admin_id: (1, 0)})
+
+    def test_rebalance_moves_unread_rooms_to_online_admins(self):
+        first = ChatMessage.objects.create(chat_room=self.rooms[0], sender=self.users[0], message='Hello?')
+        ChatMessage.objects.create(chat_room=self.rooms[0], sender=self.users[0], message='Anyone?')
+        ChatReadCursor.objects.create(user=self.admins[0], chat_room=self.rooms[0], last_read_message_id=first.id)
+        connect_user(self.admins[1].id)
+
+        self.assertEqual(rebalance_admin(self.admins[0].id), 1)
+        self.assertEqual(ChatRoom.objects.get(pk=self.rooms[0].pk).admin_id, self.admins[1].id)
+        self.assertEqual(ChatRoom.objects.get(pk=self.rooms[1].pk).admin_id, self.admins[0].id)
+        self.assertEqual(ChatReadCursor.objects.get(user=self.admins[1], chat_room=self.rooms[0]).last_read_message_id, first.id)
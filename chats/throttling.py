@@ -0,0 +1,103 @@
+import math
+import time
+from collections import deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+THROTTLED_CLOSE_CODE = 4429
+
+
+class TokenBucket:
+    # A bucket of burst tokens refilling at rate, approximated with a sliding
+    # window counter: tokens are added to a counter per window of
+    # burst / rate seconds with cache.incr, which is atomic, so sockets and
+    # workers sharing a key never overwrite each other's updates. The previous
+    # window counts for the part the sliding window still overlaps.
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.window = burst / rate
+
+    def consume(self, tokens=1, force=False):
+        # force charges tokens that were already spent, which can leave the
+        # bucket in debt until it refills.
+        index, elapsed = divmod(time.time(), self.window)
+        current = f'{self.key}_{int(index)}'
+        cache.add(current, 0, math.ceil(2 * self.window) + 1)
+        used = cache.incr(current, tokens)
+        previous = cache.get(f'{self.key}_{int(index) - 1}', 0)
+        level = previous * (1 - elapsed / self.window) + used
+
+        if level <= self.burst or force:
+            self.charged = current
+            return 0
+        cache.decr(current, tokens)
+        return (level - self.burst) / self.rate
+
+    def refund(self, tokens=1):
+        # Gives back tokens taken by the last successful consume.
+        cache.decr(self.charged, tokens)
+
+
+def consume_tokens(buckets):
+    # Stop at the first bucket that rejects the frame and refund the ones
+    # already charged, so a frame the user bucket refuses does not also drain
+    # the connection's bucket.
+    charged = []
+    for bucket in buckets:
+        retry_after = bucket.consume()
+        if retry_after:
+            for earlier in charged:
+                earlier.refund()
+            return retry_after
+        charged.append(bucket)
+    return 0
+
+
+class ThrottleMixin:
+    throttle_strikes = None
+
+    def get_throttle_buckets(self):
+        buckets = [TokenBucket(
+            f'chat_throttle_conn_{self.channel_name}',
+            settings.CHAT_CONNECTION_RATE,
+            settings.CHAT_CONNECTION_BURST,
+        )]
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated:
+            buckets.append(TokenBucket(
+                f'chat_throttle_user_{user.id}',
+                settings.CHAT_USER_RATE,
+                settings.CHAT_USER_BURST,
+            ))
+        return buckets
+
+    def throttled_event(self, retry_after):
+        return {
+            'type': 'throttled',
+            'message': 'Too many messages, please slow down',
+            'retry_after': retry_after
+        }
+
+    async def throttle(self):
+        retry_after = await sync_to_async(consume_tokens, thread_sensitive=False)(self.get_throttle_buckets())
+
+        if not retry_after:
+            return False
+
+        # Strikes are counted over a sliding window, not in a row, so a
+        # client that keeps sending too fast is closed even though some of
+        # its frames still get through.
+        now = time.monotonic()
+        if self.throttle_strikes is None:
+            self.throttle_strikes = deque()
+        self.throttle_strikes.append(now)
+        while self.throttle_strikes[0] <= now - settings.CHAT_THROTTLE_STRIKE_WINDOW:
+            self.throttle_strikes.popleft()
+
+        await self.send_event(self.throttled_event(round(retry_after, 2)))
+        if len(self.throttle_strikes) > settings.CHAT_THROTTLE_MAX_STRIKES:
+            await self.close(code=THROTTLED_CLOSE_CODE)
+        return True
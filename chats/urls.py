@@ -1,8 +1,9 @@
 from django.urls import path
 from .views import (
-    ChatRoomListView, ChatRoomCreateView, ChatRoomDetailView,
-    ChatMessageListView, ChatMessageCreateView, 
-    MarkMessagesReadView, UnreadMessageCountView
+    ChatRoomListView, ChatRoomCreateView, ChatRoomBatchCreateView, ChatRoomDetailView,
+    ChatMessageListView, ChatMessageCreateView, ChatMessageSearchView, ChatHistoryView,
+    MarkMessagesReadView, UnreadMessageCountView,
+    ChatBroadcastView, ChatBroadcastDetailView
 )
 
 app_name = 'chats'
@@ -10,9 +11,14 @@ app_name = 'chats'
 urlpatterns = [
     path('rooms/', ChatRoomListView.as_view(), name='room-list'),
     path('rooms/create/', ChatRoomCreateView.as_view(), name='room-create'),
+    path('rooms/batch/', ChatRoomBatchCreateView.as_view(), name='room-batch-create'),
     path('rooms/<int:pk>/', ChatRoomDetailView.as_view(), name='room-detail'),
+    path('rooms/<int:pk>/history/', ChatHistoryView.as_view(), name='room-history'),
     path('messages/', ChatMessageListView.as_view(), name='message-list'),
+    path('messages/search/', ChatMessageSearchView.as_view(), name='message-search'),
     path('messages/create/', ChatMessageCreateView.as_view(), name='message-create'),
     path('messages/mark-read/', MarkMessagesReadView.as_view(), name='mark-read'),
     path('messages/unread-count/', UnreadMessageCountView.as_view(), name='unread-count'),
+    path('broadcasts/', ChatBroadcastView.as_view(), name='broadcast-list-create'),
+    path('broadcasts/<int:pk>/', ChatBroadcastDetailView.as_view(), name='broadcast-detail'),
 ]
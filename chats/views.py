@@ -2,14 +2,23 @@ from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from django.db.models import Q, Max
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
-from .models import ChatMessage, ChatRoom
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from .models import ChatMessage, ChatRoom, ChatReadCursor, ChatBroadcast, RELATED_MODELS
 from .serializers import (
-    ChatMessageSerializer, ChatMessageCreateSerializer,
-    ChatRoomSerializer, ChatRoomCreateSerializer
+    ChatMessageSerializer, ChatMessageCreateSerializer, ChatMessageSearchSerializer,
+    ChatRoomSerializer, ChatRoomCreateSerializer, ChatRoomFilterSerializer, ChatRoomBatchCreateSerializer,
+    ChatBroadcastSerializer, ChatBroadcastCreateSerializer
 )
-from main.models import Unit, Service, Sell
+from .consumers import BROADCAST_CHANNEL, channel_layer_is_shared, serialize_message
+from .archive import archived_messages
+from .assignment import adjust_backlog, pick_admin, plan_assignments, reset_load
+from .search import search_messages, page_after, encode_cursor
+from users.models import CustomUser
 
 class ChatRoomListView(generics.ListAPIView):
     serializer_class = ChatRoomSerializer
@@ -17,10 +26,30 @@ class ChatRoomListView(generics.ListAPIView):
     
     def get_queryset(self):
         user = self.request.user
+        filters = ChatRoomFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        filters = filters.validated_data
+        
         if user.is_staff:
-            return ChatRoom.objects.filter(admin=user, is_active=True).order_by('-updated_at')
+            rooms = ChatRoom.objects.filter(admin=user)
         else:
-            return ChatRoom.objects.filter(user=user, is_active=True).order_by('-updated_at')
+            rooms = ChatRoom.objects.filter(user=user)
+        
+        if filters['is_active'] != 'all':
+            rooms = rooms.filter(is_active=filters['is_active'] == 'true')
+        if filters.get('related_type'):
+            rooms = rooms.related_to(filters['related_type'])
+        if filters.get('q'):
+            rooms = rooms.filter(subject__icontains=filters['q'])
+        
+        rooms = rooms.with_unread_count(user)
+        if filters['unread_only']:
+            rooms = rooms.unread_only(user)
+        
+        return (
+            rooms.select_related('user', 'admin', 'content_type')
+            .prefetch_related('content_object')
+        )
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -33,44 +62,37 @@ class ChatRoomCreateView(APIView):
     def post(self, request):
         serializer = ChatRoomCreateSerializer(data=request.data)
         if serializer.is_valid():
-            from users.models import CustomUser
-            
-            user_id = serializer.validated_data['user_id']
+            user = serializer.validated_data['user']
             subject = serializer.validated_data['subject']
-            related_type = serializer.validated_data.get('related_type')
             related_id = serializer.validated_data.get('related_id')
+            content_object = serializer.validated_data['content_object']
             
-            user = CustomUser.objects.get(id=user_id)
-            
-            content_type = None
-            content_object = None
-            
-            if related_type and related_id:
-                if related_type == 'unit':
-                    content_type = ContentType.objects.get_for_model(Unit)
-                    content_object = Unit.objects.get(id=related_id)
-                elif related_type == 'service':
-                    content_type = ContentType.objects.get_for_model(Service)
-                    content_object = Service.objects.get(id=related_id)
-                elif related_type == 'sell':
-                    content_type = ContentType.objects.get_for_model(Sell)
-                    content_object = Sell.objects.get(id=related_id)
+            content_type = ContentType.objects.get_for_model(content_object) if content_object else None
+            admin_id = request.user.id
+            if serializer.validated_data['auto_assign']:
+                admin_id = pick_admin() or admin_id
             
             chat_room, created = ChatRoom.objects.get_or_create(
                 user=user,
                 content_type=content_type,
                 object_id=related_id,
                 defaults={
-                    'admin': request.user,
+                    'admin_id': admin_id,
                     'subject': subject,
                 }
             )
             
             if not created:
-                chat_room.admin = request.user
+                previous = (chat_room.admin_id, chat_room.is_active)
+                chat_room.admin_id = admin_id
                 chat_room.subject = subject
                 chat_room.is_active = True
                 chat_room.save()
+                if previous != (admin_id, True):
+                    reset_load({previous[0], admin_id})
+            
+            if content_object is not None:
+                chat_room.content_object = content_object
             
             return Response({
                 'message': 'Chat room created successfully' if created else 'Chat room already exists',
@@ -79,6 +101,70 @@ class ChatRoomCreateView(APIView):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class ChatRoomBatchCreateView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def post(self, request):
+        serializer = ChatRoomBatchCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        entries = {}
+        for entry in serializer.validated_data['rooms']:
+            related_type = entry.get('related_type')
+            content_type_id = ContentType.objects.get_for_model(RELATED_MODELS[related_type]).id if related_type else None
+            entries[(entry['user_id'], content_type_id, entry.get('related_id'))] = entry['subject']
+        
+        plan = {}
+        if serializer.validated_data['auto_assign']:
+            plan = plan_assignments([(key, 0) for key in entries])
+        
+        now = timezone.now()
+        existing = {
+            (room.user_id, room.content_type_id, room.object_id): room
+            for room in ChatRoom.objects.filter(user_id__in={key[0] for key in entries})
+        }
+        
+        to_update = []
+        to_create = []
+        affected_admins = set(plan.values()) | {request.user.id}
+        for key, subject in entries.items():
+            admin_id = plan.get(key, request.user.id)
+            room = existing.get(key)
+            if room is None:
+                to_create.append(ChatRoom(
+                    user_id=key[0], content_type_id=key[1], object_id=key[2],
+                    admin_id=admin_id, subject=subject, last_message_at=now
+                ))
+            else:
+                affected_admins.add(room.admin_id)
+                room.admin_id = admin_id
+                room.subject = subject
+                room.is_active = True
+                room.updated_at = now
+                to_update.append(room)
+        
+        with transaction.atomic():
+            ChatRoom.objects.bulk_update(to_update, ['admin', 'subject', 'is_active', 'updated_at'])
+            # Rooms with a content type can still collide with a concurrent request; rooms
+            # without one cannot conflict in the database because NULLs are distinct.
+            ChatRoom.objects.bulk_create(
+                to_create,
+                update_conflicts=True,
+                unique_fields=['user', 'content_type', 'object_id'],
+                update_fields=['admin', 'subject', 'is_active', 'updated_at'],
+            )
+        # Bulk writes skip the model signals that keep the load counters live.
+        reset_load(affected_admins)
+        
+        return Response({
+            'message': f'{len(to_create)} chat rooms created, {len(to_update)} updated',
+            'data': {
+                'created': [room.id for room in to_create],
+                'updated': [room.id for room in to_update]
+            }
+        }, status=status.HTTP_201_CREATED if to_create else status.HTTP_200_OK)
+
 class ChatRoomDetailView(APIView):
     permission_classes = [IsAuthenticated]
     
@@ -105,6 +191,7 @@ class ChatRoomDetailView(APIView):
             if is_active is not None:
                 chat_room.is_active = is_active
                 chat_room.save()
+                reset_load([chat_room.admin_id])
             
             return Response({
                 'message': 'Chat room updated successfully',
@@ -131,10 +218,95 @@ class ChatMessageListView(generics.ListAPIView):
             else:
                 chat_room = ChatRoom.objects.get(id=chat_room_id, user=user)
             
-            return chat_room.messages.all().order_by('timestamp')
+            return chat_room.messages.with_read_state().order_by('timestamp')
         except ChatRoom.DoesNotExist:
             return ChatMessage.objects.none()
 
+class ChatHistoryView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, pk):
+        user = request.user
+        try:
+            if user.is_staff:
+                chat_room = ChatRoom.objects.get(pk=pk, admin=user)
+            else:
+                chat_room = ChatRoom.objects.get(pk=pk, user=user)
+        except ChatRoom.DoesNotExist:
+            return Response({'error': 'Chat room not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            before = request.query_params.get('before')
+            before = int(before) if before else None
+            limit = min(int(request.query_params.get('limit', 50)), 100)
+        except ValueError:
+            return Response({'error': 'before and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        messages = chat_room.messages.with_read_state().select_related('sender').order_by('-id')
+        if before:
+            messages = messages.filter(pk__lt=before)
+        messages = list(reversed(messages[:limit]))
+        
+        if len(messages) < limit and chat_room.archived_through_id:
+            archive_before = chat_room.archived_through_id + 1
+            if messages:
+                archive_before = min(archive_before, messages[0].id)
+            if before:
+                archive_before = min(archive_before, before)
+            messages = self.load_archived(chat_room, archive_before, limit - len(messages)) + messages
+        
+        return Response({
+            'room_id': chat_room.id,
+            'messages': [serialize_message(msg, msg.sender) for msg in messages],
+            'next_before': messages[0].id if len(messages) == limit else None
+        }, status=status.HTTP_200_OK)
+    
+    def load_archived(self, chat_room, before, limit):
+        messages = archived_messages(chat_room.id, before, limit)
+        senders = CustomUser.objects.in_bulk({msg.sender_id for msg in messages})
+        cursors = dict(chat_room.read_cursors.values_list('user_id', 'last_read_message_id'))
+        
+        archived = []
+        for msg in messages:
+            if msg.sender_id not in senders:
+                continue
+            msg.sender = senders[msg.sender_id]
+            msg.is_read = any(
+                last_read >= msg.id for user_id, last_read in cursors.items() if user_id != msg.sender_id
+            )
+            archived.append(msg)
+        return archived
+
+class ChatMessageSearchView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Please provide a search query using the "q" parameter'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        messages = search_messages(
+            ChatMessage.objects.filter(chat_room__admin=request.user).select_related('sender'),
+            query
+        )
+        try:
+            messages = list(page_after(messages, request.query_params.get('cursor'))[:limit + 1])
+        except ValueError:
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        
+        return Response({
+            'next': encode_cursor(messages[-1]) if has_more else None,
+            'results': ChatMessageSearchSerializer(messages, many=True).data
+        }, status=status.HTTP_200_OK)
+
 class ChatMessageCreateView(generics.CreateAPIView):
     serializer_class = ChatMessageCreateSerializer
     permission_classes = [IsAuthenticated]
@@ -156,12 +328,21 @@ class MarkMessagesReadView(APIView):
         
         try:
             if user.is_staff:
-                chat_room = ChatRoom.objects.get(id=chat_room_id, admin=user)
+                rooms = ChatRoom.objects.filter(admin=user)
             else:
-                chat_room = ChatRoom.objects.get(id=chat_room_id, user=user)
+                rooms = ChatRoom.objects.filter(user=user)
             
-            messages = chat_room.messages.filter(is_read=False).exclude(sender=user)
-            count = messages.update(is_read=True)
+            # The newest message and the unread count between the old cursor
+            # and it come from the (chat_room, id) index in the same query.
+            last_message = ChatMessage.objects.filter(chat_room=OuterRef('pk')).order_by('-id').values('id')[:1]
+            chat_room = rooms.with_unread_count(user).annotate(last_message_id=Subquery(last_message)).get(id=chat_room_id)
+            count = 0
+            
+            if chat_room.last_message_id and chat_room.last_message_id > chat_room.last_read_id:
+                if ChatReadCursor.advance(user.id, chat_room.id, chat_room.last_message_id):
+                    count = chat_room.unread_count
+                if count and chat_room.admin_id == user.id and chat_room.is_active:
+                    adjust_backlog(user.id, -count)
             
             return Response({
                 'message': f'{count} messages marked as read'
@@ -182,10 +363,53 @@ class UnreadMessageCountView(APIView):
         else:
             chat_rooms = ChatRoom.objects.filter(user=user, is_active=True)
         
-        unread_count = 0
-        for chat_room in chat_rooms:
-            unread_count += chat_room.messages.filter(is_read=False).exclude(sender=user).count()
+        unread_count = chat_rooms.with_unread_count(user).aggregate(total=Sum('unread_count'))['total'] or 0
         
         return Response({
             'unread_count': unread_count
         }, status=status.HTTP_200_OK)
+
+
+class ChatBroadcastView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        broadcasts = ChatBroadcast.objects.filter(admin=request.user)[:20]
+        return Response(ChatBroadcastSerializer(broadcasts, many=True).data, status=status.HTTP_200_OK)
+    
+    def post(self, request):
+        serializer = ChatBroadcastCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        filters = {key: value for key, value in serializer.validated_data.items() if key != 'message' and value}
+        broadcast = ChatBroadcast(admin=request.user, message=serializer.validated_data['message'], filters=filters)
+        broadcast.total_rooms = broadcast.get_rooms().count()
+        
+        if not broadcast.total_rooms:
+            return Response({'error': 'No chat rooms match the given filters'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        broadcast.save()
+        channel_layer = get_channel_layer()
+        # Without a shared layer no worker can receive the job. It stays
+        # pending until requeue_broadcasts runs it.
+        if channel_layer_is_shared(channel_layer):
+            async_to_sync(channel_layer.send)(BROADCAST_CHANNEL, {
+                'type': 'broadcast.run',
+                'broadcast_id': broadcast.id,
+            })
+        
+        return Response({
+            'message': f'Broadcast queued for {broadcast.total_rooms} chat rooms',
+            'data': ChatBroadcastSerializer(broadcast).data
+        }, status=status.HTTP_202_ACCEPTED)
+
+class ChatBroadcastDetailView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request, pk):
+        try:
+            broadcast = ChatBroadcast.objects.get(pk=pk, admin=request.user)
+            return Response(ChatBroadcastSerializer(broadcast).data, status=status.HTTP_200_OK)
+        except ChatBroadcast.DoesNotExist:
+            return Response({'error': 'Broadcast not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,81 @@
+import asyncio
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+MISSING_USER = 0
+
+_pending_lookups = {}
+
+
+def user_cache_key(user_id):
+    return f'ws_user_{user_id}'
+
+
+def get_token(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0] in api_settings.AUTH_HEADER_TYPES:
+                return parts[1]
+
+    tokens = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    return tokens[0] if tokens else None
+
+
+def load_user(user_id):
+    User = get_user_model()
+    user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id, 'is_active': True}).first()
+    cache.set(user_cache_key(user_id), user or MISSING_USER, settings.WS_USER_CACHE_TTL)
+    return user
+
+
+async def resolve_user(user_id):
+    user = await sync_to_async(cache.get, thread_sensitive=False)(user_cache_key(user_id))
+    if user is None:
+        lookup = _pending_lookups.get(user_id)
+        if lookup is None:
+            lookup = asyncio.ensure_future(database_sync_to_async(load_user)(user_id))
+            _pending_lookups[user_id] = lookup
+            lookup.add_done_callback(lambda _: _pending_lookups.pop(user_id, None))
+        user = await asyncio.shield(lookup)
+    return user or AnonymousUser()
+
+
+async def get_user_from_token(raw_token):
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return AnonymousUser()
+
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    if user_id is None:
+        return AnonymousUser()
+    return await resolve_user(user_id)
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    def __init__(self, inner):
+        super().__init__(inner)
+        self.session_inner = AuthMiddlewareStack(inner)
+
+    async def __call__(self, scope, receive, send):
+        raw_token = get_token(scope)
+        if raw_token is None:
+            return await self.session_inner(scope, receive, send)
+
+        scope = dict(scope, user=await get_user_from_token(raw_token))
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
@@ -0,0 +1,10 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import CustomUser
+from .middleware import user_cache_key
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidate_ws_user_cache(sender, instance, **kwargs):
+    cache.delete(user_cache_key(instance.pk))
@@ -1,3 +1,57 @@
-from django.test import TestCase
+import asyncio
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from chats.routing import websocket_urlpatterns
+from .middleware import JWTAuthMiddlewareStack, resolve_user, user_cache_key
+from .models import CustomUser
 
 
+class JWTSocketAuthTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        async_to_sync(get_channel_layer().flush)()
+        self.user = CustomUser.objects.create_user('user@example.com', 'Uma', 'User', 'password', is_active=True)
+        self.token = str(AccessToken.for_user(self.user))
+        self.application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+    def connects(self, path, headers=None):
+        async def main():
+            communicator = WebsocketCommunicator(self.application, path, headers=headers or [])
+            connected, _ = await communicator.connect()
+            if connected:
+                await communicator.disconnect()
+            return connected
+
+        return asyncio.run(main())
+
+    def test_token_in_query_string_or_header(self):
+        self.assertTrue(self.connects(f'/ws/chat/?token={self.token}'))
+        self.assertTrue(self.connects('/ws/chat/', [(b'authorization', f'Bearer {self.token}'.encode())]))
+        self.assertFalse(self.connects('/ws/chat/?token=garbage'))
+        self.assertFalse(self.connects('/ws/chat/'))
+
+    def test_user_is_cached_until_saved(self):
+        self.assertTrue(self.connects(f'/ws/chat/?token={self.token}'))
+        self.assertEqual(cache.get(user_cache_key(self.user.id)), self.user)
+
+        # A queryset update skips the signal, so the cached user is still used.
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertTrue(self.connects(f'/ws/chat/?token={self.token}'))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+        self.assertFalse(self.connects(f'/ws/chat/?token={self.token}'))
+
+    def test_concurrent_lookups_share_one_query(self):
+        async def main():
+            return await asyncio.gather(*[resolve_user(self.user.id) for _ in range(20)])
+
+        users = asyncio.run(main())
+        self.assertEqual(len({id(user) for user in users}), 1)
+        self.assertEqual(users[0], self.user)